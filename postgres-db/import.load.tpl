@@ -11,4 +11,6 @@ CAST
 
 WITH include drop, create tables, create indexes, reset sequences
 
-SET work_mem to '16MB', maintenance_work_mem to '512MB';
+SET work_mem to '16MB', maintenance_work_mem to '512MB'
+
+EXCLUDING TABLE NAMES LIKE '_migration_state';
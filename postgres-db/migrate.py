@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
 import os
-import sys
+import queue
+import re
 import sqlite3
-from typing import List, Dict, Optional, Set, Tuple, Any, NoReturn, Generator
+import sys
+import threading
+import time
+from bisect import bisect_right
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Iterable, Optional, Tuple, Any, NoReturn, Callable
 from datetime import datetime, timezone
 import psycopg2
 
 BACKUP_DIR = "/backup"
 SQLITE_FILE = f"{BACKUP_DIR}/_backup_database-sql-lite.db"
 
+# Уникальные ограничения вынесены в INDEX_SQL: индексы строятся один раз после загрузки, а не на каждую вставку
 SCHEMA_SQL: Dict[str, str] = {
     "user": """
     CREATE TABLE "user" (
         "id" TEXT NOT NULL PRIMARY KEY,
         "username" TEXT NOT NULL DEFAULT '',
-        "email" TEXT UNIQUE,
+        "email" TEXT,
         "isemailconfirmed" BOOLEAN NOT NULL DEFAULT 1,
         "password" TEXT,
         "role" TEXT NOT NULL DEFAULT 'USER',
@@ -45,12 +55,65 @@ SCHEMA_SQL: Dict[str, str] = {
     """,
 }
 
+INDEX_SQL: Dict[str, List[str]] = {
+    "user": ['CREATE UNIQUE INDEX "user_email_key" ON "user" ("email")'],
+}
+
 DATETIME_COLUMNS: Dict[str, List[str]] = {
     "user": ["createdat", "updatedat"],
     "petitiondata": ["createdat", "updatedat"],
     "yieldrow": ["createdat", "updatedat"],
 }
 
+# Таблицы со ссылкой authorid → "user"; ссылки на несуществующих авторов обнуляются при чтении
+AUTHOR_TABLES = ("yieldrow", "petitiondata")
+
+# Массовая загрузка: без fsync, файл всё равно собирается заново во временном файле. Журнал в памяти
+# (не OFF): без него ROLLBACK TO batch в insert_rows ничего не откатывает и построчный повтор ловит ложные ошибки
+SQLITE_BULK_PRAGMAS = (
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA foreign_keys = OFF",
+)
+
+# Инкрементальный режим правит существующую копию на месте — журнал нужен, чтобы сбой не испортил файл
+SQLITE_INCREMENTAL_PRAGMAS = (
+    "PRAGMA journal_mode = DELETE",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA foreign_keys = OFF",
+)
+
+# Отметка последней синхронизации: максимальный updatedat (мс) по каждой таблице.
+# Таблица служебная: import.load.tpl исключает её при восстановлении копии в PostgreSQL
+STATE_TABLE = "_migration_state"
+STATE_SQL = f"""
+CREATE TABLE IF NOT EXISTS "{STATE_TABLE}" (
+    "table" TEXT NOT NULL PRIMARY KEY,
+    "high_water" INTEGER,
+    "synced_at" INTEGER NOT NULL
+)
+"""
+
+# Запас назад от отметки: строки, закоммиченные позже, но с более ранним updatedat, попадут в следующую дельту
+DEFAULT_LOOKBACK_SECONDS = 300
+
+PG_TIMESTAMP_TYPES = ("timestamp without time zone", "timestamp with time zone", "date")
+
+BATCH_SIZE = 5000
+
+# Проверка копии: строк на диапазон ключа и сколько расходящихся диапазонов печатать на таблицу
+VERIFY_CHUNK_ROWS = 10000
+VERIFY_MAX_REPORTED = 20
+
+
+class MigrationError(Exception):
+    """Копия неполна (таблица не прочитана целиком) — транзакция SQLite откатывается"""
+
 
 def to_unix_millis(value: Any) -> Optional[int]:
     """Преобразует datetime/строку/число в UNIX timestamp (мс) в UTC."""
@@ -77,174 +140,830 @@ def to_unix_millis(value: Any) -> Optional[int]:
     return None
 
 
-def recreate_table(sqlite_conn: sqlite3.Connection, table: str, create_sql: str) -> None:
-    cursor = sqlite_conn.cursor()
-    cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
-    print(f"[INFO] Удалена старая таблица: {table}")
+# ---------- Текстовый формат COPY ----------
+
+_COPY_ESCAPE_RE = re.compile(r"\\(?:([0-7]{1,3})|x([0-9A-Fa-f]{1,2})|(.))", re.DOTALL)
+_COPY_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+
+def _unescape_match(match: "re.Match") -> str:
+    octal, hexadecimal, char = match.groups()
+    if octal:
+        return chr(int(octal, 8))
+    if hexadecimal:
+        return chr(int(hexadecimal, 16))
+    return _COPY_ESCAPES.get(char, char)
 
-    cursor.execute(create_sql)
-    print(f"[INFO] Создана новая таблица: {table}")
 
+def parse_copy_lines(lines: List[str]) -> List[List[Optional[str]]]:
+    """
+    Строки текстового COPY → списки полей. Табуляции и переводы строк внутри значений
+    экранированы, поэтому split('\\t') безопасен; строки без '\\' (нет NULL и экранирования)
+    разбираются одним split без обхода полей.
+    """
+    rows: List[List[Optional[str]]] = []
+    append = rows.append
+    for line in lines:
+        fields = line.split("\t")
+        if "\\" in line:
+            fields = [
+                None if field == "\\N" else (_COPY_ESCAPE_RE.sub(_unescape_match, field) if "\\" in field else field)
+                for field in fields
+            ]
+        append(fields)
+    return rows
+
+
+class CopyBatcher:
+    """
+    Приёмник copy_expert: psycopg2 пишет в него поток COPY (по сообщению на строку),
+    он режет поток на строки и отдаёт батчи разобранных строк в on_batch.
+    """
+
+    def __init__(self, on_batch: Callable[[List[List[Optional[str]]]], None], batch_size: int = BATCH_SIZE):
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.rows = 0
+        self._chunks: List[bytes] = []
+        self._tail = b""
+
+    def write(self, data) -> int:
+        self._chunks.append(data if isinstance(data, bytes) else data.encode("utf-8"))
+        if len(self._chunks) >= self.batch_size:
+            self._flush()
+        return len(data)
+
+    def _flush(self, final: bool = False) -> None:
+        if not self._chunks:
+            return
+        data = self._tail + b"".join(self._chunks)
+        self._chunks.clear()
+        cut = len(data) if final else data.rfind(b"\n") + 1
+        self._tail = data[cut:]
+        lines = data[:cut].decode("utf-8").split("\n")
+        if lines and lines[-1] == "":
+            lines.pop()
+        if lines:
+            self.rows += len(lines)
+            self.on_batch(parse_copy_lines(lines))
+
+    def close(self) -> None:
+        self._chunks.append(b"")
+        self._flush(final=True)
+
+
+# ---------- SQLite ----------
 
 def create_tables(sqlite_conn: sqlite3.Connection) -> None:
-    """Создаёт таблицы SQLite согласно SCHEMA_SQL."""
-    with sqlite_conn:
-        for table, create_sql in SCHEMA_SQL.items():
-            recreate_table(sqlite_conn, table, create_sql)
+    """Создаёт таблицы SQLite согласно SCHEMA_SQL (внутри общей транзакции загрузки)."""
+    for table, create_sql in SCHEMA_SQL.items():
+        sqlite_conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        sqlite_conn.execute(create_sql)
+        print(f"[INFO] Создана таблица: {table}")
+    sqlite_conn.execute(STATE_SQL)
 
 
-def get_common_columns(pg_cursor, sqlite_conn: sqlite3.Connection, table: str) -> List[str]:
-    """Возвращает список общих колонок между PostgreSQL и SQLite для таблицы."""
-    columns = [desc[0] for desc in pg_cursor.description]
-    sqlite_columns_info = sqlite_conn.execute(f'PRAGMA table_info("{table}")').fetchall()
-    sqlite_columns = {col[1] for col in sqlite_columns_info}
+def create_indexes(sqlite_conn: sqlite3.Connection) -> None:
+    for table, statements in INDEX_SQL.items():
+        for statement in statements:
+            started = time.perf_counter()
+            sqlite_conn.execute(statement)
+            print(f"[INFO] Индекс для '{table}' построен за {time.perf_counter() - started:.2f} с")
 
-    # print(f"[DEBUG] Колонки PostgreSQL для '{table}': {columns}")
-    # print(f"[DEBUG] Колонки SQLite для '{table}': {list(sqlite_columns)}")
 
-    common_cols = [col for col in columns if col in sqlite_columns]
-    if not common_cols:
-        print(f"[WARNING] Нет общих колонок для таблицы '{table}', пропускаем миграцию.")
-    return common_cols
+def sqlite_columns(sqlite_conn: sqlite3.Connection, table: str) -> List[str]:
+    return [col[1] for col in sqlite_conn.execute(f'PRAGMA table_info("{table}")').fetchall()]
 
 
-def fetch_rows( pg_cursor: psycopg2.extensions.cursor, batch_size: int = 1000) -> Generator[List[Tuple[Any, ...]], None, None]:
-    """Генератор, который возвращает данные из PostgreSQL батчами."""
-    while True:
-        rows: List[Tuple[Any, ...]] = pg_cursor.fetchmany(batch_size)
-        if not rows:
-            break
-        yield rows
+def read_state(sqlite_conn: sqlite3.Connection) -> Optional[Dict[str, Optional[int]]]:
+    """Отметки прошлой синхронизации; None, если копия создана без них или схема таблиц не та"""
+    existing = {row[0] for row in sqlite_conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if STATE_TABLE not in existing or not set(SCHEMA_SQL) <= existing:
+        return None
+    state = dict(sqlite_conn.execute(f'SELECT "table", "high_water" FROM "{STATE_TABLE}"').fetchall())
+    return state if set(SCHEMA_SQL) <= set(state) else None
 
 
-def convert_row(row: tuple, columns: List[str], table: str) -> tuple:
-    row_dict = dict(zip(columns, row))
-    for col in DATETIME_COLUMNS.get(table, []):
-        if col in row_dict and row_dict[col] is not None:
-            row_dict[col] = to_unix_millis(row_dict[col])
-    return tuple(row_dict[c] for c in columns if c in row_dict)
+def save_state(sqlite_conn: sqlite3.Connection, skip: Iterable[str] = ()) -> None:
+    """
+    Новые отметки — максимальный updatedat уже скопированных строк. Таблицам из skip (часть строк
+    не вставлена) отметка не пишется: max(updatedat) ушёл бы дальше потерянных строк
+    """
+    now_ms = int(time.time() * 1000)
+    for table in SCHEMA_SQL:
+        if table in skip:
+            continue
+        high_water = None
+        if "updatedat" in sqlite_columns(sqlite_conn, table):
+            high_water = sqlite_conn.execute(f'SELECT max("updatedat") FROM "{table}"').fetchone()[0]
+        sqlite_conn.execute(
+            f'INSERT OR REPLACE INTO "{STATE_TABLE}" ("table", "high_water", "synced_at") VALUES (?, ?, ?)',
+            (table, high_water, now_ms),
+        )
 
 
-def migrate_table( pg_conn: psycopg2.extensions.connection,  sqlite_conn: sqlite3.Connection,  table: str, user_ids: Optional[Set[str]] = None) -> None:
-    print(f"\n[INFO] Миграция данных для таблицы '{table}'...")
+def null_orphan_authors(sqlite_conn: sqlite3.Connection) -> int:
+    """ON DELETE SET NULL для удалённых пользователей (внешние ключи SQLite при загрузке выключены)"""
+    nulled = 0
+    for table in AUTHOR_TABLES:
+        nulled += sqlite_conn.execute(
+            f'UPDATE "{table}" SET "authorid" = NULL WHERE "authorid" IS NOT NULL '
+            f'AND NOT EXISTS (SELECT 1 FROM "user" u WHERE u."id" = "{table}"."authorid")'
+        ).rowcount
+    return nulled
 
-    with pg_conn.cursor(f"{table}_cursor") as pg_cursor:
-        pg_cursor.execute(f'SELECT * FROM "{table}"')
 
-        first_rows: List[Tuple[Any, ...]] = pg_cursor.fetchmany(1)
-        if not first_rows:
-            print(f"[INFO] Нет данных для таблицы '{table}'.")
-            return
+# ---------- PostgreSQL ----------
 
-        pg_columns: List[str] = [desc[0] for desc in pg_cursor.description]
-
-        sqlite_columns_info: List[Tuple] = sqlite_conn.execute(f'PRAGMA table_info("{table}")').fetchall()
-        sqlite_columns: List[str] = [col[1] for col in sqlite_columns_info]
-
-        # print(f"[DEBUG] Колонки PostgreSQL для '{table}': {pg_columns}")
-        # print(f"[DEBUG] Колонки SQLite для '{table}': {sqlite_columns}")
-
-        common_columns: List[str] = [col for col in pg_columns if col in sqlite_columns]
-        placeholders: str = ", ".join(["?"] * len(common_columns))
-
-        insert_sql: str = f'INSERT INTO "{table}" ({", ".join(common_columns)}) VALUES ({placeholders})'
-        # print(f"[DEBUG] Строка INSERT для таблицы '{table}': {insert_sql}")
-
-        def filter_row(row_dict: Dict[str, Any]) -> Dict[str, Any]:
-            if user_ids is not None and table in ("yieldrow", "petitiondata"):
-                if row_dict.get("authorid") not in user_ids:
-                    row_dict["authorid"] = None
-            return row_dict
-
-        rows_migrated: int = 0
-        batch_rows: List[Tuple[Any, ...]] = []
-        columns: List[str] = pg_columns
-
-        # Добавляем первую строку с фильтрацией
-        for row in first_rows:
-            row_dict: Dict[str, Any] = dict(zip(columns, row))
-            row_dict = filter_row(row_dict)
-            for col in DATETIME_COLUMNS.get(table, []):
-                if col in row_dict and row_dict[col] is not None:
-                    row_dict[col] = to_unix_millis(row_dict[col])
-            batch_rows.append(tuple(row_dict[c] for c in common_columns))
-
-        # Обрабатываем остальные данные батчами
-        for rows_batch in fetch_rows(pg_cursor, batch_size=1000):
-            for row in rows_batch:
-                row_dict = dict(zip(columns, row))
-                row_dict = filter_row(row_dict)
-                for col in DATETIME_COLUMNS.get(table, []):
-                    if col in row_dict and row_dict[col] is not None:
-                        row_dict[col] = to_unix_millis(row_dict[col])
-                batch_rows.append(tuple(row_dict[c] for c in common_columns))
+def pg_columns(pg_conn: psycopg2.extensions.connection, schema: str, table: str) -> List[Tuple[str, str]]:
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position",
+            (schema, table),
+        )
+        return cur.fetchall()
 
-            try:
-                with sqlite_conn:
-                    sqlite_conn.executemany(insert_sql, batch_rows)
-                rows_migrated += len(batch_rows)
-            except sqlite3.IntegrityError as e:
-                print(f"[ERROR] Ошибка вставки в таблицу '{table}': {e}")
-                print(f"[ERROR] Пример проблемных данных: {batch_rows[:5]}")
-            batch_rows.clear()
-
-        # Вставляем остаток, если остался
-        if batch_rows:
-            try:
-                with sqlite_conn:
-                    sqlite_conn.executemany(insert_sql, batch_rows)
-                rows_migrated += len(batch_rows)
-            except sqlite3.IntegrityError as e:
-                print(f"[ERROR] Ошибка вставки в таблицу '{table}': {e}")
-                print(f"[ERROR] Пример проблемных данных: {batch_rows[:5]}")
 
-        print(f"[INFO] Вставлено строк: {rows_migrated} в таблицу '{table}'")
+class TablePlan:
+    """Что и как читать из таблицы PostgreSQL: выражения SELECT для COPY и преобразования на стороне Python."""
+
+    def __init__(self, table: str, schema: str, pg_cols: List[Tuple[str, str]], target_cols: List[str],
+                 since_ms: Optional[int] = None, upsert: bool = False, join_authors: bool = False):
+        self.table = table
+        self.schema = schema
+        types = dict(pg_cols)
+        self.columns = [name for name, _ in pg_cols if name in target_cols]
+        datetime_cols = set(DATETIME_COLUMNS.get(table, []))
+
+        # Ссылки на несуществующих авторов обнуляются в самом запросе: LEFT JOIN на user вместо
+        # множества id в памяти Python, поэтому таблицы не зависят друг от друга и грузятся параллельно
+        join = ""
+        if join_authors and "authorid" in self.columns:
+            join = f' LEFT JOIN "{schema}"."user" u ON u."id" = t."authorid"'
+
+        expressions = []
+        # Даты в текстовых колонках (не timestamp) переводятся в Python
+        self.python_datetime_idx: List[int] = []
+        for i, name in enumerate(self.columns):
+            quoted = f't."{name}"'
+            if name == "authorid" and join:
+                expressions.append('u."id"')
+            elif name in datetime_cols and types[name] in PG_TIMESTAMP_TYPES:
+                # Эпоха в мс считается в PostgreSQL; timestamp без зоны — как UTC, как и раньше
+                expressions.append(f"trunc(extract(epoch from {quoted}) * 1000)::bigint")
+            elif name in datetime_cols:
+                expressions.append(quoted)
+                self.python_datetime_idx.append(i)
+            elif types[name] == "boolean":
+                expressions.append(f"{quoted}::int")
+            else:
+                expressions.append(quoted)
+
+        # Порядок первичного ключа: вставки в индекс SQLite идут подряд, а не вразброс.
+        # COLLATE "C" — байтовый порядок, совпадающий с BINARY в SQLite
+        order = ""
+        if "id" in types:
+            order = ' ORDER BY t."id"' + (' COLLATE "C"' if types["id"] in ("text", "character varying") else "")
 
+        # Дельта: строки с updatedat не раньше отметки (сравнение в UTC — сессия читателя в UTC)
+        where = ""
+        if since_ms is not None and types.get("updatedat") in PG_TIMESTAMP_TYPES:
+            where = f' WHERE t."updatedat" >= to_timestamp({int(since_ms)} / 1000.0)'
+        self.incremental = bool(where)
+        self.copy_sql = (
+            f'COPY (SELECT {", ".join(expressions)} FROM "{schema}"."{table}" t{join}{where}{order}) TO STDOUT'
+        )
+        # Для контрольных сумм порядок не нужен — сортировка в PostgreSQL не выполняется
+        self.expressions = expressions
+        self.from_sql = f'"{schema}"."{table}" t{join}'
+        self.checksum_sql = f'COPY (SELECT {", ".join(expressions)} FROM {self.from_sql}) TO STDOUT'
+        self.keys_sql = f'COPY (SELECT t."id" FROM "{schema}"."{table}" t{order}) TO STDOUT' if "id" in types else None
 
-def migrate_data(pg_conn_str: str, sqlite_file: str) -> None:
+        quoted_columns = ", ".join(f'"{name}"' for name in self.columns)
+        self.insert_sql = (
+            f'INSERT INTO "{table}" ({quoted_columns}) '
+            f'VALUES ({", ".join("?" * len(self.columns))})'
+        )
+        if upsert and "id" in self.columns:
+            updates = ", ".join(f'"{name}" = excluded."{name}"' for name in self.columns if name != "id")
+            self.insert_sql += f' ON CONFLICT ("id") DO UPDATE SET {updates}' if updates else ' ON CONFLICT ("id") DO NOTHING'
+
+    def convert(self, rows: List[List[Optional[str]]]) -> List[List[Any]]:
+        """Преобразования, которые не сделал PostgreSQL: даты из текстовых колонок"""
+        for i in self.python_datetime_idx:
+            for row in rows:
+                if row[i] is not None:
+                    row[i] = to_unix_millis(row[i])
+        return rows
+
+
+# ---------- Миграция ----------
+
+_DONE = object()
+
+
+def copy_batches(pg_conn_str: str, copy_sql: str, on_batch: Callable[[List[List[Optional[str]]]], None]) -> None:
+    """COPY ... TO STDOUT в отдельном соединении, строки — батчами в on_batch"""
+    pg_conn = psycopg2.connect(pg_conn_str)
     try:
-        if os.path.exists(sqlite_file):
-            os.remove(sqlite_file)
-            print(f"[INFO] Удалён существующий файл SQLite: {os.path.abspath(sqlite_file)}")
+        pg_conn.set_client_encoding("UTF8")
+        batcher = CopyBatcher(on_batch)
+        with pg_conn.cursor() as cur:
+            # Границы дельты заданы в UTC, как и эпоха в мс
+            cur.execute("SET TIME ZONE 'UTC'")
+            cur.copy_expert(copy_sql, batcher)
+        batcher.close()
+    finally:
+        pg_conn.close()
 
-        print(f"[INFO] Файл SQLite будет создан по пути: {os.path.abspath(sqlite_file)}")
-        pg_conn: psycopg2.extensions.connection = psycopg2.connect(pg_conn_str)
-        sqlite_conn: sqlite3.Connection = sqlite3.connect(sqlite_file)
-        sqlite_conn.execute("PRAGMA foreign_keys = ON;")
 
-        create_tables(sqlite_conn)
+def read_table(pg_conn_str: str, plan: TablePlan, out: "queue.Queue", stop: threading.Event) -> None:
+    """
+    Поток-читатель: своё соединение PostgreSQL, поток COPY режется на батчи и уходит писателю SQLite.
+    Если другая таблица уже упала (stop), чтение прерывается — копия всё равно будет откачена.
+    """
+    def on_batch(rows: List[List[Optional[str]]]) -> None:
+        if stop.is_set():
+            raise MigrationError("чтение прервано")
+        out.put((plan, plan.convert(rows)))
+
+    try:
+        copy_batches(pg_conn_str, plan.copy_sql, on_batch)
+        out.put((plan, _DONE))
+    except Exception as e:
+        out.put((plan, e))
+
+
+def insert_rows(sqlite_conn: sqlite3.Connection, plan: TablePlan, rows: List[List[Any]]) -> int:
+    """Вставка батча; при нарушении ограничений — построчно, чтобы потерять только проблемные строки"""
+    sqlite_conn.execute("SAVEPOINT batch")
+    try:
+        sqlite_conn.executemany(plan.insert_sql, rows)
+        sqlite_conn.execute("RELEASE batch")
+        return len(rows)
+    except sqlite3.IntegrityError:
+        # Строки батча до ошибки уже вставлены — откатываем их и повторяем построчно
+        sqlite_conn.execute("ROLLBACK TO batch")
+        sqlite_conn.execute("RELEASE batch")
+    inserted = 0
+    for row in rows:
+        try:
+            sqlite_conn.execute(plan.insert_sql, row)
+            inserted += 1
+        except sqlite3.IntegrityError as e:
+            print(f"[ERROR] Ошибка вставки в таблицу '{plan.table}': {e}; строка: {row[:3]}", file=sys.stderr)
+    return inserted
+
 
-        # Начальный набор user_ids (после создания таблиц он пуст)
-        user_ids: Set[str] = {row[0] for row in sqlite_conn.execute('SELECT id FROM "user"')} if 'user' in SCHEMA_SQL else set()
+def migrate_tables(pg_conn_str: str, sqlite_conn: sqlite3.Connection,
+                   plans: List[TablePlan]) -> Dict[str, Tuple[int, float, int]]:
+    """
+    Параллельная миграция независимых таблиц: по потоку-читателю COPY на таблицу,
+    единственный писатель SQLite — текущий поток. Очередь ограничена, чтобы память не росла,
+    если SQLite не успевает. Возвращает (вставлено, секунд, отброшено строк) по таблицам.
+    Если хотя бы один читатель упал, остальные останавливаются и бросается MigrationError.
+    """
+    out: "queue.Queue" = queue.Queue(maxsize=8)
+    stop = threading.Event()
+    failed_table: Optional[str] = None
+    started = time.perf_counter()
+    stats: Dict[str, List[Any]] = {plan.table: [0, 0.0, 0] for plan in plans}
+    readers = [
+        threading.Thread(target=read_table, args=(pg_conn_str, plan, out, stop), name=f"copy-{plan.table}", daemon=True)
+        for plan in plans
+    ]
+    for reader in readers:
+        print(f"\n[INFO] Миграция данных для таблицы '{reader.name[5:]}'...")
+        reader.start()
 
-        table_list = ["user", "yieldrow", "petitiondata"]
+    remaining = len(readers)
+    while remaining:
+        plan, item = out.get()
+        if item is _DONE or isinstance(item, Exception):
+            remaining -= 1
+            stats[plan.table][1] = time.perf_counter() - started
+            if isinstance(item, Exception) and failed_table is None:
+                print(f"[ERROR] Ошибка при миграции таблицы '{plan.table}': {item}", file=sys.stderr)
+                failed_table = plan.table
+                stop.set()
+            continue
+        if failed_table is not None:
+            # Батчи, прочитанные до остановки, не вставляются
+            continue
+        inserted = insert_rows(sqlite_conn, plan, item)
+        stats[plan.table][0] += inserted
+        stats[plan.table][2] += len(item) - inserted
 
-        migrate_table(pg_conn, sqlite_conn, "user")
+    for reader in readers:
+        reader.join()
+    if failed_table is not None:
+        raise MigrationError(f"таблица '{failed_table}' прочитана не полностью")
+    for table, (rows, seconds, _) in stats.items():
+        print(f"[INFO] Вставлено строк: {rows} в таблицу '{table}' за {seconds:.2f} с ({rows / max(seconds, 1e-9):,.0f} строк/с)")
+    return {table: (rows, seconds, failed) for table, (rows, seconds, failed) in stats.items()}
 
-        # После миграции user читаем user_ids заново из SQLite
-        user_ids: Set[str] = {row[0] for row in sqlite_conn.execute('SELECT id FROM "user"')}
 
-        for table in (t for t in table_list if t != "user"):
+def sync_deletions(pg_conn: psycopg2.extensions.connection, pg_conn_str: str,
+                   sqlite_conn: sqlite3.Connection, plan: TablePlan) -> Tuple[int, int]:
+    """
+    Удаляет из копии строки, которых больше нет в PostgreSQL; возвращает (удалено, не хватает в копии).
+    Наборы ключей сравниваются по числу и сумме хэшей id (как в verify_backup), а не только по числу строк:
+    удаление и пропущенная вставка в одном окне дают то же число строк, но другую сумму. Совпали — ключи
+    не читаются. Иначе ключи источника потоком COPY ложатся во временную таблицу, и лишние строки удаляются
+    одним запросом; ключи, которых нет в копии (дельта их не захватила), только подсчитываются.
+    """
+    if plan.keys_sql is None or "id" not in plan.columns:
+        return 0, 0
+    key_text = row_text_sql(['t."id"'])
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            f"SELECT count(*), sum(('x' || substr(md5({key_text}), 1, 16))::bit(64)::bigint) "
+            f'FROM "{plan.schema}"."{plan.table}" t'
+        )
+        pg_count, pg_sum = cur.fetchone()
+    sqlite_conn.create_aggregate("hash_sum", -1, _HashSum)
+    sqlite_count, sqlite_sum = sqlite_conn.execute(f'SELECT count(*), hash_sum("id") FROM "{plan.table}"').fetchone()
+    if (pg_count, int(pg_sum or 0) & _HASH_MASK) == (sqlite_count, int(sqlite_sum or 0)):
+        return 0, 0
+
+    id_type = next(col[2] for col in sqlite_conn.execute(f'PRAGMA table_info("{plan.table}")') if col[1] == "id")
+    sqlite_conn.execute('DROP TABLE IF EXISTS temp."_pg_keys"')
+    sqlite_conn.execute(f'CREATE TEMP TABLE "_pg_keys" ("id" {id_type} NOT NULL PRIMARY KEY)')
+    copy_batches(pg_conn_str, plan.keys_sql,
+                 lambda rows: sqlite_conn.executemany('INSERT OR IGNORE INTO temp."_pg_keys" VALUES (?)', rows))
+    deleted = sqlite_conn.execute(
+        f'DELETE FROM "{plan.table}" WHERE NOT EXISTS '
+        f'(SELECT 1 FROM temp."_pg_keys" k WHERE k."id" = "{plan.table}"."id")'
+    ).rowcount
+    sqlite_conn.execute('DROP TABLE temp."_pg_keys"')
+    missing = pg_count - (sqlite_count - deleted)
+    print(f"[INFO] Удалено строк из '{plan.table}': {deleted} (источник: {pg_count}, копия: {sqlite_count})")
+    return deleted, missing
+
+
+def migrate_incremental(pg_conn_str: str, sqlite_file: str, schema: str = "public",
+                        lookback_seconds: float = DEFAULT_LOOKBACK_SECONDS) -> bool:
+    """
+    Дельта-синхронизация существующей копии: upsert строк с updatedat не раньше отметки прошлого запуска
+    (минус lookback_seconds), удаление исчезнувших строк по сравнению наборов ключей.
+    Возвращает False, если копии или отметок нет и нужна полная миграция. Если часть строк дельты
+    не вставилась (например, пользователи обменялись email и upsert нарушает user_email_key),
+    дельта откатывается целиком и тоже возвращается False — отметка не сдвигается за потерянные строки.
+    Так же поступает и с ключами источника, которых после дельты нет в копии.
+    """
+    if not os.path.exists(sqlite_file):
+        print("[INFO] Копии SQLite ещё нет — выполняется полная миграция")
+        return False
+    sqlite_conn: sqlite3.Connection = sqlite3.connect(sqlite_file, isolation_level=None)
+    try:
+        state = read_state(sqlite_conn)
+        if state is None:
+            print("[INFO] В копии нет отметок синхронизации — выполняется полная миграция")
+            return False
+
+        started = time.perf_counter()
+        for pragma in SQLITE_INCREMENTAL_PRAGMAS:
+            sqlite_conn.execute(pragma)
+        pg_conn: psycopg2.extensions.connection = psycopg2.connect(pg_conn_str)
+        try:
+            lookback_ms = int(lookback_seconds * 1000)
+            plans = {
+                table: TablePlan(
+                    table, schema, pg_columns(pg_conn, schema, table), sqlite_columns(sqlite_conn, table),
+                    since_ms=None if state.get(table) is None else max(0, state[table] - lookback_ms),
+                    upsert=True, join_authors=table in AUTHOR_TABLES,
+                )
+                for table in SCHEMA_SQL
+            }
+            for table, plan in plans.items():
+                mode = "дельта" if plan.incremental else "полностью"
+                print(f"[INFO] Таблица '{table}': {mode}" + (f", с отметки {state[table]}" if plan.incremental else ""))
+
+            sqlite_conn.execute("BEGIN")
             try:
-                migrate_table(pg_conn, sqlite_conn, table, user_ids=user_ids)
-            except psycopg2.Error as e:
-                print(f"[ERROR] Ошибка при миграции таблицы '{table}': {e}", file=sys.stderr)
-                continue
+                stats = migrate_tables(pg_conn_str, sqlite_conn, [plan for plan in plans.values() if plan.columns])
+                rejected = {table: failed for table, (_, _, failed) in stats.items() if failed}
+                if rejected:
+                    sqlite_conn.execute("ROLLBACK")
+                    print(f"[WARNING] Дельта не применена, отброшено строк: {rejected} — выполняется полная миграция",
+                          file=sys.stderr)
+                    return False
+                synced = {table: sync_deletions(pg_conn, pg_conn_str, sqlite_conn, plan) for table, plan in plans.items()}
+                missing = {table: count for table, (_, count) in synced.items() if count}
+                if missing:
+                    # Строки вне окна дельты (закоммичены позже lookback): отметка не должна уйти дальше них
+                    sqlite_conn.execute("ROLLBACK")
+                    print(f"[WARNING] Дельта не захватила строк: {missing} — выполняется полная миграция",
+                          file=sys.stderr)
+                    return False
+                deleted = {table: count for table, (count, _) in synced.items()}
+                # Удалённые или не вставленные пользователи: ссылки на них обнуляет SQLite, без id в памяти
+                if deleted["user"] or stats.get("user", (0, 0.0, 0))[2]:
+                    print(f"[INFO] Обнулено ссылок на отсутствующих пользователей: {null_orphan_authors(sqlite_conn)}")
 
-        sqlite_conn.commit()
+                save_state(sqlite_conn)
+                sqlite_conn.execute("COMMIT")
+            except BaseException:
+                # Копия остаётся в состоянии прошлой синхронизации, отметки не сдвигаются
+                sqlite_conn.execute("ROLLBACK")
+                raise
+        finally:
+            pg_conn.close()
+
+        changed = sum(rows for rows, _, _ in stats.values())
+        print(f"\n[INFO] Инкрементально: {changed} строк обновлено/добавлено, {sum(deleted.values())} удалено "
+              f"за {time.perf_counter() - started:.2f} с")
+        return True
+    finally:
         sqlite_conn.close()
 
+
+def migrate_data(pg_conn_str: str, sqlite_file: str, schema: str = "public", incremental: bool = False,
+                 lookback_seconds: float = DEFAULT_LOOKBACK_SECONDS) -> None:
+    try:
+        if incremental and migrate_incremental(pg_conn_str, sqlite_file, schema, lookback_seconds):
+            return
+
+        # Копия собирается во временном файле и заменяет прежнюю только целиком: при сбое старая остаётся
+        partial_file = f"{sqlite_file}.part"
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+
+        print(f"[INFO] Файл SQLite будет создан по пути: {os.path.abspath(sqlite_file)}")
+        started = time.perf_counter()
+        pg_conn: psycopg2.extensions.connection = psycopg2.connect(pg_conn_str)
+        # Явные транзакции: вся загрузка — одна транзакция SQLite
+        sqlite_conn: sqlite3.Connection = sqlite3.connect(partial_file, isolation_level=None)
+        for pragma in SQLITE_BULK_PRAGMAS:
+            sqlite_conn.execute(pragma)
+
+        sqlite_conn.execute("BEGIN")
+        create_tables(sqlite_conn)
+        plans = {
+            table: TablePlan(table, schema, pg_columns(pg_conn, schema, table), sqlite_columns(sqlite_conn, table),
+                             join_authors=table in AUTHOR_TABLES)
+            for table in SCHEMA_SQL
+        }
+        pg_conn.close()
+        for table, plan in plans.items():
+            if not plan.columns:
+                print(f"[WARNING] Нет общих колонок для таблицы '{table}', пропускаем миграцию.")
+
+        # Все таблицы грузятся одновременно: ссылки на несуществующих авторов обнулены в запросе (LEFT JOIN)
+        stats = migrate_tables(pg_conn_str, sqlite_conn, [plan for plan in plans.values() if plan.columns])
+        if stats.get("user", (0, 0.0, 0))[2]:
+            # Пользователи, не прошедшие вставку, — ссылки на них обнуляются уже в SQLite
+            print(f"[INFO] Обнулено ссылок на невставленных пользователей: {null_orphan_authors(sqlite_conn)}")
+
+        create_indexes(sqlite_conn)
+        rejected = [table for table, (_, _, failed) in stats.items() if failed]
+        if rejected:
+            print(f"[WARNING] Отметки синхронизации не сохранены для {rejected}: "
+                  "следующий --incremental выполнит полную миграцию", file=sys.stderr)
+        save_state(sqlite_conn, skip=rejected)
+        sqlite_conn.execute("COMMIT")
+
+        violations = sqlite_conn.execute("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            print(f"[WARNING] Нарушений внешних ключей: {len(violations)}", file=sys.stderr)
+        sqlite_conn.close()
+        os.replace(partial_file, sqlite_file)
+
+        total_rows = sum(rows for rows, _, _ in stats.values())
+        elapsed = time.perf_counter() - started
+        print(f"\n[INFO] Итого: {total_rows} строк за {elapsed:.2f} с ({total_rows / max(elapsed, 1e-9):,.0f} строк/с)")
+
     except psycopg2.Error as pg_err:
         print(f"[ERROR] Ошибка подключения к PostgreSQL: {pg_err}", file=sys.stderr)
         sys.exit(1)
     except sqlite3.Error as sqlite_err:
         print(f"[ERROR] Ошибка при работе с SQLite: {sqlite_err}", file=sys.stderr)
         sys.exit(1)
+    except MigrationError as migration_err:
+        print(f"[ERROR] Миграция прервана, изменения откачены: {migration_err}", file=sys.stderr)
+        sys.exit(1)
     finally:
         if 'pg_conn' in locals() and pg_conn:
             pg_conn.close()
         if 'sqlite_conn' in locals() and sqlite_conn:
             sqlite_conn.close()
+        # Недостроенная копия не должна остаться рядом с рабочей
+        if 'partial_file' in locals() and os.path.exists(partial_file):
+            os.remove(partial_file)
+
+
+# ---------- Проверка копии ----------
+
+_HASH_MASK = (1 << 64) - 1
+
+
+def row_text(values: List[Any]) -> str:
+    """
+    Текст строки для хэша: каждое значение с длиной ('abc' → '3:abc'), NULL — '-', через запятую.
+    Значения берутся в текстовом виде, поэтому 5 из SQLite и '5' из PostgreSQL совпадают.
+    В PostgreSQL тот же текст строит row_text_sql — суммы считаются прямо в базах.
+    """
+    parts = []
+    for value in values:
+        if value is None:
+            parts.append("-")
+        else:
+            text = str(value)
+            parts.append(f"{len(text)}:{text}")
+    return ",".join(parts)
+
+
+def row_text_sql(expressions: List[str]) -> str:
+    """row_text в SQL PostgreSQL"""
+    parts = []
+    for expression in expressions:
+        text = f"({expression})::text"
+        parts.append(f"coalesce(length({text}) || ':' || {text}, '-')")
+    return " || ',' || ".join(parts)
+
+
+def text_hash(text: str) -> int:
+    """Первые 64 бита md5 текста строки: md5 есть в PostgreSQL, в SQLite его считает агрегат _HashSum"""
+    return int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "big")
+
+
+class _HashSum:
+    """
+    Агрегат SQLite hash_sum(кол1, кол2, ...): сумма хэшей row_text mod 2^64. Текст строки собирается в Python —
+    так быстрее, чем конкатенацией в SQLite. Сумма возвращается текстом: в INTEGER SQLite она не помещается
+    """
+
+    def __init__(self) -> None:
+        self.total = 0
+
+    def step(self, *values: Any) -> None:
+        self.total = (self.total + text_hash(row_text(values))) & _HASH_MASK
+
+    def finalize(self) -> str:
+        return str(self.total)
+
+
+class RangeChecksums:
+    """
+    Порядконезависимые контрольные суммы по диапазонам ключа: число строк и сумма хэшей строк mod 2^64.
+    Диапазон i — [bounds[i-1], bounds[i]) (как width_bucket в PostgreSQL), крайние диапазоны открыты,
+    так что лишние ключи тоже учитываются.
+    """
+
+    def __init__(self, bounds: List[Any]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sums = [0] * (len(bounds) + 1)
+
+    def add(self, key: Any, values: List[Any]) -> None:
+        i = bisect_right(self.bounds, key) if self.bounds else 0
+        self.counts[i] += 1
+        self.sums[i] = (self.sums[i] + text_hash(row_text(values))) & _HASH_MASK
+
+    def set(self, i: int, count: int, total: int) -> None:
+        self.counts[i] = count
+        self.sums[i] = total & _HASH_MASK
+
+    def range_of(self, i: int) -> Tuple[Any, Any]:
+        return (self.bounds[i - 1] if i > 0 else None), (self.bounds[i] if i < len(self.bounds) else None)
+
+    def mismatches(self, other: "RangeChecksums") -> List[int]:
+        return [i for i in range(len(self.counts))
+                if (self.counts[i], self.sums[i]) != (other.counts[i], other.sums[i])]
+
+
+def key_bounds(sqlite_conn: sqlite3.Connection, table: str, chunk_rows: int) -> List[Any]:
+    """Границы диапазонов — каждый chunk_rows-й ключ копии (по индексу первичного ключа SQLite)"""
+    return [row[0] for row in sqlite_conn.execute(
+        f'SELECT "id" FROM (SELECT "id", row_number() OVER (ORDER BY "id") AS rn FROM "{table}") '
+        f'WHERE rn % ? = 0',
+        (chunk_rows,),
+    )]
+
+
+def pg_checksums(pg_conn_str: str, plan: TablePlan, bounds: List[Any], key_type: Callable[[str], Any]) -> RangeChecksums:
+    """
+    Суммы на стороне PostgreSQL одним запросом GROUP BY по номеру диапазона: строки не покидают сервер.
+    Текстовые ключи сравниваются как байты UTF-8 — тот же порядок, что BINARY в SQLite.
+    Таблицы с датами в текстовых колонках (их переводит Python) читаются потоком COPY, как при миграции.
+    """
+    checksums = RangeChecksums(bounds)
+    if plan.python_datetime_idx:
+        key_idx = plan.columns.index("id") if "id" in plan.columns else None
+
+        def on_batch(rows: List[List[Optional[str]]]) -> None:
+            for row in plan.convert(rows):
+                checksums.add(None if key_idx is None else key_type(row[key_idx]), row)
+
+        copy_batches(pg_conn_str, plan.checksum_sql, on_batch)
+        return checksums
+
+    bucket, params = "0", []
+    if "id" in plan.columns and bounds:
+        if key_type is int:
+            bucket, params = 'width_bucket(t."id", %s::bigint[])', [bounds]
+        else:
+            bucket = """width_bucket(convert_to(t."id"::text, 'UTF8'), %s::bytea[])"""
+            params = [[psycopg2.Binary(bound.encode("utf-8")) for bound in bounds]]
+    # Хэш — знаковый bigint, sum(bigint) — numeric без переполнения: по модулю 2^64 сумма та же, что у беззнаковых
+    query = (
+        f"SELECT {bucket}, count(*), "
+        f"sum(('x' || substr(md5({row_text_sql(plan.expressions)}), 1, 16))::bit(64)::bigint) "
+        f"FROM {plan.from_sql} GROUP BY 1"
+    )
+    pg_conn = psycopg2.connect(pg_conn_str)
+    try:
+        pg_conn.set_client_encoding("UTF8")
+        with pg_conn.cursor() as cur:
+            # Эпоха в мс — в UTC, как при миграции
+            cur.execute("SET TIME ZONE 'UTC'")
+            # Групп всего len(bounds) + 1, но планировщик этого не знает и сортирует все строки на диск
+            cur.execute("SET enable_sort = off")
+            cur.execute(query, params)
+            for i, count, total in cur:
+                checksums.set(i, count, int(total))
+    finally:
+        pg_conn.close()
+    return checksums
+
+
+def sqlite_checksums(sqlite_file: str, plan: TablePlan, bounds: List[Any]) -> RangeChecksums:
+    """
+    Суммы на стороне SQLite: по запросу на диапазон ключа (поиск по первичному ключу), соединение только для чтения.
+    Хэши считает Python, поэтому verify_backup запускает эту функцию в отдельном процессе на таблицу
+    """
+    checksums = RangeChecksums(bounds)
+    conn = sqlite3.connect(f"file:{sqlite_file}?mode=ro", uri=True)
+    try:
+        conn.create_aggregate("hash_sum", -1, _HashSum)
+        quoted_columns = ", ".join(f'"{name}"' for name in plan.columns)
+        query = f'SELECT count(*), hash_sum({quoted_columns}) FROM "{plan.table}"'
+        ranges: List[Tuple[str, Tuple[Any, ...]]] = [("", ())]
+        if "id" in plan.columns and bounds:
+            ranges = [(' WHERE "id" < ?', (bounds[0],))]
+            ranges += [(' WHERE "id" >= ? AND "id" < ?', (lower, upper)) for lower, upper in zip(bounds, bounds[1:])]
+            ranges.append((' WHERE "id" >= ?', (bounds[-1],)))
+        for i, (where, params) in enumerate(ranges):
+            count, total = conn.execute(query + where, params).fetchone()
+            # Для пустого диапазона агрегат не вызывается ни разу и SQLite возвращает NULL
+            checksums.set(i, count, int(total or 0))
+    finally:
+        conn.close()
+    return checksums
+
+
+def verify_backup(pg_conn_str: str, sqlite_file: str, schema: str = "public",
+                  columns: Optional[Dict[str, List[str]]] = None, chunk_rows: int = VERIFY_CHUNK_ROWS) -> bool:
+    """
+    Проверка копии без построчного сравнения: по каждой таблице считаются контрольные суммы диапазонов ключа
+    запросами в PostgreSQL и в SQLite, все таблицы и обе стороны — параллельно. Печатает расходящиеся диапазоны;
+    columns — проверяемые колонки по таблицам (по умолчанию все общие), ключ "id" добавляется всегда.
+    """
+    print("\n[INFO] Проверка копии по контрольным суммам...")
+    started = time.perf_counter()
+    try:
+        pg_conn: psycopg2.extensions.connection = psycopg2.connect(pg_conn_str)
+        sqlite_conn = sqlite3.connect(f"file:{sqlite_file}?mode=ro", uri=True)
+        try:
+            jobs = []
+            for table in SCHEMA_SQL:
+                available = sqlite_columns(sqlite_conn, table)
+                chosen = available
+                if columns and table in columns:
+                    missing = [name for name in columns[table] if name not in available]
+                    if missing:
+                        print(f"[WARNING] В таблице '{table}' нет колонок {missing}, они не проверяются")
+                    chosen = ["id"] + [name for name in columns[table] if name in available and name != "id"]
+                plan = TablePlan(table, schema, pg_columns(pg_conn, schema, table), chosen,
+                                 join_authors=table in AUTHOR_TABLES)
+                if not plan.columns:
+                    print(f"[WARNING] Нет общих колонок для таблицы '{table}', пропускаем проверку.")
+                    continue
+                bounds: List[Any] = []
+                key_type: Callable[[str], Any] = str
+                if "id" in plan.columns:
+                    bounds = key_bounds(sqlite_conn, table, chunk_rows)
+                    id_type = next(col[2] for col in sqlite_conn.execute(f'PRAGMA table_info("{table}")') if col[1] == "id")
+                    key_type = int if "INT" in id_type.upper() else str
+                jobs.append((plan, bounds, key_type))
+        finally:
+            pg_conn.close()
+            sqlite_conn.close()
+
+        # PostgreSQL считает сам — его ждут потоки; хэши SQLite считает Python — им нужны отдельные процессы
+        with ThreadPoolExecutor(max_workers=max(1, len(jobs))) as threads, \
+                ProcessPoolExecutor(max_workers=max(1, min(len(jobs), os.cpu_count() or 1)),
+                                    mp_context=multiprocessing.get_context("spawn")) as processes:
+            futures = [
+                (plan, threads.submit(pg_checksums, pg_conn_str, plan, bounds, key_type),
+                 processes.submit(sqlite_checksums, sqlite_file, plan, bounds))
+                for plan, bounds, key_type in jobs
+            ]
+            results = [(plan, source.result(), backup.result()) for plan, source, backup in futures]
+    except psycopg2.Error as pg_err:
+        print(f"[ERROR] Ошибка PostgreSQL при проверке: {pg_err}", file=sys.stderr)
+        return False
+    except sqlite3.Error as sqlite_err:
+        print(f"[ERROR] Ошибка SQLite при проверке: {sqlite_err}", file=sys.stderr)
+        return False
+    except Exception as err:
+        # Ошибки из потоков и процессов (в т.ч. BrokenProcessPool) — отчёт вместо трассировки
+        print(f"[ERROR] Проверка прервана: {type(err).__name__}: {err}", file=sys.stderr)
+        return False
+
+    ok = True
+    for plan, source, backup in results:
+        bad = source.mismatches(backup)
+        total = sum(source.counts)
+        if not bad:
+            print(f"[INFO] '{plan.table}': {total} строк, {len(source.counts)} диапазонов — совпадает")
+            continue
+        ok = False
+        print(f"[ERROR] '{plan.table}': расходятся {len(bad)} из {len(source.counts)} диапазонов "
+              f"(PostgreSQL: {total} строк, SQLite: {sum(backup.counts)})", file=sys.stderr)
+        for i in bad[:VERIFY_MAX_REPORTED]:
+            lower, upper = source.range_of(i)
+            print(f"[ERROR]   id в [{lower!r}, {upper!r}): PostgreSQL {source.counts[i]} строк, "
+                  f"SQLite {backup.counts[i]} строк", file=sys.stderr)
+        if len(bad) > VERIFY_MAX_REPORTED:
+            print(f"[ERROR]   ... и ещё {len(bad) - VERIFY_MAX_REPORTED} диапазонов", file=sys.stderr)
+
+    print(f"[INFO] Проверка {'пройдена' if ok else 'не пройдена'} за {time.perf_counter() - started:.2f} с")
+    return ok
+
+
+def parse_verify_columns(specs: Optional[List[str]]) -> Optional[Dict[str, List[str]]]:
+    """'таблица:кол1,кол2' → {таблица: [кол1, кол2]}"""
+    if not specs:
+        return None
+    columns: Dict[str, List[str]] = {}
+    for spec in specs:
+        table, _, names = spec.partition(":")
+        columns.setdefault(table, []).extend(name for name in names.split(",") if name)
+    return columns
+
+
+# ---------- Тестовые данные ----------
+
+def generate_dataset(pg_conn_str: str, schema: str, rows: int) -> None:
+    """
+    Синтетические таблицы в отдельной схеме для замера скорости: rows строк в petitiondata и yieldrow,
+    rows/10 пользователей. Около 1% ссылок authorid — на несуществующих пользователей,
+    часть текстов — с табуляциями, переводами строк и обратными слешами (проверка разбора COPY).
+    """
+    if schema == "public":
+        raise ValueError("Тестовые данные пишутся только в отдельную схему, не в public")
+    users = max(1, rows // 10)
+    pg_conn = psycopg2.connect(pg_conn_str)
+    started = time.perf_counter()
+    try:
+        with pg_conn, pg_conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+            cur.execute(f'CREATE SCHEMA "{schema}"')
+            cur.execute(f'SET search_path TO "{schema}"')
+            cur.execute("""
+                CREATE TABLE "user" (
+                    id text PRIMARY KEY, username text NOT NULL DEFAULT '', email text UNIQUE,
+                    isemailconfirmed boolean NOT NULL DEFAULT true, password text, role text NOT NULL DEFAULT 'USER',
+                    createdat timestamp(3) NOT NULL, updatedat timestamp(3) NOT NULL, tokenversion integer NOT NULL DEFAULT 0
+                );
+                CREATE TABLE petitiondata (
+                    id serial PRIMARY KEY, createdat timestamp(3) NOT NULL, updatedat timestamp(3) NOT NULL,
+                    authorid text, petition text NOT NULL
+                );
+                CREATE TABLE yieldrow (
+                    id text PRIMARY KEY, entity text NOT NULL DEFAULT '', createdat timestamp(3) NOT NULL,
+                    updatedat timestamp(3) NOT NULL, authorid text
+                );
+            """)
+            cur.execute("""
+                INSERT INTO "user"
+                SELECT md5(g::text), 'user ' || g, CASE WHEN mod(g, 50) = 0 THEN NULL ELSE 'user' || g || '@example.com' END,
+                       mod(g, 3) <> 0, md5('p' || g), CASE WHEN mod(g, 100) = 0 THEN 'ADMIN' ELSE 'USER' END,
+                       timestamp '2020-01-01' + g * interval '37 seconds', timestamp '2024-01-01' + g * interval '11 seconds',
+                       mod(g, 7)
+                FROM generate_series(1, %s) g
+            """, (users,))
+            cur.execute("""
+                INSERT INTO petitiondata (createdat, updatedat, authorid, petition)
+                SELECT timestamp '2021-01-01' + g * interval '13 seconds', timestamp '2024-06-01' + g * interval '3 seconds',
+                       CASE WHEN mod(g, 100) = 0 THEN 'missing-' || g WHEN mod(g, 40) = 0 THEN NULL ELSE md5((mod(g, %s) + 1)::text) END,
+                       CASE WHEN mod(g, 25) = 0 THEN E'Петиция\\t№' || g || E'\\nстрока\\\\2' ELSE 'Петиция №' || g || ' ' || repeat('текст ', mod(g, 20)) END
+                FROM generate_series(1, %s) g
+            """, (users, rows))
+            cur.execute("""
+                INSERT INTO yieldrow
+                SELECT 'y' || md5(g::text), 'entity-' || (mod(g, 1000)), timestamptz '2022-01-01 00:00:00+03' + g * interval '7 seconds',
+                       timestamp '2024-03-01' + g * interval '5 seconds',
+                       CASE WHEN mod(g, 100) = 0 THEN 'missing-' || g ELSE md5((mod(g, %s) + 1)::text) END
+                FROM generate_series(1, %s) g
+            """, (users, rows))
+            cur.execute(f'ANALYZE "{schema}"."user", "{schema}".petitiondata, "{schema}".yieldrow')
+    finally:
+        pg_conn.close()
+    print(f"[INFO] Сгенерировано в схеме '{schema}': {users} пользователей, по {rows} строк petitiondata и yieldrow "
+          f"за {time.perf_counter() - started:.1f} с")
 
 
 def show_counts_dynamic(sqlite_file: str, tables_dict: Dict[str, List[str]]) -> None:
@@ -253,7 +972,7 @@ def show_counts_dynamic(sqlite_file: str, tables_dict: Dict[str, List[str]]) ->
 
     queries = []
     for table in tables_dict.keys():
-        queries.append(f"SELECT '{table}' AS table_name, COUNT(*) AS row_count FROM {table}")
+        queries.append(f"SELECT '{table}' AS table_name, COUNT(*) AS row_count FROM \"{table}\"")
 
     full_query = " UNION ALL ".join(queries)
 
@@ -265,14 +984,47 @@ def show_counts_dynamic(sqlite_file: str, tables_dict: Dict[str, List[str]]) ->
 
 
 def main() -> NoReturn:
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
+    parser = argparse.ArgumentParser(description="Миграция PostgreSQL → SQLite")
+    parser.add_argument("--sqlite", default=SQLITE_FILE, help="файл SQLite (пересоздаётся)")
+    parser.add_argument("--schema", default="public", help="схема PostgreSQL с исходными таблицами")
+    parser.add_argument("--incremental", action="store_true",
+                        help="обновить существующую копию: только изменённые с прошлого запуска и удалённые строки")
+    parser.add_argument("--lookback-seconds", type=float, default=DEFAULT_LOOKBACK_SECONDS,
+                        help="запас назад от отметки updatedat в инкрементальном режиме")
+    parser.add_argument("--generate", type=int, metavar="N",
+                        help="перед миграцией создать тестовые данные (N строк) в --schema (не public)")
+    parser.add_argument("--verify", action="store_true",
+                        help="после миграции сверить копию с PostgreSQL по контрольным суммам диапазонов ключа")
+    parser.add_argument("--verify-only", action="store_true", help="только проверить существующую копию, без миграции")
+    parser.add_argument("--verify-columns", action="append", metavar="TABLE:COL,COL",
+                        help="проверяемые колонки таблицы (можно повторять); по умолчанию — все")
+    parser.add_argument("--verify-chunk-rows", type=int, default=VERIFY_CHUNK_ROWS,
+                        help="строк в одном диапазоне ключа при проверке")
+    args = parser.parse_args()
+
+    sqlite_dir = os.path.dirname(args.sqlite)
+    if sqlite_dir and not os.path.exists(sqlite_dir):
+        os.makedirs(sqlite_dir)
     pg_conn: Optional[str] = os.environ.get("PG_CONN")
     if not pg_conn:
         print("[ERROR] Не задана переменная окружения PG_CONN", file=sys.stderr)
         sys.exit(1)
-    migrate_data(pg_conn, SQLITE_FILE)
-    show_counts_dynamic(SQLITE_FILE, DATETIME_COLUMNS)
+    if args.generate:
+        try:
+            generate_dataset(pg_conn, args.schema, args.generate)
+        except (ValueError, psycopg2.Error) as e:
+            print(f"[ERROR] Не удалось сгенерировать тестовые данные: {e}", file=sys.stderr)
+            sys.exit(1)
+    if not args.verify_only:
+        migrate_data(pg_conn, args.sqlite, args.schema, incremental=args.incremental, lookback_seconds=args.lookback_seconds)
+        show_counts_dynamic(args.sqlite, DATETIME_COLUMNS)
+    if args.verify or args.verify_only:
+        if not os.path.exists(args.sqlite):
+            print(f"[ERROR] Файл SQLite не найден: {os.path.abspath(args.sqlite)}", file=sys.stderr)
+            sys.exit(1)
+        columns = parse_verify_columns(args.verify_columns)
+        if not verify_backup(pg_conn, args.sqlite, args.schema, columns, max(1, args.verify_chunk_rows)):
+            sys.exit(2)
 
     sys.exit(0)
 
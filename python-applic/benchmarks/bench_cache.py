@@ -0,0 +1,108 @@
+"""
+Бенчмарк кэша пайплайна: загрузка/сохранение списка задач (3450 строк таблицы)
+и результатов обработки в прежнем формате (json, indent=2) и в новых сериализаторах.
+
+Запуск из python-applic:
+    python -m benchmarks.bench_cache --tasks 3450
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from cache import HAS_MSGPACK, HAS_ORJSON, HAS_ZSTD, Cache, make_serializer
+
+
+class LegacyCache:
+    """Прежняя реализация Cache.set/get — эталон для сравнения."""
+
+    def __init__(self, base_path: str):
+        self.base_path = Path(base_path)
+
+    def set(self, key, value):
+        with open(self.base_path / f"{key}.json", "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False, indent=2)
+
+    def get(self, key):
+        with open(self.base_path / f"{key}.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def make_tasks(count: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    statuses = ["", "", "completed", "error", "in_progress"]
+    return [
+        {"status": rng.choice(statuses), "url": f"https://example-{rng.randint(0, 500)}.ru/blog/статья-{i}?utm={rng.random():.6f}"}
+        for i in range(count)
+    ]
+
+
+def make_results(tasks: list) -> dict:
+    results = {"success": [], "errors": [], "skipped": []}
+    for i, task in enumerate(tasks):
+        if i % 10 == 0:
+            results["errors"].append({"url": task["url"], "status": "error", "error": "Не удалось извлечь контент " * 3})
+        elif i % 25 == 0:
+            results["skipped"].append({"url": task["url"], "status": "skipped", "error": "Rate limit исчерпан"})
+        else:
+            results["success"].append({"url": task["url"], "status": "completed"})
+    return results
+
+
+def timeit(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=3450)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    tasks = make_tasks(args.tasks)
+    payloads = {"0_a_light_tasks": tasks, "0_b_light_processed_results": make_results(tasks)}
+
+    variants = [("json", False)]
+    if HAS_ORJSON:
+        variants.append(("orjson", False))
+    if HAS_MSGPACK:
+        variants.append(("msgpack", False))
+    if HAS_ZSTD:
+        variants += [(name, True) for name, _ in variants]
+
+    for key, value in payloads.items():
+        print(f"\n📦 {key}")
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy = LegacyCache(tmp)
+            legacy_set = timeit(lambda: legacy.set(key, value), args.repeat)
+            legacy_get = timeit(lambda: legacy.get(key), args.repeat)
+            size = (Path(tmp) / f"{key}.json").stat().st_size
+            print(f"  legacy json indent=2   set {legacy_set * 1000:7.2f} ms  get {legacy_get * 1000:7.2f} ms  {size / 1024:8.1f} KiB")
+
+        for name, compress in variants:
+            with tempfile.TemporaryDirectory() as tmp:
+                serializer = make_serializer(name, compress)
+                cache = Cache(tmp, serializer=serializer)
+                cold = Cache(tmp, serializer=serializer, memory=False)
+                cache_set = timeit(lambda: cache.set(key, value), args.repeat)
+                cold_get = timeit(lambda: cold.get(key), args.repeat)
+                warm_get = timeit(lambda: cache.get(key), args.repeat)
+                assert cold.get(key) == value and cache.get(key) == value
+                size = (Path(tmp) / f"{key}{serializer.suffix}").stat().st_size
+                label = name + ("+zstd" if compress else "")
+                print(
+                    f"  {label:<22} set {cache_set * 1000:7.2f} ms  get {cold_get * 1000:7.2f} ms"
+                    f" (память {warm_get * 1000:.3f} ms)  {size / 1024:8.1f} KiB"
+                    f"  ×{legacy_get / cold_get:.1f} чтение, ×{legacy_set / cache_set:.1f} запись"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Бенчмарк tools.extract_json на длинных ответах LLM (100 KB+).
+
+Запуск из python-applic:
+    python -m benchmarks.bench_extract_json --kb 200
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+from tools import JSONObjectLocator, extract_json
+
+
+def legacy_extract_json(text: str) -> dict:
+    """Прежняя реализация extract_json — эталон для сравнения."""
+    if not text or not isinstance(text, str):
+        return {}
+    text = text.strip()
+    patterns = [r'```json\s*(.*?)\s*```', r'```\s*(.*?)\s*```', r'(\{.*\})']
+    for pattern in patterns:
+        matches = re.findall(pattern, text, re.DOTALL)
+        for match in matches:
+            matches_sorted = sorted(matches, key=len, reverse=True)
+            for candidate in matches_sorted:
+                candidate = candidate.strip()
+                if candidate.startswith('{') and candidate.endswith('}'):
+                    try:
+                        return json.loads(candidate)
+                    except json.JSONDecodeError:
+                        continue
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return {}
+
+
+def make_responses(kb: int, seed: int = 42) -> tuple:
+    rng = random.Random(seed)
+    words = ['бренд', 'стратегия', 'маркетинг', 'design', 'content', 'аудитория']
+    prose = ' '.join(rng.choice(words) for _ in range(kb * 1024 // 8))
+    payload = {
+        "title": "SEO статья",
+        "sections": [{"h2": f"Раздел {i}", "text": ' '.join(rng.choice(words) for _ in range(40))} for i in range(kb * 3)],
+    }
+    body = json.dumps(payload, ensure_ascii=False)
+    # Много мелких код-блоков — худший случай для пересортировки matches в legacy
+    snippets = '\n'.join(f"```\nfn_{i}() {{ return {i}; }}\n```" for i in range(kb * 4))
+    # Невалидные JSON-подобные блоки без ```json: legacy пересортировывает и перебирает их для каждого совпадения
+    broken = '\n'.join(f'```\n{{"item": {i}, "draft": true,}}\n```' for i in range(kb * 3))
+    return payload, {
+        "broken_code_blocks": f"{broken}\n{body}",
+        "fenced_json": f"{prose[:2000]}\n```json\n{body}\n```\n{prose[:2000]}",
+        "prose_then_json": f"{prose}\n{body}",
+        "many_code_blocks": f"{snippets}\n```json\n{body}\n```",
+        # Незакрытые '{' в прозе: раньше каждая запускала повторное сканирование остатка текста
+        "stray_braces": f"{'{' * (kb * 200)}\n{'x { y ' * (kb * 50)}\n{body}",
+    }
+
+
+def timeit(func, *args, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def stream_extract(text: str, chunk_size: int = 64) -> list:
+    locator = JSONObjectLocator()
+    found = []
+    for i in range(0, len(text), chunk_size):
+        found.extend(locator.feed(text[i:i + chunk_size]))
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--kb', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    payload, responses = make_responses(args.kb)
+    for name, text in responses.items():
+        legacy = timeit(legacy_extract_json, text, repeat=args.repeat)
+        fast = timeit(extract_json, text, repeat=args.repeat)
+        streamed = timeit(stream_extract, text, repeat=args.repeat)
+        assert extract_json(text) == payload, f"{name}: extract_json не нашёл ответ"
+        assert payload in stream_extract(text), f"{name}: потоковый поиск не нашёл ответ"
+        legacy_ok = "ok" if legacy_extract_json(text) == payload else "MISS"
+        print(f"{name:18} {len(text) / 1024:6.0f} KB  legacy {legacy * 1000:9.1f} ms [{legacy_ok}]  "
+              f"extract_json {fast * 1000:6.1f} ms (x{legacy / fast:.1f})  feed(64) {streamed * 1000:6.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
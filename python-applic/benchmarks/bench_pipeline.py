@@ -0,0 +1,458 @@
+"""
+Сквозной бенчмарк LightPipeline.run на локальных заменах внешних сервисов:
+фикстурный веб-сервер отдаёт сохранённый HTML-корпус (--corpus, *.html) или сгенерированные статьи,
+таблица — SheetsEmulator, LLM — MockOpenRouter, векторная БД — FakeVectorStore в памяти.
+Задержка каждой замены настраивается; разбор, очистка, чанкование, TaskStore, журнал и синхронизация
+статусов работают по-настоящему.
+
+Отчёт: URL/мин, перцентили задержек по этапам, CPU и пиковый RSS. С --baseline прогон завершается
+с кодом 1, если пропускная способность упала больше чем на --max-regression.
+
+Запуск из python-applic:
+    python -m benchmarks.bench_pipeline --urls 200 --save-baseline benchmarks/pipeline_baseline.json
+    python -m benchmarks.bench_pipeline --urls 200 --baseline benchmarks/pipeline_baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import httpx  # type: ignore
+from prefect import flow  # type: ignore
+from prefect.task_runners import ConcurrentTaskRunner  # type: ignore
+
+from benchmarks.mock_openrouter import MockOpenRouter
+from light_pipeline import LightPipeline
+from services.extraction_pool import get_extraction_pool
+from services.google_sheets import GoogleSheetsService
+from services.sheets_emulator import SheetsEmulator
+from services.simple_scraper import SimpleScraperService
+from services.vector_ingestion_service import VectorIngestionService
+
+SPREADSHEET_ID = "bench"
+SHEET_NAME = "Main"
+
+PARAGRAPH_WORDS = (
+    "производительность конвейер страница статья обработка данные индекс запрос поиск текст "
+    "векторный модель результат задача таблица сервер ответ загрузка очистка разбор фрагмент"
+).split()
+
+
+# ---------- замеры этапов ----------
+
+class StageRecorder:
+    """Замеры этапов в JSONL-файл процесса: воркеры шардированного режима пишут каждый в свой файл."""
+
+    def __init__(self, directory: str):
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        self._file = open(path / f"stages-{os.getpid()}.jsonl", "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._file.write(json.dumps({"stage": stage, "seconds": seconds}) + "\n")
+            self._file.flush()
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+
+_recorders: Dict[str, StageRecorder] = {}
+
+
+def get_recorder(directory: str) -> StageRecorder:
+    if directory not in _recorders:
+        _recorders[directory] = StageRecorder(directory)
+    return _recorders[directory]
+
+
+def load_stages(directory: str) -> Dict[str, List[float]]:
+    stages: Dict[str, List[float]] = {}
+    for path in Path(directory).glob("stages-*.jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                stages.setdefault(item["stage"], []).append(item["seconds"])
+    return stages
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# ---------- фикстурный сайт ----------
+
+def make_article(i: int, rng: random.Random) -> bytes:
+    """Статья с навигацией и подвалом: основной текст ~5–8 тыс. символов."""
+    paragraphs = "\n".join(
+        "<p>" + " ".join(rng.choice(PARAGRAPH_WORDS) for _ in range(rng.randint(40, 70))).capitalize() + ".</p>"
+        for _ in range(rng.randint(12, 18))
+    )
+    return f"""<!DOCTYPE html>
+<html lang="ru"><head><meta charset="utf-8"><title>Статья {i}</title>
+<meta name="description" content="Тестовая статья {i}"><meta name="keywords" content="бенчмарк, статья"></head>
+<body><nav><a href="/">Главная</a> <a href="/blog">Блог</a> <a href="/contacts">Контакты</a></nav>
+<main><article><h1>Статья номер {i}</h1>
+{paragraphs}
+</article></main>
+<footer>© Бенчмарк. Все права защищены. <a href="/privacy">Политика конфиденциальности</a></footer>
+</body></html>""".encode("utf-8")
+
+
+def load_corpus(corpus_dir: Optional[str], size: int = 50, seed: int = 42) -> List[bytes]:
+    if corpus_dir:
+        pages = [path.read_bytes() for path in sorted(Path(corpus_dir).glob("*.html"))]
+        if not pages:
+            raise SystemExit(f"❌ В {corpus_dir} нет *.html")
+        return pages
+    rng = random.Random(seed)
+    return [make_article(i, rng) for i in range(size)]
+
+
+class FixtureSite:
+    """HTTP-сервер корпуса в фоновом потоке: /page-{i} отдаёт страницу i % len(corpus)."""
+
+    def __init__(self, corpus: List[bytes], host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.corpus = corpus
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):  # noqa: A002 — тихий режим
+                pass
+
+            def do_GET(self):
+                with site._lock:
+                    site.requests += 1
+                if site.latency:
+                    time.sleep(site.latency)
+
+                status, body = 404, b"not found"
+                if self.path.startswith("/page-") and self.path[6:].isdigit():
+                    status, body = 200, site.corpus[int(self.path[6:]) % len(site.corpus)]
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+    def start(self) -> "FixtureSite":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+
+# ---------- замены сервисов ----------
+
+class TimedSheetsEmulator(SheetsEmulator):
+    """Эмулятор таблицы с замером каждого вызова API (этапы sheets:<метод>)."""
+
+    def __init__(self, recorder: StageRecorder, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def _api_call(self, method: str, metric: str) -> None:
+        with self.recorder.span(f"sheets:{method}"):
+            super()._api_call(method, metric)
+
+
+class TimedExtractionPool:
+    """Обёртка пула извлечения: замер разбора и очистки HTML (этап extract)."""
+
+    def __init__(self, pool, recorder: StageRecorder):
+        self.pool = pool
+        self.recorder = recorder
+
+    async def extract_text(self, html, url: str) -> Dict[str, Any]:
+        with self.recorder.span("extract"):
+            return await self.pool.extract_text(html, url)
+
+
+class FixtureScraper(SimpleScraperService):
+    """SimpleScraperService без браузера: страница скачивается с фикстурного сервера, остальное — как в проде."""
+
+    def __init__(self, logger, recorder: StageRecorder, timeout: float = 30.0):
+        super().__init__(logger=logger, use_llm=True, llm_mode="streaming", js_delay=0.0)
+        self.recorder = recorder
+        self.timeout = timeout
+        # Клиент на event loop: создание httpx.AsyncClient (SSL-контекст) блокирует loop и искажает замеры
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self.extraction_pool = TimedExtractionPool(self.extraction_pool, recorder)
+        if self.llm_service:
+            extract = self.llm_service.extract_text_from_blocks
+
+            def timed_extract(*args, **kwargs):
+                with recorder.span("llm"):
+                    return extract(*args, **kwargs)
+
+            self.llm_service.extract_text_from_blocks = timed_extract
+
+    async def _crawl(self, url: str, use_llm: bool):
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            self._clients[loop] = httpx.AsyncClient(timeout=self.timeout)
+        with self.recorder.span("fetch"):
+            response = await self._clients[loop].get(url)
+        return SimpleNamespace(
+            html=response.text, success=response.is_success, status_code=response.status_code, extracted_content=None
+        )
+
+    def close(self) -> None:
+        pass
+
+
+class FakeVectorStore:
+    """Векторная БД в памяти: задержка запроса к БД и стоимость эмбеддинга на чанк (в потоке, как _prepare_rows)."""
+
+    def __init__(self, recorder: StageRecorder, latency: float = 0.02, embed_seconds: float = 0.005):
+        self.recorder = recorder
+        self.latency = latency
+        self.embed_seconds = embed_seconds
+        self.urls = set()
+        self.rows = 0
+
+    async def url_exists_async(self, url: str) -> bool:
+        with self.recorder.span("exists"):
+            await asyncio.sleep(self.latency)
+        return url in self.urls
+
+    async def add_chunks_async(self, chunks: List[Dict[str, Any]]) -> bool:
+        with self.recorder.span("embed"):
+            await asyncio.to_thread(time.sleep, self.embed_seconds * len(chunks))
+        with self.recorder.span("upsert"):
+            await asyncio.sleep(self.latency)
+        self.rows += len(chunks)
+        self.urls.update(chunk["metadata"]["url"] for chunk in chunks)
+        return True
+
+
+class TimedIngestion(VectorIngestionService):
+    """Полное время обработки одного URL (этап url)."""
+
+    def __init__(self, recorder: StageRecorder, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.recorder = recorder
+
+    async def ingest_url_async(self, task) -> bool:
+        with self.recorder.span("url"):
+            return await super().ingest_url_async(task)
+
+
+def bench_ingestion_factory(config: Dict[str, Any], spreadsheet_id: str, sheet_name: str, logger,
+                            task_store=None, sheets_service=None) -> VectorIngestionService:
+    """Фабрика для LightPipeline и воркеров (picklable через functools.partial)."""
+    recorder = get_recorder(config["stages_dir"])
+    return TimedIngestion(
+        recorder,
+        FakeVectorStore(recorder, config["db_latency"], config["embed_seconds"]),
+        sheets_service, spreadsheet_id, sheet_name, logger,
+        task_store=task_store, scraper=FixtureScraper(logger, recorder),
+    )
+
+
+@flow(name="bench_pipeline", task_runner=ConcurrentTaskRunner(), validate_parameters=False)
+def bench_flow(pipeline: LightPipeline) -> Dict[str, Any]:
+    start = time.perf_counter()
+    result = pipeline.run(SHEET_NAME)
+    return {"elapsed": time.perf_counter() - start, "stats": result["stats"], "processed": result["processed_results"]}
+
+
+# ---------- прогон и отчёт ----------
+
+def resource_usage() -> Dict[str, float]:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_self": own.ru_utime + own.ru_stime,
+        "cpu_children": children.ru_utime + children.ru_stime,
+        "max_rss_mb": own.ru_maxrss / 1024,
+        "max_child_rss_mb": children.ru_maxrss / 1024,
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    stages_dir = str(Path(workdir) / "stages")
+    corpus = load_corpus(args.corpus)
+    cwd = os.getcwd()
+    # TaskStore, журнал и кэш LLM пишут в pipeline_cache относительно рабочего каталога
+    os.chdir(workdir)
+    os.environ.update({
+        "GOOGLE_LIGHT_ID": SPREADSHEET_ID,
+        "OPENROUTER_API_KEY": "bench",
+        "LLM_CACHE_DISABLED": "1",
+        "EXTRACTION_WORKERS": str(args.extraction_workers),
+        "TASK_SYNC_INTERVAL": str(args.sync_interval),
+    })
+    try:
+        with FixtureSite(corpus, latency=args.fetch_latency) as site, \
+                MockOpenRouter(latency=args.llm_latency) as llm:
+            os.environ["OPENROUTER_BASE_URL"] = llm.base_url
+            recorder = get_recorder(stages_dir)
+            emulator = TimedSheetsEmulator(recorder, latency=args.sheets_latency, seed=42)
+            emulator.seed_tasks(SPREADSHEET_ID, SHEET_NAME, args.urls, url_template=f"{site.base_url}/page-{{i}}")
+
+            config = {"stages_dir": stages_dir, "db_latency": args.db_latency, "embed_seconds": args.embed_seconds}
+            pipeline = LightPipeline(
+                resume=False, workers=args.workers,
+                sheets_service=GoogleSheetsService(client=emulator.client()),
+                ingestion_factory=partial(bench_ingestion_factory, config),
+            )
+            before = resource_usage()
+            outcome = bench_flow(pipeline)
+            get_extraction_pool().shutdown()
+            after = resource_usage()
+            llm_requests = len(llm.requests)
+            sheet_calls = dict(emulator.calls)
+    finally:
+        os.chdir(cwd)
+
+    processed = outcome["processed"]
+    counts = processed.counts()
+    handled = counts["success"] + counts["errors"]
+    stages = load_stages(stages_dir)
+    if not args.keep_workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("baseline", "save_baseline", "output")},
+        "elapsed_seconds": outcome["elapsed"],
+        "urls_per_min": handled / outcome["elapsed"] * 60 if outcome["elapsed"] else 0.0,
+        "success": counts["success"],
+        "errors": counts["errors"],
+        "skipped": counts["skipped"],
+        "cpu_seconds": after["cpu_self"] - before["cpu_self"] + after["cpu_children"] - before["cpu_children"],
+        "max_rss_mb": after["max_rss_mb"],
+        "max_child_rss_mb": after["max_child_rss_mb"],
+        "llm_requests": llm_requests,
+        "sheet_calls": sheet_calls,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p90_ms": percentile(values, 90) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "total_s": sum(values),
+            }
+            for stage, values in sorted(stages.items())
+        },
+        "workdir": workdir if args.keep_workdir else None,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n📊 {report['success']} ok / {report['errors']} ошибок / {report['skipped']} пропущено "
+          f"за {report['elapsed_seconds']:.1f} с — {report['urls_per_min']:.1f} URL/мин")
+    print(f"   CPU {report['cpu_seconds']:.1f} с, RSS {report['max_rss_mb']:.0f} МБ "
+          f"(дочерние до {report['max_child_rss_mb']:.0f} МБ), запросов к LLM {report['llm_requests']}")
+    print(f"\n{'этап':<24}{'n':>7}{'p50, мс':>11}{'p90, мс':>11}{'p99, мс':>11}{'всего, с':>11}")
+    for stage, item in report["stages"].items():
+        print(f"{stage:<24}{item['count']:>7}{item['p50_ms']:>11.1f}{item['p90_ms']:>11.1f}"
+              f"{item['p99_ms']:>11.1f}{item['total_s']:>11.2f}")
+
+
+def check_baseline(report: Dict[str, Any], baseline_path: str, max_regression: float) -> bool:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    expected = baseline["urls_per_min"]
+    change = (report["urls_per_min"] - expected) / expected if expected else 0.0
+    print(f"\n📏 Базовая линия: {expected:.1f} URL/мин, сейчас {report['urls_per_min']:.1f} ({change:+.1%})")
+    for stage, item in report["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if old and old["p90_ms"]:
+            print(f"   {stage:<22} p90 {old['p90_ms']:.1f} → {item['p90_ms']:.1f} мс")
+    if change < -max_regression:
+        print(f"❌ Регрессия пропускной способности больше {max_regression:.0%}")
+        return False
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--corpus", help="каталог с сохранёнными *.html (по умолчанию — сгенерированные статьи)")
+    parser.add_argument("--fetch-latency", type=float, default=0.05)
+    parser.add_argument("--sheets-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--embed-seconds", type=float, default=0.005, help="стоимость эмбеддинга на чанк")
+    parser.add_argument("--extraction-workers", type=int, default=2)
+    parser.add_argument("--sync-interval", type=float, default=5.0, help="период выгрузки статусов в таблицу")
+    parser.add_argument("--output", help="JSON-отчёт")
+    parser.add_argument("--baseline", help="JSON-отчёт прошлого прогона для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить отчёт как базовую линию")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="допустимое падение URL/мин (доля)")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчёт: {path}")
+
+    ok = report["success"] > 0
+    if not ok:
+        print("❌ Ни один URL не обработан — прогон не годится для сравнения")
+    if args.baseline:
+        ok = check_baseline(report, args.baseline, args.max_regression) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Микробенчмарк очистки текста на больших страницах.
+
+Запуск из python-applic:
+    python -m benchmarks.bench_text_cleaning --lines 200000
+"""
+import argparse
+import random
+import re
+import time
+
+from services.text_cleaning import SKIP_WORDS, clean_text
+
+
+def legacy_advanced_text_cleaning(text: str) -> str:
+    """Прежняя реализация advanced_text_cleaning — эталон для сравнения."""
+    if not text:
+        return ""
+
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'&[a-zA-Z0-9#]+;', ' ', text)
+
+    cleaned_lines = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or len(line) < 3:
+            continue
+        nav_keywords = ['войти', 'login', 'регистрация', 'register', 'меню', 'menu', 'подписаться', 'subscribe', 'перейти к навигации', 'перейти к поиску', 'вики любит', 'заглавная', 'порталы', 'справка', 'карма', 'профиль', '@']
+        if any(kw in line.lower() for kw in nav_keywords) and len(line) < 20:
+            continue
+        if re.match(r'^https?://\S+$', line):
+            continue
+        cleaned_lines.append(line)
+
+    cleaned_text = '\n'.join(cleaned_lines)
+    cleaned_text = re.sub(r'\s{2,}', ' ', cleaned_text)
+    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
+    return cleaned_text.strip()
+
+
+def legacy_skip_words(line: str) -> bool:
+    skip_words = ['войти', 'регистрация', 'меню', 'подписаться', 'карма', 'профиль', '@', 'перейти к навигации', 'перейти к поиску', 'вики любит', 'заглавная', 'порталы', 'справка', 'узнать больше']
+    return any(kw in line.lower() for kw in skip_words)
+
+
+def make_page(lines: int, seed: int = 42) -> str:
+    rng = random.Random(seed)
+    words = ['бренд', 'стратегия', 'маркетинг', 'design', 'content', 'аудитория', 'рынок', 'платформа']
+    samples = [
+        lambda: ' '.join(rng.choice(words) for _ in range(rng.randint(5, 30))),
+        lambda: '<p>' + ' '.join(rng.choice(words) for _ in range(12)) + '&nbsp;</p>',
+        lambda: rng.choice(['Войти', 'Меню', 'Подписаться', 'Профиль', 'login']),
+        lambda: 'https://example.com/' + str(rng.randint(0, 10 ** 6)),
+        lambda: '   ',
+    ]
+    return '\n'.join(rng.choice(samples)() for _ in range(lines))
+
+
+def timeit(func, *args, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    page = make_page(args.lines)
+    print(f"📄 Страница: {len(page) / 1024:.0f} KB, {args.lines} строк")
+
+    # Старый scrape_page чистил текст дважды
+    legacy = timeit(lambda t: legacy_advanced_text_cleaning(legacy_advanced_text_cleaning(t)), page, repeat=args.repeat)
+    single = timeit(clean_text, page, repeat=args.repeat)
+    print(f"advanced_text_cleaning x2 (legacy): {legacy * 1000:8.1f} ms")
+    print(f"clean_text (single pass):           {single * 1000:8.1f} ms  (x{legacy / single:.1f})")
+
+    lines = page.split('\n')
+    legacy_skip = timeit(lambda ls: [legacy_skip_words(line) for line in ls], lines, repeat=args.repeat)
+    matcher_skip = timeit(lambda ls: [SKIP_WORDS.search(line) for line in ls], lines, repeat=args.repeat)
+    print(f"skip_words any() (legacy):          {legacy_skip * 1000:8.1f} ms")
+    print(f"KeywordMatcher:                     {matcher_skip * 1000:8.1f} ms  (x{legacy_skip / matcher_skip:.1f})")
+
+    twice = legacy_advanced_text_cleaning(legacy_advanced_text_cleaning(page))
+    assert clean_text(page) == twice, "Результат отличается от двойной очистки legacy"
+    assert clean_text(clean_text(page)) == clean_text(page), "clean_text не идемпотентна"
+    print("✅ Результаты совпадают с legacy")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Локальный мок OpenRouter (/api/v1/chat/completions) для проверки клиентов и нагрузочных прогонов.
+
+Поддерживает обычные и потоковые (SSE) ответы, искусственную задержку
+и периодические 429 с заголовком Retry-After.
+
+Запуск из python-applic:
+    python -m benchmarks.mock_openrouter --port 8808 --latency 0.2 --rate-limit-every 5
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+
+def default_reply(payload: Dict[str, Any]) -> str:
+    """Детерминированный ответ: для JSON-режима — объект, для извлечения — эхо фрагментов."""
+    prompt = payload["messages"][-1]["content"]
+    if payload.get("response_format", {}).get("type") == "json_object":
+        return json.dumps({"ok": True, "prompt_chars": len(prompt)}, ensure_ascii=False)
+    if "Фрагменты:" in prompt:
+        return prompt.split("Фрагменты:", 1)[1].strip()
+    return f"Ответ на: {prompt.strip()[:80]}"
+
+
+class MockOpenRouter:
+    """HTTP-сервер в фоновом потоке; используйте как контекстный менеджер."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        rate_limit_every: int = 0,
+        retry_after: float = 0.1,
+        stream_chunk_chars: int = 64,
+        reply: Callable[[Dict[str, Any]], str] = default_reply,
+    ):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.stream_chunk_chars = stream_chunk_chars
+        self.reply = reply
+        self.requests: List[Dict[str, Any]] = []
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v1/chat/completions"
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):  # noqa: A002 — тихий режим
+                pass
+
+            def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    for key, value in (headers or {}).items():
+                        self.send_header(key, value)
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # клиент ушёл по таймауту
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+
+                with mock._lock:
+                    mock.requests.append(payload)
+                    number = len(mock.requests)
+                    limited = mock.rate_limit_every and number % mock.rate_limit_every == 0
+                    if limited:
+                        mock.rate_limited += 1
+
+                if limited:
+                    self._send_json(429, {"error": {"message": "Rate limit exceeded"}},
+                                    {"Retry-After": str(mock.retry_after)})
+                    return
+
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                content = mock.reply(payload)
+                if payload.get("stream"):
+                    self._stream(content, payload)
+                else:
+                    self._send_json(200, {
+                        "id": f"mock-{number}",
+                        "model": payload.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": len(json.dumps(payload)) // 4, "completion_tokens": len(content) // 4},
+                    })
+
+            def _stream(self, content: str, payload: Dict[str, Any]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+                    step = mock.stream_chunk_chars
+                    for i in range(0, len(content), step):
+                        chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + step]}}], "model": payload.get("model")}
+                        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # клиент оборвал поток — ожидаемо при раннем завершении
+
+        return Handler
+
+    def start(self) -> "MockOpenRouter":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    args = parser.parse_args()
+
+    mock = MockOpenRouter(args.host, args.port, args.latency, args.rate_limit_every, args.retry_after).start()
+    print(f"🧪 Mock OpenRouter: {mock.base_url} (OPENROUTER_BASE_URL={mock.base_url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
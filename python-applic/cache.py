@@ -1,23 +1,139 @@
+import importlib
 import json
 import logging
+import os
+import tempfile
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Optional, Type, TypeVar
+from typing import Any, Callable, Dict, Optional, Tuple, Type, TypeVar
 from dataclasses import asdict, is_dataclass
 from dacite import from_dict, Config as DaciteConfig # type: ignore
 
+try:
+    import orjson # type: ignore
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import msgpack # type: ignore
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+try:
+    import zstandard # type: ignore
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
 T = TypeVar('T')
 
+DEFAULT_DACITE_CONFIG = DaciteConfig(cast=[str, int, float, bool])
+
+
+class CacheSerializer:
+    """Формат файлов кэша: суффикс + функции (де)сериализации в байты, опционально со сжатием zstd."""
+
+    def __init__(self, name: str, suffix: str, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any],
+                 compress: bool = False):
+        if compress and not HAS_ZSTD:
+            raise ImportError("Для сжатия кэша нужен пакет zstandard")
+        self.name = name
+        self.suffix = suffix + (".zst" if compress else "")
+        self.compress = compress
+        self._dumps = dumps
+        self._loads = loads
+        if compress:
+            self._compressor = zstandard.ZstdCompressor(level=3)
+            self._decompressor = zstandard.ZstdDecompressor()
+
+    def dumps(self, value: Any) -> bytes:
+        data = self._dumps(value)
+        return self._compressor.compress(data) if self.compress else data
+
+    def loads(self, data: bytes) -> Any:
+        if self.compress:
+            data = self._decompressor.decompress(data)
+        return self._loads(data)
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def _orjson_dumps(value: Any) -> bytes:
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _msgpack_dumps(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _msgpack_loads(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def make_serializer(name: Optional[str] = None, compress: Optional[bool] = None) -> CacheSerializer:
+    """
+    Сериализатор по имени (json | orjson | msgpack) или из окружения:
+    CACHE_FORMAT (по умолчанию orjson, если установлен) и CACHE_COMPRESS=zstd.
+    """
+    name = (name or os.getenv("CACHE_FORMAT") or ("orjson" if HAS_ORJSON else "json")).lower()
+    if compress is None:
+        compress = os.getenv("CACHE_COMPRESS", "").lower() == "zstd"
+
+    if name == "orjson" and HAS_ORJSON:
+        return CacheSerializer("orjson", ".json", _orjson_dumps, orjson.loads, compress)
+    if name == "msgpack" and HAS_MSGPACK:
+        return CacheSerializer("msgpack", ".msgpack", _msgpack_dumps, _msgpack_loads, compress)
+    if name not in ("json", "orjson", "msgpack"):
+        raise ValueError(f"Неизвестный формат кэша: {name}")
+    return CacheSerializer("json", ".json", _json_dumps, json.loads, compress)
+
+
+@lru_cache(maxsize=1)
+def _legacy_serializers() -> Tuple[CacheSerializer, ...]:
+    """Форматы, которые читаются при отсутствии файла в текущем формате (миграция старого кэша)."""
+    serializers = [make_serializer("json", compress=False)]
+    if HAS_MSGPACK:
+        serializers.append(make_serializer("msgpack", compress=False))
+    if HAS_ZSTD:
+        serializers.append(make_serializer("json", compress=True))
+        if HAS_MSGPACK:
+            serializers.append(make_serializer("msgpack", compress=True))
+    return tuple(serializers)
+
+
+@lru_cache(maxsize=128)
+def _resolve_class(class_path: str) -> Type[Any]:
+    module_name, class_name = class_path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
 
 class Cache:
-    """Файловый кэш для JSON-сериализуемых данных с поддержкой дата-классов через dacite."""
+    """
+    Файловый кэш с поддержкой дата-классов через dacite.
+    Формат задаётся сериализатором (orjson/msgpack, опционально zstd), запись атомарная
+    (временный файл + os.replace). В памяти держатся байты последней записи/чтения: повторный get
+    не читает диск, пока файл не изменился, и каждый раз декодирует свежую копию — изменение
+    полученного значения на месте не портит кэш.
+    """
 
-    def __init__(self, base_path: str = "pipeline_cache", logger: Optional[logging.Logger] = None):
+    def __init__(self, base_path: str = "pipeline_cache", logger: Optional[logging.Logger] = None,
+                 serializer: Optional[CacheSerializer] = None, memory: bool = True):
         self.base_path = Path(base_path)
         self.base_path.mkdir(exist_ok=True)
         self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.serializer = serializer or make_serializer()
+        self.memory = memory
+        # key -> ((mtime_ns, size), сериализатор, байты файла)
+        self._memory: Dict[str, Tuple[Tuple[int, int], CacheSerializer, bytes]] = {}
+        self._lock = threading.Lock()
 
-    def _file(self, key: str) -> Path:
-        return self.base_path / f"{key}.json"
+    def _file(self, key: str, serializer: Optional[CacheSerializer] = None) -> Path:
+        return self.base_path / f"{key}{(serializer or self.serializer).suffix}"
 
     def set(self, key: str, value: Any) -> None:
         """Сохраняет объект (обычный или дата-класс) в кэш.
@@ -30,46 +146,91 @@ class Cache:
                 data["__class__"] = f"{value.__class__.__module__}.{value.__class__.__qualname__}"
             else:
                 data = value
-            with open(file, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            payload = self.serializer.dumps(data)
         except (TypeError, ValueError) as e:
             self.logger.error(f"Ошибка сериализации для ключа {key}: {e}")
             raise
+
+        try:
+            # Пишем рядом во временный файл и атомарно подменяем: при падении остаётся прежняя версия
+            fd, tmp_name = tempfile.mkstemp(dir=self.base_path, prefix=f".{key}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_name, file)
+            except BaseException:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+
+            if self.memory:
+                stat = file.stat()
+                with self._lock:
+                    self._memory[key] = ((stat.st_mtime_ns, stat.st_size), self.serializer, payload)
         except Exception as e:
             self.logger.error(f"Ошибка при сохранении {key}: {e}")
             raise
 
+    def _load(self, key: str) -> Any:
+        """Сырые данные по ключу: байты из памяти, если файл не менялся, иначе с диска."""
+        serializers = (self.serializer,) + tuple(
+            s for s in _legacy_serializers() if s.suffix != self.serializer.suffix
+        )
+        for serializer in serializers:
+            file = self._file(key, serializer)
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self.memory:
+                with self._lock:
+                    cached = self._memory.get(key)
+                if cached is not None and cached[0] == signature:
+                    return cached[1].loads(cached[2])
+
+            payload = file.read_bytes()
+            data = serializer.loads(payload)
+            if self.memory:
+                with self._lock:
+                    self._memory[key] = (signature, serializer, payload)
+            return data
+        return None
+
     def get(self, key: str, dacite_config: Optional[DaciteConfig] = None) -> Optional[T]:
         """Загружает объект из кэша.
         Если в данных есть '__class__' → восстанавливает дата-класс через dacite.
         По умолчанию включает auto-cast типов (str, int, float, bool).
         """
-        file = self._file(key)
-        if not file.exists():
-            return None
-
         try:
-            with open(file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
+            data = self._load(key)
             if isinstance(data, dict) and "__class__" in data:
-                class_path = data.pop("__class__")
-                module_name, class_name = class_path.rsplit(".", 1)
-                module = __import__(module_name, fromlist=[class_name])
-                data_class: Type[T] = getattr(module, class_name)
+                data_class: Type[T] = _resolve_class(data["__class__"])
+                fields = {k: v for k, v in data.items() if k != "__class__"}
 
                 # ✅ если не передан dacite_config — используем cast по умолчанию
-                config = dacite_config or DaciteConfig(cast=[str, int, float, bool])
-                return from_dict(data_class=data_class, data=data, config=config)
+                config = dacite_config or DEFAULT_DACITE_CONFIG
+                return from_dict(data_class=data_class, data=fields, config=config)
 
             return data
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Ошибка декодирования JSON для ключа {key}: {e}")
+        except ValueError as e:
+            # JSONDecodeError и ошибки orjson/msgpack/zstd наследуются от ValueError
+            self.logger.error(f"Ошибка декодирования кэша для ключа {key}: {e}")
             return None
         except Exception as e:
             self.logger.error(f"Ошибка при загрузке {key}: {e}")
             return None
 
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Сбрасывает слой в памяти (для ключа или целиком); файлы не трогает."""
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+            else:
+                self._memory.pop(key, None)
+
     def dump_markdown(self, key: str, value: Any, file_suffix: str = ".md") -> None:
             """Сохраняет объект (обычный или дата-класс) в кэш в формате Markdown.
             Для словарей и дата-классов преобразует данные в таблицу Markdown.
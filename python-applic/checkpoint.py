@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+FINISHED_STATUSES = frozenset({"completed", "error"})
+
+
+class CheckpointJournal:
+    """
+    Журнал контрольных точек пайплайна: append-only JSONL, одна строка на обработанный URL.
+    Каждая запись сбрасывается на диск сразу (fsync), поэтому при падении теряются
+    только URL, которые обрабатывались в этот момент.
+
+    Файлы в base_path:
+        {run}.{writer}.{seq}.jsonl.active — текущий сегмент писателя;
+        {run}.{writer}.{seq}.jsonl        — закрытый сегмент (после ротации или close);
+        {run}.snapshot.jsonl              — результат компакции закрытых сегментов.
+    У каждого процесса свой writer_id, так что несколько писателей не мешают друг другу.
+    """
+
+    def __init__(
+        self,
+        run_key: str = "light",
+        base_path: str = "pipeline_cache/checkpoints",
+        writer_id: Optional[str] = None,
+        segment_max_records: int = 5000,
+        stale_after_seconds: float = 3600,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.run_key = run_key
+        self.base_path = Path(base_path)
+        self.base_path.mkdir(parents=True, exist_ok=True)
+        self.writer_id = writer_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.segment_max_records = segment_max_records
+        self.stale_after_seconds = stale_after_seconds
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment: Optional[Path] = None
+        self._segment_records = 0
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.base_path / f"{self.run_key}.snapshot.jsonl"
+
+    def _segments(self, include_active: bool = True) -> List[Path]:
+        patterns = [f"{self.run_key}.*.jsonl"] + ([f"{self.run_key}.*.jsonl.active"] if include_active else [])
+        segments = {p for pattern in patterns for p in self.base_path.glob(pattern)}
+        segments.discard(self.snapshot_path)
+        return sorted(segments)
+
+    def _open_segment(self) -> None:
+        seq = time.time_ns()
+        self._segment = self.base_path / f"{self.run_key}.{self.writer_id}.{seq}.jsonl.active"
+        self._file = open(self._segment, "a", encoding="utf-8")
+        self._segment_records = 0
+
+    def _seal_segment(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self._segment is not None and self._segment.exists():
+            if self._segment_records:
+                os.replace(self._segment, self._segment.with_suffix(""))
+            else:
+                self._segment.unlink()
+        self._segment = None
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Дописывает результат обработки URL и сразу сбрасывает его на диск."""
+        entry = dict(record)
+        entry.setdefault("ts", time.time())
+        entry.setdefault("writer", self.writer_id)
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._segment_records += 1
+            if self._segment_records >= self.segment_max_records:
+                self._seal_segment()
+
+    @staticmethod
+    def _read(path: Path, records: Dict[str, Dict[str, Any]]) -> int:
+        """Читает файл журнала в records (последняя по ts запись URL побеждает)."""
+        count = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная строка при падении — пропускаем
+                        continue
+                    url = entry.get("url")
+                    if not url:
+                        continue
+                    previous = records.get(url)
+                    if previous is None or entry.get("ts", 0) >= previous.get("ts", 0):
+                        records[url] = entry
+                    count += 1
+        except FileNotFoundError:
+            pass  # сегмент мог быть удалён параллельной компакцией
+        return count
+
+    def replay(self) -> Dict[str, Dict[str, Any]]:
+        """Последнее состояние каждого URL по снапшоту и всем сегментам (включая чужие активные)."""
+        records: Dict[str, Dict[str, Any]] = {}
+        self._read(self.snapshot_path, records)
+        for segment in self._segments():
+            self._read(segment, records)
+        return records
+
+    def writer_records(self, writer_id: str) -> Dict[str, Dict[str, Any]]:
+        """Записи одного писателя, включая незакрытый сегмент (например, умершего процесса-воркера)."""
+        records: Dict[str, Dict[str, Any]] = {}
+        for pattern in (f"{self.run_key}.{writer_id}.*.jsonl", f"{self.run_key}.{writer_id}.*.jsonl.active"):
+            for segment in sorted(self.base_path.glob(pattern)):
+                self._read(segment, records)
+        return records
+
+    def finished(self) -> Dict[str, Dict[str, Any]]:
+        """URL, которые уже не нужно обрабатывать повторно (completed/error)."""
+        return {url: r for url, r in self.replay().items() if r.get("status") in FINISHED_STATUSES}
+
+    def compact(self) -> int:
+        """
+        Сливает снапшот и закрытые сегменты в новый снапшот и удаляет слитые сегменты.
+        Активные сегменты других писателей трогаются, только если не менялись
+        stale_after_seconds (писатель, скорее всего, упал). Возвращает число слитых сегментов.
+        """
+        lock_path = self.base_path / f"{self.run_key}.compact.lock"
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            self.logger.info("⏭️ Компакция журнала уже идёт в другом процессе")
+            return 0
+
+        try:
+            now = time.time()
+            own_segment = self._segment
+            segments = [
+                s for s in self._segments()
+                if s != own_segment and (
+                    s.suffix != ".active" or now - s.stat().st_mtime > self.stale_after_seconds
+                )
+            ]
+            if not segments:
+                return 0
+
+            records: Dict[str, Dict[str, Any]] = {}
+            self._read(self.snapshot_path, records)
+            for segment in segments:
+                self._read(segment, records)
+
+            fd, tmp_name = tempfile.mkstemp(dir=self.base_path, prefix=f".{self.run_key}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for entry in records.values():
+                        f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_name, self.snapshot_path)
+            except BaseException:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+
+            for segment in segments:
+                segment.unlink(missing_ok=True)
+            self.logger.info(f"🗜️ Журнал {self.run_key}: слито сегментов {len(segments)}, URL в снапшоте {len(records)}")
+            return len(segments)
+        finally:
+            os.close(lock_fd)
+            lock_path.unlink(missing_ok=True)
+
+    def reset(self) -> None:
+        """Удаляет весь журнал прогона (запуск без resume)."""
+        with self._lock:
+            self._seal_segment()
+            for path in self._segments() + [self.snapshot_path]:
+                path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        with self._lock:
+            self._seal_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
@@ -1,36 +1,47 @@
-from dataclasses import asdict
 import os
-from prefect.task_runners import ConcurrentTaskRunner # type: ignore
+from itertools import islice
+from typing import Callable, Iterator, Optional
 from prefect import get_run_logger # type: ignore
-from cache import Cache
+from checkpoint import CheckpointJournal
+from metrics import METRICS, publish_run_artifacts, start_metrics_server
 from prefect import task # type: ignore
-from models import LightTask
-from services.google_sheets import GoogleSheetsService
-from services.urls_to_database import urls_to_database
-from services.vector_store import VectorStoreService
-from services.vector_ingestion_service import VectorIngestionService
-
-
-@task(retries=3, retry_delay_seconds=10)
-def read_light_tasks(sheets_service: GoogleSheetsService, spreadsheet_id: str, sheet_name: str) -> list[LightTask]:
-    """Чтение задач из Google Sheets"""
-    data = sheets_service.read_sheets(spreadsheet_id, sheet_name)
-    data = data if isinstance(data, list) else [data]
-
-    return [
-        LightTask(
+from prefect.cache_policies import NO_CACHE # type: ignore
+from models import LightTask, ResultTable
+from services.google_sheets import GoogleSheetsService, create_sheets_service
+from services.urls_to_database import urls_to_database, urls_to_database_sharded
+from services.vector_ingestion_service import VectorIngestionService, build_vector_ingestion
+from task_store import TaskStore, TaskStoreSyncer
+
+
+def iter_light_tasks(sheets_service: GoogleSheetsService, spreadsheet_id: str, sheet_name: str) -> Iterator[LightTask]:
+    """Ленивое чтение задач из Google Sheets по страницам"""
+    for item in sheets_service.iter_records(spreadsheet_id, sheet_name):
+        yield LightTask(
             status=item.get("status", ""),
             url=item.get("url", "")
         )
-        for item in data[:3450]  # Ограничение количества записей
-    ]
+
+
+@task(retries=3, retry_delay_seconds=10, cache_policy=NO_CACHE)
+def import_light_tasks(sheets_service: GoogleSheetsService, task_store: TaskStore,
+                       spreadsheet_id: str, sheet_name: str, overwrite: bool = False) -> int:
+    """Постраничный импорт задач из Google Sheets в TaskStore (каждая страница сразу доступна воркерам)"""
+    task_store.set_import_done(False)
+    imported = task_store.import_stream(iter_light_tasks(sheets_service, spreadsheet_id, sheet_name), overwrite=overwrite)
+    task_store.set_import_done(True)
+    return imported
 
 
 class LightPipeline:
-    def __init__(self, resume: bool = True):
+    def __init__(self, resume: bool = True, workers: int = 1, sheets_service: Optional[GoogleSheetsService] = None,
+                 ingestion_factory: Callable[..., VectorIngestionService] = build_vector_ingestion):
         self.resume = resume
-        self.cache = Cache()
-        self.sheets_service = GoogleSheetsService()
+        self.workers = max(1, workers)
+        self.task_store = TaskStore()
+        self._import_future = None
+        self.sheets_service = sheets_service or create_sheets_service()
+        # Фабрика сервиса векторизации (уходит и в процессы-воркеры, поэтому должна быть picklable)
+        self.ingestion_factory = ingestion_factory
         self.logger = None
 
     def _get_vector_ingestion(self, spreadsheet_id: str, sheet_name: str) -> VectorIngestionService:
@@ -38,9 +49,8 @@ class LightPipeline:
         if not self.logger:
             raise ValueError("Logger должен быть инициализирован")
 
-        vector_store = VectorStoreService(logger=self.logger)
-        return VectorIngestionService(
-            vector_store, self.sheets_service, spreadsheet_id, sheet_name, self.logger
+        return self.ingestion_factory(
+            spreadsheet_id, sheet_name, self.logger, task_store=self.task_store, sheets_service=self.sheets_service
         )
 
     def run(self, sheet_name: str = "Main"):
@@ -52,6 +62,8 @@ class LightPipeline:
             raise ValueError("Не задан GOOGLE_LIGHT_ID")
 
         self.logger.info("🚀 Запуск LIGHT пайплайна...")
+        METRICS.reset()
+        start_metrics_server()
 
         # Этап 1: Чтение данных
         light_tasks = self._get_light_tasks(spreadsheet_id, sheet_name)
@@ -69,8 +81,18 @@ class LightPipeline:
         # Этап 3: Векторизация
         processed_results = self._process_urls(tasks_to_process, spreadsheet_id, sheet_name)
 
+        if self._import_future is not None:
+            # Воркеры стартовали до конца импорта — итог считаем по полному списку
+            self._wait_import()
+            light_tasks = self.task_store.all_tasks()
+            handled = set(processed_results.urls)
+            valid_tasks = light_tasks
+            tasks_to_process = [t for t in light_tasks if t.url in handled]
+            skipped_count = len(valid_tasks) - len(tasks_to_process)
+
         # Статистика и логирование
         stats = self._log_statistics(valid_tasks, tasks_to_process, processed_results, skipped_count)
+        self._publish_metrics(stats)
 
         return {
             "light_tasks": light_tasks,
@@ -79,72 +101,128 @@ class LightPipeline:
         }
 
     def _get_light_tasks(self, spreadsheet_id: str, sheet_name: str) -> list[LightTask]:
-        """Получение списка задач (с кэшированием при resume=True)"""
-        cache_key = "0_a_light_tasks"
-
-        if self.resume:
-            cached_tasks = self.cache.get(cache_key)
-            if cached_tasks:
-                return [LightTask(**task) for task in cached_tasks]
-
-        # Чтение новых данных
-        tasks = read_light_tasks(self.sheets_service, spreadsheet_id, sheet_name)
-
-        if self.resume:
-            self.cache.set(cache_key, [asdict(task) for task in tasks])
-
-        return tasks
+        """
+        Получение списка задач из локального хранилища: импорт из таблицы без resume или при пустом хранилище,
+        иначе — одна синхронизация с таблицей перед запуском.
+        """
+        if not self.resume or self.task_store.is_empty():
+            # Без resume таблица — источник истины, локальные статусы перезаписываются
+            self.task_store.set_import_done(False)
+            self._import_future = import_light_tasks.submit(
+                self.sheets_service, self.task_store, spreadsheet_id, sheet_name, overwrite=not self.resume
+            )
+            if self.workers == 1:
+                self._wait_import()
+            # В шардированном режиме воркеры берут задачи, пока следующие страницы ещё загружаются
+        else:
+            # Resume: строки и статусы, появившиеся в таблице с прошлого запуска, попадают в очередь до старта,
+            # а не только после первого прохода TaskStoreSyncer
+            try:
+                self.task_store.sync_with_sheet(self.sheets_service, spreadsheet_id, sheet_name)
+            except Exception as e:
+                self.logger.warning(f"⚠️ Синхронизация с таблицей перед запуском не удалась, работаем по локальной очереди: {e}")
+
+        return self.task_store.all_tasks()
+
+    def _wait_import(self) -> None:
+        try:
+            imported = self._import_future.result()
+            self.logger.info(f"📥 Импортировано из таблицы: {imported}")
+        finally:
+            # Даже при ошибке импорта воркеры не должны ждать новые страницы
+            self.task_store.set_import_done(True)
+            self._import_future = None
 
     def _filter_tasks(self, light_tasks: list[LightTask]) -> tuple[list, list, int]:
         """Фильтрация задач по статусу и валидности URL"""
-        valid_tasks = [t for t in light_tasks if t.url and t.url.strip()]
-
-        completed_statuses = {"completed", "error"}
-        tasks_to_process = [
-            t for t in valid_tasks
-            if str(t.status).strip().lower() not in completed_statuses
-        ]
+        # Пустые URL отброшены при импорте, незавершённые задачи — индексный запрос к хранилищу
+        valid_tasks = light_tasks
+        tasks_to_process = self.task_store.pending()
 
         skipped_count = len(valid_tasks) - len(tasks_to_process)
 
         return valid_tasks, tasks_to_process, skipped_count
 
-    def _process_urls(self, tasks_to_process: list[LightTask], spreadsheet_id: str, sheet_name: str) -> dict:
-        """Обработка URL через сервис векторизации"""
-        cache_key = "0_b_light_processed_results"
+    def _process_urls(self, tasks_to_process: list[LightTask], spreadsheet_id: str, sheet_name: str) -> ResultTable:
+        """Обработка URL через сервис векторизации (с журналом контрольных точек по каждому URL)"""
+        journal = CheckpointJournal(run_key=f"light-{sheet_name}", logger=self.logger)
+        finished: dict = {}
+        journaled: list[LightTask] = []
 
         if self.resume:
-            cached_results = self.cache.get(cache_key)
-            if cached_results:
-                return cached_results
-
-        vector_ingestion = self._get_vector_ingestion(spreadsheet_id, sheet_name)
-        results = urls_to_database(tasks_to_process, vector_ingestion, self.logger)
-
-        if self.resume:
-            self.cache.set(cache_key, results)
+            finished = journal.finished()
+            if finished:
+                before = len(tasks_to_process)
+                journaled = [t for t in tasks_to_process if t.url in finished]
+                tasks_to_process = [t for t in tasks_to_process if t.url not in finished]
+                # Хранилище догоняет журнал, чтобы воркеры не арендовали уже обработанные URL
+                for t in journaled:
+                    self.task_store.set_status(t.url, finished[t.url]["status"])
+                self.logger.info(
+                    f"♻️ Журнал: {len(finished)} URL уже обработаны, пропущено {before - len(tasks_to_process)}"
+                )
+        else:
+            journal.reset()
+
+        try:
+            with TaskStoreSyncer(self.task_store, self.sheets_service, spreadsheet_id, sheet_name):
+                if self.workers > 1:
+                    self.task_store.requeue_unleased()
+                    results = urls_to_database_sharded(
+                        spreadsheet_id, sheet_name, self.workers, journal.run_key, self.logger,
+                        ingestion_factory=self.ingestion_factory, task_store=self.task_store,
+                    )
+                else:
+                    vector_ingestion = self._get_vector_ingestion(spreadsheet_id, sheet_name)
+                    results = urls_to_database(tasks_to_process, vector_ingestion, self.logger, journal=journal)
+        finally:
+            journal.close()
+            try:
+                journal.compact()
+            except OSError as e:
+                self.logger.warning(f"⚠️ Не удалось сжать журнал контрольных точек: {e}")
+
+        # Восстановленные из журнала URL входят в итог наравне с обработанными сейчас
+        for t in journaled:
+            record = finished[t.url]
+            results.add(t.url, record["status"], record.get("error"))
 
         return results
 
+    def _publish_metrics(self, stats: dict) -> None:
+        """Сводка по этапам в лог и артефакты Prefect (ошибка публикации не роняет запуск)"""
+        for row in METRICS.summary():
+            self.logger.info(
+                f"⏱ {row['stage']}: n={row['count']}, p50={row['p50_ms']} мс, "
+                f"p90={row['p90_ms']} мс, p99={row['p99_ms']} мс, всего {row['total_s']} с"
+            )
+        bottleneck = METRICS.bottleneck()
+        if bottleneck:
+            self.logger.info(f"🐢 Узкое место: {bottleneck}")
+        try:
+            publish_run_artifacts(stats)
+        except Exception as e:
+            self.logger.warning(f"⚠️ Не удалось опубликовать артефакты метрик: {e}")
+
     def _log_statistics(self, valid_tasks: list, tasks_to_process: list,
-                        processed_results: dict, skipped_count: int) -> dict:
+                        processed_results: ResultTable, skipped_count: int) -> dict:
         """Логирование статистики и ошибок"""
         stats = {
             "total_found": len(valid_tasks),
             "total_processed": len(tasks_to_process),
-            "success": len(processed_results["success"]),
-            "errors": len(processed_results["errors"]),
+            "success": processed_results.count("success"),
+            "errors": processed_results.count("errors"),
             "skipped": skipped_count,
         }
 
         self.logger.info(f"📊 Статистика: {stats}")
 
         # Логирование ошибок (первые 5)
-        if processed_results["errors"]:
+        if stats["errors"]:
             self.logger.warning("❌ Проблемные URL:")
             error_samples = ", ".join(
-                f"{err['url']}: {err['error']}"
-                for err in processed_results["errors"][:5]
+                f"{err['url']}: {err.get('error', '')}"
+                for err in islice(processed_results.rows("errors"), 5)
             )
             self.logger.warning(error_samples)
 
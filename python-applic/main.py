@@ -1,14 +1,17 @@
-from prefect import flow # type: ignore
+from prefect import flow, get_run_logger # type: ignore
 from dotenv import load_dotenv # type: ignore
 from prefect.task_runners import ConcurrentTaskRunner # type: ignore
 
 from light_pipeline import LightPipeline
+from profiling import profile_run
 
 
 @flow(log_prints=True, task_runner=ConcurrentTaskRunner())
-def seo_content_pipeline_light(resume: bool = True):
+def seo_content_pipeline_light(resume: bool = True, workers: int = 1, profile: bool = False):
     load_dotenv()
-    return LightPipeline(resume).run()
+    # profile=True: выборочный профайлер всех потоков, результаты в pipeline_cache/profiles
+    with profile_run(profile, name="light", logger=get_run_logger()):
+        return LightPipeline(resume, workers).run()
 
 
 if __name__ == "__main__":
@@ -18,5 +21,5 @@ if __name__ == "__main__":
     ).deploy(
         name="seo_content_pipeline_light",
         work_pool_name="default",
-        parameters={"resume": True}
+        parameters={"resume": True, "workers": 1, "profile": False}
     )
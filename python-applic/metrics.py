@@ -0,0 +1,219 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# Границы корзин гистограмм, секунды: от долей миллисекунды (чанкование, очистка) до медленных страниц и LLM
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+STAGES = ("fetch", "parse", "clean", "llm", "chunk", "embed", "upsert", "sheet_update")
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами: O(log n) на наблюдение, память не растёт."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри корзины (как histogram_quantile)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "max": self.max}
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        if tuple(data["buckets"]) != self.buckets:
+            raise ValueError("Несовместимые корзины гистограммы")
+        self.counts = [a + b for a, b in zip(self.counts, data["counts"])]
+        self.count = sum(self.counts)
+        self.sum += data["sum"]
+        self.max = max(self.max, data["max"])
+
+
+class MetricsRegistry:
+    """
+    Метрики пути загрузки URL: гистограммы длительностей этапов и счётчики исходов.
+    Потокобезопасен; процессы-воркеры возвращают snapshot(), родитель сливает их через merge().
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, int] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, stage: str):
+        """Замер этапа; длительность записывается и при исключении"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "histograms": {stage: h.to_dict() for stage, h in self._histograms.items()},
+                "counters": dict(self._counters),
+            }
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        with self._lock:
+            for stage, data in snapshot.get("histograms", {}).items():
+                histogram = self._histograms.get(stage)
+                if histogram is None:
+                    histogram = self._histograms[stage] = Histogram(self.buckets)
+                histogram.merge(data)
+            for name, value in snapshot.get("counters", {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Строки сводки по этапам (основные этапы первыми), длительности в миллисекундах"""
+        with self._lock:
+            order = [s for s in STAGES if s in self._histograms] + sorted(set(self._histograms) - set(STAGES))
+            rows = []
+            for stage in order:
+                h = self._histograms[stage]
+                rows.append({
+                    "stage": stage,
+                    "count": h.count,
+                    "p50_ms": round(h.quantile(0.5) * 1000, 1),
+                    "p90_ms": round(h.quantile(0.9) * 1000, 1),
+                    "p99_ms": round(h.quantile(0.99) * 1000, 1),
+                    "mean_ms": round(h.sum / h.count * 1000, 1) if h.count else 0.0,
+                    "total_s": round(h.sum, 2),
+                })
+            return rows
+
+    def bottleneck(self) -> Optional[str]:
+        """Этап с наибольшим суммарным временем среди основных"""
+        rows = [row for row in self.summary() if row["stage"] in STAGES]
+        return max(rows, key=lambda row: row["total_s"])["stage"] if rows else None
+
+    def to_prometheus(self, prefix: str = "ingest") -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)"""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Длительность этапов обработки URL",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            for name, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: Optional[int] = None, host: str = "127.0.0.1",
+                         registry: MetricsRegistry = METRICS) -> Optional[ThreadingHTTPServer]:
+    """
+    HTTP-эндпоинт /metrics в фоновом потоке. Порт — аргумент или METRICS_PORT; без порта не запускается.
+    Повторный вызов возвращает уже запущенный сервер.
+    """
+    global _server
+    if port is None:
+        port = int(os.getenv("METRICS_PORT", 0))
+    if not port:
+        return None
+
+    with _server_lock:
+        if _server is not None:
+            return _server
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):  # noqa: A002 — тихий режим
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        _server = ThreadingHTTPServer((host, port), Handler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        logging.getLogger(__name__).info(f"📈 Метрики Prometheus: http://{host}:{port}/metrics")
+        return _server
+
+
+def publish_run_artifacts(stats: Dict[str, Any], registry: MetricsRegistry = METRICS,
+                          key: str = "light-pipeline-metrics") -> None:
+    """Таблица этапов и краткая сводка как артефакты Prefect текущего запуска"""
+    from prefect.artifacts import create_markdown_artifact, create_table_artifact  # type: ignore
+
+    rows = registry.summary()
+    if rows:
+        create_table_artifact(key=f"{key}-stages", table=rows, description="Длительности этапов обработки URL")
+
+    counters = registry.snapshot()["counters"]
+    lines = [
+        "## Итог запуска",
+        "",
+        *(f"- **{name}**: {value}" for name, value in stats.items()),
+        *(f"- **{name}**: {value}" for name, value in sorted(counters.items())),
+    ]
+    bottleneck = registry.bottleneck()
+    if bottleneck:
+        lines.append(f"- **узкое место**: `{bottleneck}`")
+    create_markdown_artifact(key=key, markdown="\n".join(lines), description="Сводка LIGHT пайплайна")
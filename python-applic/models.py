@@ -1,7 +1,9 @@
+import sys
+from array import array
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Dict, Optional
-import pandas as pd # type: ignore
+from itertools import compress
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 @dataclass
 class Author:
@@ -45,21 +47,150 @@ branding agency с более чем 15-летним практическим о
 """
     current_year: str = field(default_factory=lambda: str(datetime.now().year))
 
-@dataclass
+@dataclass(slots=True)
 class LightTask:
     status: str
     url: str
 
-    def to_dataframe(self) -> pd.DataFrame:
+    def __post_init__(self):
+        # Статусов единицы, а задач — сотни тысяч: одна строка на статус вместо копии в каждой задаче
+        self.status = sys.intern(self.status)
+
+    def to_dataframe(self):
         """Convert LightTask to DataFrame with 2 columns"""
-        return pd.DataFrame([{
-            "status": self.status,
-            "url": self.url
-        }])
+        return tasks_to_dataframe([self])
 
     def __str__(self):
         return f"LightTask(status={self.status}, url={self.url})"
 
+
+def tasks_to_dataframe(tasks: Iterable[LightTask]):
+    """Пакетное преобразование задач в DataFrame (status, url) — колонками, без DataFrame на задачу"""
+    import pandas as pd  # type: ignore
+
+    tasks = list(tasks)
+    return pd.DataFrame({
+        "status": pd.Categorical([t.status for t in tasks]),
+        "url": [t.url for t in tasks],
+    })
+
+
+class ResultTable:
+    """
+    Результаты обработки URL в колонках: список URL и компактные массивы кодов
+    статуса, категории (success/errors/skipped) и сообщения об ошибке.
+    Строки статусов и сообщений хранятся по одному разу, поэтому 100k результатов —
+    это список URL плюс несколько сотен КБ, а не 100k словарей.
+    """
+
+    CATEGORIES = ("success", "errors", "skipped")
+    __slots__ = ("urls", "_status", "_category", "_error", "_statuses", "_messages", "_status_ids", "_message_ids")
+
+    def __init__(self):
+        self.urls: List[str] = []
+        self._status = array("B")
+        self._category = array("B")
+        self._error = array("I")  # 0 — без ошибки
+        self._statuses: List[str] = []
+        self._messages: List[Optional[str]] = [None]
+        self._status_ids: Dict[str, int] = {}
+        self._message_ids: Dict[str, int] = {}
+
+    @staticmethod
+    def category_of(status: str) -> str:
+        if status == "completed":
+            return "success"
+        return "skipped" if status == "skipped" else "errors"
+
+    def _status_id(self, status: str) -> int:
+        sid = self._status_ids.get(status)
+        if sid is None:
+            sid = self._status_ids[status] = len(self._statuses)
+            self._statuses.append(status)
+        return sid
+
+    def _message_id(self, message: Optional[str]) -> int:
+        if not message:
+            return 0
+        mid = self._message_ids.get(message)
+        if mid is None:
+            mid = self._message_ids[message] = len(self._messages)
+            self._messages.append(message)
+        return mid
+
+    def add(self, url: str, status: str, error: Optional[str] = None, category: Optional[str] = None) -> str:
+        """Добавляет результат; категория по умолчанию выводится из статуса. Возвращает категорию."""
+        category = category or self.category_of(status)
+        self.urls.append(url)
+        self._status.append(self._status_id(status))
+        self._category.append(self.CATEGORIES.index(category))
+        self._error.append(self._message_id(error))
+        return category
+
+    def add_many(self, urls: Iterable[str], status: str, error: Optional[str] = None,
+                 category: Optional[str] = None) -> None:
+        """Одинаковый результат для пачки URL (например, оставшиеся задачи при отмене)"""
+        before = len(self.urls)
+        self.urls.extend(urls)
+        added = len(self.urls) - before
+        self._status.extend(array("B", [self._status_id(status)]) * added)
+        self._category.extend(array("B", [self.CATEGORIES.index(category or self.category_of(status))]) * added)
+        self._error.extend(array("I", [self._message_id(error)]) * added)
+
+    def extend(self, other: "ResultTable") -> None:
+        """Дописывает результаты другой таблицы (например, процесса-воркера)"""
+        status_map = array("B", (self._status_id(s) for s in other._statuses))
+        message_map = array("I", (self._message_id(m) for m in other._messages))
+        self.urls.extend(other.urls)
+        self._status.extend(status_map[i] for i in other._status)
+        self._category.extend(other._category)
+        self._error.extend(message_map[i] for i in other._error)
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def count(self, category: str) -> int:
+        return self._category.count(self.CATEGORIES.index(category))
+
+    def counts(self) -> Dict[str, int]:
+        return {category: self.count(category) for category in self.CATEGORIES}
+
+    def rows(self, category: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Строки как словари {url, status[, error]} — создаются по требованию"""
+        wanted = None if category is None else self.CATEGORIES.index(category)
+        for i, url in enumerate(self.urls):
+            if wanted is not None and self._category[i] != wanted:
+                continue
+            row = {"url": url, "status": self._statuses[self._status[i]]}
+            if self._error[i]:
+                row["error"] = self._messages[self._error[i]]
+            yield row
+
+    def urls_in(self, category: str) -> List[str]:
+        wanted = self.CATEGORIES.index(category)
+        return list(compress(self.urls, (c == wanted for c in self._category)))
+
+    def to_dataframe(self):
+        """DataFrame (url, status, category, error) одним вызовом: коды становятся категориальными колонками"""
+        import pandas as pd  # type: ignore
+
+        return pd.DataFrame({
+            "url": self.urls,
+            "status": pd.Categorical.from_codes(self._status, categories=self._statuses or [""]),
+            "category": pd.Categorical.from_codes(self._category, categories=self.CATEGORIES),
+            "error": pd.Series(self._messages, dtype=object).take(self._error).reset_index(drop=True),
+        })
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"ResultTable({', '.join(f'{k}={v}' for k, v in self.counts().items())})"
+
 @dataclass
 class SearchResult:
     content: str
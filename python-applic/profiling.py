@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Процессы-воркеры профилируют себя сами, если родитель выставил каталог профиля
+PROFILE_DIR_ENV = "PIPELINE_PROFILE_DIR"
+
+Frame = Tuple[str, str, int]  # (функция, файл, строка начала функции)
+_STDLIB = sysconfig.get_paths()["stdlib"] + os.sep
+
+
+class SamplingProfiler:
+    """
+    Статистический профайлер всех потоков процесса: фоновый поток раз в interval секунд
+    снимает стеки через sys._current_frames(). Накладные расходы не зависят от числа вызовов функций,
+    в отличие от cProfile, поэтому его можно включать на боевом запуске.
+
+    Стеки агрегируются (стек → число выборок); ожидания сети и блокировок тоже видны —
+    как выборки в select/wait/acquire.
+    """
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 128, logger: Optional[logging.Logger] = None):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.elapsed = 0.0
+        self._frames: Dict[object, Frame] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _frame(self, code) -> Frame:
+        frame = self._frames.get(code)
+        if frame is None:
+            frame = self._frames[code] = (code.co_name, code.co_filename, code.co_firstlineno)
+        return frame
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack: List[Frame] = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(self._frame(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[(names.get(ident, f"thread-{ident}"), tuple(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            self._sample()
+            next_at += self.interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_at = time.perf_counter()  # не догоняем пропущенные тики — иначе профайлер сам станет нагрузкой
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    # ---------- выгрузка ----------
+
+    @staticmethod
+    def _label(frame: Frame) -> str:
+        name, filename, line = frame
+        return f"{name} ({_short_path(filename)}:{line})"
+
+    def collapsed(self) -> Iterator[str]:
+        """Collapsed stacks (Brendan Gregg): поток;кадр;кадр… число — вход для flamegraph.pl и speedscope"""
+        for (thread, stack), count in self.stacks.most_common():
+            labels = [thread] + [self._label(frame).replace(";", ",") for frame in stack]
+            yield f"{';'.join(labels)} {count}"
+
+    def speedscope(self, name: str) -> Dict:
+        """Формат speedscope (sampled): по профилю на поток, одинаковые стеки объединены с весом"""
+        # Реальная длительность тика: при конкуренции за GIL часть тиков пропускается
+        tick = self.elapsed / self.samples if self.samples and self.elapsed else self.interval
+        frames: List[Dict] = []
+        index: Dict[Frame, int] = {}
+        profiles: Dict[str, Dict] = {}
+        for (thread, stack), count in self.stacks.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                ids.append(index[frame])
+            profile = profiles.setdefault(thread, {
+                "type": "sampled", "name": thread, "unit": "seconds",
+                "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+            })
+            profile["samples"].append(ids)
+            profile["weights"].append(count * tick)
+        for profile in profiles.values():
+            profile["endValue"] = sum(profile["weights"])
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "runner_killer profiling",
+            "shared": {"frames": frames},
+            "profiles": sorted(profiles.values(), key=lambda p: -p["endValue"]),
+        }
+
+    def hot_paths(self, top: int = 30) -> str:
+        """Сводка: функции по собственному и полному времени, самые частые стеки"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        threads: Counter = Counter()
+        for (thread, stack), count in self.stacks.items():
+            threads[thread] += count
+            if stack:
+                own[stack[-1]] += count
+            for frame in set(stack):
+                total[frame] += count
+
+        all_samples = sum(self.stacks.values()) or 1
+        lines = [
+            f"Выборок: {self.samples} за {self.elapsed:.1f} с (интервал {self.interval * 1000:.0f} мс), "
+            f"стеков потоков: {all_samples}",
+            "",
+            "Потоки:",
+            *(f"  {count / all_samples:6.1%}  {thread}" for thread, count in threads.most_common()),
+            "",
+            "Собственное время (функция на вершине стека):",
+            *(f"  {count / all_samples:6.1%}  {self._label(frame)}" for frame, count in own.most_common(top)),
+            "",
+            "Полное время (функция где-либо в стеке):",
+            *(f"  {count / all_samples:6.1%}  {self._label(frame)}" for frame, count in total.most_common(top)),
+            "",
+            "Частые стеки:",
+        ]
+        for (thread, stack), count in self.stacks.most_common(10):
+            lines.append(f"  {count / all_samples:6.1%}  [{thread}]")
+            lines.extend(f"      {self._label(frame)}" for frame in stack[-8:])
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str, name: str = "profile") -> Path:
+        """profile.collapsed, profile.speedscope.json и hot_paths.txt в directory"""
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / f"{name}.collapsed", "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in self.collapsed())
+        with open(path / f"{name}.speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(self.speedscope(name), f, ensure_ascii=False)
+        with open(path / f"{name}.hot_paths.txt", "w", encoding="utf-8") as f:
+            f.write(self.hot_paths())
+        return path
+
+
+def _short_path(filename: str) -> str:
+    """Путь относительно site-packages / рабочего каталога — короче в сводках и флеймграфах"""
+    for marker in ("site-packages/", "dist-packages/"):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    if filename.startswith(_STDLIB):
+        return filename[len(_STDLIB):]
+    cwd = os.getcwd() + os.sep
+    return filename[len(cwd):] if filename.startswith(cwd) else filename
+
+
+@contextmanager
+def profile_run(enabled: bool, name: str = "flow", base_path: str = "pipeline_cache/profiles",
+                interval: float = 0.01, logger: Optional[logging.Logger] = None):
+    """
+    Профилирование блока кода, если enabled. Результаты — в base_path/{время}-{pid}/;
+    дочерние процессы-воркеры получают каталог через PIPELINE_PROFILE_DIR и пишут туда свои профили.
+    """
+    if not enabled:
+        yield None
+        return
+
+    logger = logger or logging.getLogger(__name__)
+    directory = Path(base_path) / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    previous = os.environ.get(PROFILE_DIR_ENV)
+    os.environ[PROFILE_DIR_ENV] = str(directory.resolve())
+    profiler = SamplingProfiler(interval=interval, logger=logger).start()
+    logger.info(f"🔬 Профилирование включено (интервал {interval * 1000:.0f} мс)")
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        if previous is None:
+            os.environ.pop(PROFILE_DIR_ENV, None)
+        else:
+            os.environ[PROFILE_DIR_ENV] = previous
+        try:
+            profiler.write(str(directory), name)
+            logger.info(f"🔬 Профиль сохранён: {directory} ({profiler.samples} выборок)")
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить профиль: {e}")
+
+
+@contextmanager
+def profile_worker(name: str, logger: Optional[logging.Logger] = None):
+    """Профиль процесса-воркера, если родитель запущен с профилированием"""
+    directory = os.getenv(PROFILE_DIR_ENV)
+    if not directory:
+        yield None
+        return
+
+    profiler = SamplingProfiler(logger=logger).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        try:
+            profiler.write(directory, name)
+        except OSError as e:
+            (logger or logging.getLogger(__name__)).warning(f"⚠️ Не удалось сохранить профиль воркера: {e}")
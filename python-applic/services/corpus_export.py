@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx  # type: ignore
+import numpy as np  # type: ignore
+
+from services.vector_schema import EMBEDDING_DIM, TABLE_NAME
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+try:
+    import orjson  # type: ignore
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def _loads(data) -> Any:
+    return orjson.loads(data) if HAS_ORJSON else json.loads(data)
+
+
+def corpus_schema(dim: int = EMBEDDING_DIM) -> "pa.Schema":
+    """Схема файлов выгрузки: эмбеддинг — список float32 фиксированной длины (читается в numpy без копирования)"""
+    return pa.schema([
+        ("id", pa.int64()),
+        ("url", pa.string()),
+        ("content", pa.string()),
+        ("metadata", pa.string()),  # JSON как есть
+        ("embedding", pa.list_(pa.float32(), dim)),
+    ])
+
+
+def _parse_embeddings(embeddings: List[Any], dim: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Эмбеддинги страницы в одну матрицу (n, dim) float32 и маску отсутствующих.
+    pgvector через PostgREST приходит строкой "[0.1,0.2,...]" — все строки страницы
+    склеиваются и разбираются одним вызовом JSON-парсера.
+    """
+    missing = np.fromiter((e is None or e == "" for e in embeddings), dtype=bool, count=len(embeddings))
+    present = [e for e in embeddings if e is not None and e != ""]
+    if present and isinstance(present[0], str):
+        flat = np.asarray(_loads("[" + ",".join(e[1:-1] for e in present) + "]"), dtype=np.float32)
+    else:
+        flat = np.asarray([v for e in present for v in e], dtype=np.float32)
+    if flat.size != len(present) * dim:
+        raise ValueError(f"Неожиданная размерность эмбеддингов: {flat.size} значений на {len(present)} строк, ожидается {dim}")
+
+    matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+    matrix[~missing] = flat.reshape(-1, dim)
+    return matrix, (missing if missing.any() else None)
+
+
+def rows_to_batch(rows: List[Dict[str, Any]], dim: int = EMBEDDING_DIM) -> "pa.RecordBatch":
+    """Страница строк PostgREST → RecordBatch по corpus_schema"""
+    metadata = [row.get("metadata") or {} for row in rows]
+    matrix, missing = _parse_embeddings([row.get("embedding") for row in rows], dim)
+    embedding = pa.FixedSizeListArray.from_arrays(
+        pa.array(matrix.reshape(-1)), dim, mask=None if missing is None else pa.array(missing),
+    )
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array([row["id"] for row in rows], type=pa.int64()),
+            pa.array([m.get("url") or m.get("URL") for m in metadata], type=pa.string()),
+            pa.array([row.get("content") for row in rows], type=pa.string()),
+            pa.array([json.dumps(m, ensure_ascii=False) for m in metadata], type=pa.string()),
+            embedding,
+        ],
+        schema=corpus_schema(dim),
+    )
+
+
+def batch_to_payload(batch: "pa.RecordBatch") -> bytes:
+    """RecordBatch → JSON-тело bulk upsert (эмбеддинги сериализуются прямо из numpy, если есть orjson)"""
+    dim = batch.schema.field("embedding").type.list_size
+    column = batch.column("embedding")
+    matrix = column.values.to_numpy(zero_copy_only=False).reshape(-1, dim)
+    valid = column.is_valid().to_numpy(zero_copy_only=False)
+    rows = [
+        {
+            "id": row_id,
+            "content": content,
+            "metadata": json.loads(metadata) if metadata else {},
+            "embedding": (matrix[i] if HAS_ORJSON else matrix[i].tolist()) if valid[i] else None,
+        }
+        for i, (row_id, content, metadata) in enumerate(zip(
+            batch.column("id").to_pylist(), batch.column("content").to_pylist(), batch.column("metadata").to_pylist(),
+        ))
+    ]
+    if HAS_ORJSON:
+        return orjson.dumps(rows, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(rows, ensure_ascii=False).encode("utf-8")
+
+
+def iter_batches(path: str, batch_size: int = 1000, columns: Optional[List[str]] = None) -> Iterator["pa.RecordBatch"]:
+    """Потоковое чтение выгрузки (каталог part-*.parquet или один файл) без загрузки целиком"""
+    root = Path(path)
+    files = sorted(root.glob("part-*.parquet")) if root.is_dir() else [root]
+    for file in files:
+        yield from pq.ParquetFile(file).iter_batches(batch_size=batch_size, columns=columns)
+
+
+def load_embeddings(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids, матрица n×dim float32) для офлайн-построения индекса; строки без эмбеддинга пропускаются"""
+    table = pq.read_table(path, columns=["id", "embedding"]).combine_chunks()
+    table = table.filter(table.column("embedding").is_valid())
+    column = table.column("embedding").chunk(0) if table.num_rows else None
+    if column is None:
+        return np.empty(0, dtype=np.int64), np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    dim = column.type.list_size
+    matrix = column.values.to_numpy(zero_copy_only=False)[column.offset * dim:(column.offset + len(column)) * dim]
+    return table.column("id").to_numpy(), matrix.reshape(-1, dim)
+
+
+class CorpusArchive:
+    """
+    Выгрузка таблицы векторного хранилища в Parquet и обратная загрузка через PostgREST.
+
+    Выгрузка: диапазон id делится на partitions частей, каждая листается keyset-пагинацией
+    (id > последний, order=id) — без OFFSET, поэтому страница стоит одинаково в начале и в конце таблицы.
+    Разбор следующей страницы и запись текущей идут параллельно с сетевыми запросами.
+    Загрузка: файлы читаются потоково по батчам, батчи отправляются bulk upsert'ом
+    (merge-duplicates по первичному ключу) с ограниченным числом запросов в полёте.
+    """
+
+    def __init__(
+        self,
+        supabase_url: Optional[str] = None,
+        supabase_key: Optional[str] = None,
+        table: str = TABLE_NAME,
+        dim: int = EMBEDDING_DIM,
+        timeout: float = 120.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        if not HAS_PYARROW:
+            raise ImportError("Для выгрузки корпуса нужен пакет pyarrow")
+        self.supabase_url = supabase_url or os.getenv("SUPABASE_URL")
+        self.supabase_key = supabase_key or os.getenv("SUPABASE_KEY")
+        if not self.supabase_url or not self.supabase_key:
+            raise ValueError("Отсутствуют переменные окружения: SUPABASE_URL, SUPABASE_KEY")
+        self.table = table
+        self.dim = dim
+        self.timeout = timeout
+        self.transport = transport
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+
+    def _client(self, connections: int) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=f"{self.supabase_url.rstrip('/')}/rest/v1",
+            headers={
+                "apikey": self.supabase_key,
+                "Authorization": f"Bearer {self.supabase_key}",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+            timeout=httpx.Timeout(self.timeout),
+            transport=self.transport,
+        )
+
+    @staticmethod
+    async def _request(client: httpx.AsyncClient, method: str, url: str, retries: int = 3, delay: float = 1.0,
+                       **kwargs) -> httpx.Response:
+        for attempt in range(1, retries + 1):
+            try:
+                response = await client.request(method, url, **kwargs)
+                response.raise_for_status()
+                return response
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500 \
+                    or e.response.status_code == 429
+                if attempt == retries or not retryable:
+                    raise
+                await asyncio.sleep(delay * attempt)
+
+    # ---------- выгрузка ----------
+
+    async def _id_bound(self, client: httpx.AsyncClient, direction: str) -> Optional[int]:
+        response = await self._request(
+            client, "GET", f"/{self.table}", params={"select": "id", "order": f"id.{direction}", "limit": 1},
+        )
+        rows = response.json()
+        return rows[0]["id"] if rows else None
+
+    async def _export_range(self, client: httpx.AsyncClient, directory: Path, part: int,
+                            low: int, high: int, page_size: int, rows_per_file: int,
+                            compression: str, stats: Dict[str, int]) -> None:
+        """Keyset-пагинация по id в (low, high]; страница разбирается и пишется в потоке, пока идёт следующий запрос"""
+        schema = corpus_schema(self.dim)
+        writer = None
+        file_no = file_rows = 0
+        last_id = low
+        write_task: Optional[asyncio.Future] = None
+
+        def write(batch: "pa.RecordBatch") -> None:
+            nonlocal writer, file_no, file_rows
+            if writer is None:
+                writer = pq.ParquetWriter(directory / f"part-{part:03d}-{file_no:05d}.parquet", schema,
+                                          compression=compression)
+            writer.write_batch(batch)
+            file_rows += batch.num_rows
+            if file_rows >= rows_per_file:
+                writer.close()
+                writer, file_no, file_rows = None, file_no + 1, 0
+
+        def write_rows(rows: List[Dict[str, Any]]) -> int:
+            write(rows_to_batch(rows, self.dim))
+            return len(rows)
+
+        try:
+            while True:
+                response = await self._request(client, "GET", f"/{self.table}", params={
+                    "select": "id,content,metadata,embedding",
+                    "and": f"(id.gt.{last_id},id.lte.{high})",
+                    "order": "id.asc",
+                    "limit": page_size,
+                })
+                rows = await asyncio.to_thread(_loads, response.content)
+                # Запись предыдущей страницы шла, пока грузилась эта; писатель один — дожидаемся его
+                if write_task is not None:
+                    written = await write_task  # не `stats[...] += await`: части выгружаются параллельно
+                    stats["rows"] += written
+                    write_task = None
+                if not rows:
+                    break
+                last_id = rows[-1]["id"]
+                write_task = asyncio.ensure_future(asyncio.to_thread(write_rows, rows))
+        finally:
+            if write_task is not None and not write_task.done():
+                await asyncio.gather(write_task, return_exceptions=True)
+            if writer is not None:
+                writer.close()
+            stats["files"] += file_no + (1 if file_rows else 0)
+
+    async def export_async(self, path: str, page_size: int = 1000, partitions: int = 4,
+                           rows_per_file: int = 200_000, compression: str = "zstd") -> Dict[str, Any]:
+        """Выгрузка всей таблицы в каталог path (part-{часть}-{номер}.parquet)"""
+        directory = Path(path)
+        directory.mkdir(parents=True, exist_ok=True)
+        for stale in directory.glob("part-*.parquet"):
+            stale.unlink()
+
+        start = time.perf_counter()
+        stats = {"rows": 0, "files": 0}
+        async with self._client(partitions + 1) as client:
+            low, high = await self._id_bound(client, "asc"), await self._id_bound(client, "desc")
+            if low is None:
+                self.logger.info("ℹ️ Таблица пуста — выгружать нечего")
+                return {**stats, "seconds": 0.0}
+            # Деление на диапазоны и колонка id в Parquet рассчитаны на целочисленный ключ
+            if not all(isinstance(bound, int) and not isinstance(bound, bool) for bound in (low, high)):
+                raise ValueError(
+                    f"Выгрузка {self.table} требует целочисленный id (int64), получено: {low!r} … {high!r}"
+                )
+
+            # Диапазоны id равной ширины; пропуски в id лишь делают части неравными по числу строк
+            step = max(1, -(-(high - low + 1) // partitions))
+            bounds = [(low - 1 + i * step, min(high, low - 1 + (i + 1) * step)) for i in range(partitions)]
+            bounds = [(a, b) for a, b in bounds if a < b]
+            self.logger.info(f"📤 Выгрузка {self.table}: id {low}…{high}, частей {len(bounds)}")
+            await asyncio.gather(*(
+                self._export_range(client, directory, part, a, b, page_size, rows_per_file, compression, stats)
+                for part, (a, b) in enumerate(bounds)
+            ))
+
+        seconds = time.perf_counter() - start
+        self.logger.info(
+            f"✅ Выгружено {stats['rows']} строк в {stats['files']} файлов за {seconds:.1f} с "
+            f"({stats['rows'] / seconds if seconds else 0:.0f} строк/с)"
+        )
+        return {**stats, "seconds": round(seconds, 2)}
+
+    # ---------- загрузка ----------
+
+    async def import_async(self, path: str, batch_size: int = 500, concurrency: int = 4) -> Dict[str, Any]:
+        """Потоковая загрузка выгрузки обратно в таблицу bulk upsert'ом (существующие id перезаписываются)"""
+        start = time.perf_counter()
+        stats = {"rows": 0, "batches": 0, "failed_rows": 0}
+        semaphore = asyncio.Semaphore(concurrency)
+        pending = set()
+
+        async with self._client(concurrency) as client:
+            async def send(batch: "pa.RecordBatch") -> None:
+                try:
+                    body = await asyncio.to_thread(batch_to_payload, batch)
+                    await self._request(
+                        client, "POST", f"/{self.table}", params={"on_conflict": "id"}, content=body,
+                        headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+                    )
+                    stats["rows"] += batch.num_rows
+                    stats["batches"] += 1
+                except Exception as e:
+                    stats["failed_rows"] += batch.num_rows
+                    self.logger.error(f"❌ Батч из {batch.num_rows} строк не загружен: {e}")
+                finally:
+                    semaphore.release()
+
+            # Чтение файла — в потоке; в памяти не больше concurrency батчей
+            batches = iter_batches(path, batch_size)
+            while True:
+                await semaphore.acquire()
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    semaphore.release()
+                    break
+                task = asyncio.ensure_future(send(batch))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+
+        seconds = time.perf_counter() - start
+        self.logger.info(
+            f"✅ Загружено {stats['rows']} строк ({stats['batches']} батчей) за {seconds:.1f} с"
+            + (f", не загружено: {stats['failed_rows']}" if stats["failed_rows"] else "")
+        )
+        return {**stats, "seconds": round(seconds, 2)}
+
+    def export(self, path: str, **kwargs) -> Dict[str, Any]:
+        return asyncio.run(self.export_async(path, **kwargs))
+
+    def import_(self, path: str, **kwargs) -> Dict[str, Any]:
+        return asyncio.run(self.import_async(path, **kwargs))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка корпуса векторного хранилища в Parquet")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="таблица → каталог Parquet")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--page-size", type=int, default=1000)
+    export_parser.add_argument("--partitions", type=int, default=4)
+    export_parser.add_argument("--rows-per-file", type=int, default=200_000)
+    import_parser = sub.add_parser("import", help="каталог или файл Parquet → таблица (upsert)")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int, default=500)
+    import_parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    archive = CorpusArchive()
+    if args.command == "export":
+        archive.export(args.path, page_size=args.page_size, partitions=args.partitions,
+                       rows_per_file=args.rows_per_file)
+    else:
+        archive.import_(args.path, batch_size=args.batch_size, concurrency=args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
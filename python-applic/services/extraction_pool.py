@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Union
+
+from services.memory_guard import get_memory_guard, tracked_call
+
+logger = logging.getLogger(__name__)
+
+# Экземпляр StructuredHTMLScraper создаётся один раз на процесс-воркер
+_structured_scraper = None
+
+
+def _decode(html: bytes) -> str:
+    return html.decode('utf-8', errors='replace')
+
+
+def extract_text_payload(html: bytes, url: str) -> Dict[str, Any]:
+    """Очищенный текст и метаданные страницы (выполняется в процессе-воркере)."""
+    from services.simple_scraper import extract_page
+
+    start = time.perf_counter()
+    timings: Dict[str, float] = {}
+    content, metadata = extract_page(_decode(html), url, timings=timings)
+    # parse — разбор и выборка без очистки текста (clean замерена отдельно)
+    timings["parse"] = time.perf_counter() - start - timings.get("clean", 0.0)
+    return {"content": content, "metadata": metadata, "timings": timings}
+
+
+def extract_structured_payload(html: bytes, url: str, method: str = "crawl4ai") -> Optional[Dict[str, Any]]:
+    """Структурированный HTML, метаданные, структура и SEO-метрики (выполняется в процессе-воркере)."""
+    global _structured_scraper
+    if _structured_scraper is None:
+        from services.html_scraper import StructuredHTMLScraper
+        _structured_scraper = StructuredHTMLScraper(logger=logging.getLogger("StructuredHTMLScraper"))
+    return _structured_scraper._process_html(_decode(html), url, method=method)
+
+
+class ExtractionPool:
+    """
+    Пул процессов для CPU-bound разбора HTML (BeautifulSoup, селекторы, SEO-анализ).
+    Асинхронные скраперы ожидают результат через await, не блокируя event loop и загрузки.
+    EXTRACTION_WORKERS=0 отключает пул — разбор идёт в потоке текущего процесса.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        if max_workers is None:
+            max_workers = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # spawn: процесс Prefect многопоточный, fork из него небезопасен
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info(f"🧵 Пул извлечения запущен: {self.max_workers} процессов")
+            return self._executor
+
+    async def _run(self, func: Callable[..., Any], html: Union[str, bytes], url: str, *args: Any) -> Any:
+        data = html.encode('utf-8') if isinstance(html, str) else html
+        guard = get_memory_guard()
+        data = guard.cap(data, url)
+
+        executor = self._get_executor()
+        if executor is None:
+            result, memory = await asyncio.to_thread(tracked_call, func, data, url, *args)
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                result, memory = await loop.run_in_executor(executor, tracked_call, func, data, url, *args)
+            except BrokenProcessPool as e:
+                logger.warning(f"⚠️ Пул извлечения упал ({e}), перезапуск и разбор в потоке")
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+                result, memory = await asyncio.to_thread(tracked_call, func, data, url, *args)
+
+        guard.observe_page(memory, url)
+        return result
+
+    async def extract_text(self, html: Union[str, bytes], url: str) -> Dict[str, Any]:
+        return await self._run(extract_text_payload, html, url)
+
+    async def extract_structured(self, html: Union[str, bytes], url: str, method: str = "crawl4ai") -> Optional[Dict[str, Any]]:
+        return await self._run(extract_structured_payload, html, url, method)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+_default_pool: Optional[ExtractionPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_extraction_pool() -> ExtractionPool:
+    """Общий пул извлечения на процесс."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ExtractionPool()
+        return _default_pool
@@ -1,14 +1,25 @@
 import os
-from typing import Dict, List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Union
 import gspread # type: ignore
 from google.oauth2.service_account import Credentials # type: ignore
 
+from metrics import METRICS
 from models import LightTask
+from services.url_utils import URLIndex, url_key
+
+
+def _column_letter(col: int) -> str:
+    return gspread.utils.rowcol_to_a1(1, col).rstrip("0123456789")
+
 
 class GoogleSheetsService:
-    def __init__(self):
-        self.credentials = self._setup_credentials()
-        self.client = gspread.authorize(self.credentials)
+    def __init__(self, client: Optional[Any] = None):
+        """client — готовый gspread-совместимый клиент (например, эмулятор); без него авторизуемся в Google."""
+        if client is None:
+            self.credentials = self._setup_credentials()
+            client = gspread.authorize(self.credentials)
+        self.client = client
 
     def _setup_credentials(self):
         scope = [
@@ -47,6 +58,44 @@ class GoogleSheetsService:
             print(f"❌ Ошибка чтения Google Sheets: {e}")
             return []
 
+    def iter_records(self, spreadsheet_id: str, sheet_name: str, page_size: int = 1000) -> Iterator[Dict]:
+        """
+        Постраничное чтение листа через batch_get: записи отдаются генератором по мере загрузки,
+        следующая страница скачивается в фоне, пока обрабатывается текущая.
+        Память не зависит от размера листа; полностью пустые строки пропускаются.
+        """
+        sheet = self.client.open_by_key(spreadsheet_id).worksheet(sheet_name)
+        headers = sheet.row_values(1)
+        if not headers:
+            print("⚠️ Лист пуст или нет данных")
+            return
+
+        last_col = _column_letter(len(headers))
+        row_count = sheet.row_count
+        starts = list(range(2, row_count + 1, page_size))
+        if not starts:
+            return
+
+        def fetch(start: int) -> List[List[str]]:
+            end = min(start + page_size - 1, row_count)
+            return sheet.batch_get([f"A{start}:{last_col}{end}"])[0]
+
+        total = 0
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            pending = prefetcher.submit(fetch, starts[0])
+            for i in range(len(starts)):
+                rows = pending.result()
+                if i + 1 < len(starts):
+                    pending = prefetcher.submit(fetch, starts[i + 1])
+
+                for row in rows:
+                    if not any(str(cell).strip() for cell in row):
+                        continue
+                    total += 1
+                    yield dict(zip(headers, list(row) + [""] * (len(headers) - len(row))))
+
+        print(f"📊 Получено записей: {total}")
+
         #  def update_results(self, spreadsheet_id: str, results: Dict):
         #         sheet = self.client.open_by_key(spreadsheet_id).worksheet("Рабочий")
 
@@ -67,6 +116,10 @@ class GoogleSheetsService:
         #             sheet.batch_update(updates)
 
     def update_task_status(self, spreadsheet_id: str, sheet_name: str, url: str, new_status: str) -> bool:
+        with METRICS.span("sheet_update"):
+            return self._update_task_status(spreadsheet_id, sheet_name, url, new_status)
+
+    def _update_task_status(self, spreadsheet_id: str, sheet_name: str, url: str, new_status: str) -> bool:
         try:
             sheet = self.client.open_by_key(spreadsheet_id).worksheet(sheet_name)
             records = sheet.get_all_records()
@@ -100,6 +153,52 @@ class GoogleSheetsService:
             print(f"❌ Ошибка обновления статуса для {url}: {type(e).__name__}: {e}")
             return False
 
+    def update_task_statuses(self, spreadsheet_id: str, sheet_name: str, statuses: Dict[str, str]) -> int:
+        """
+        Пакетное обновление статусов {url: status}: два чтения колонок и один batch_update
+        вместо полного чтения листа на каждый URL. URL сопоставляются по url_key, поэтому
+        обновляются все строки-варианты адреса. Возвращает число изменённых ячеек.
+        """
+        with METRICS.span("sheet_update"):
+            return self._update_task_statuses(spreadsheet_id, sheet_name, statuses)
+
+    def _update_task_statuses(self, spreadsheet_id: str, sheet_name: str, statuses: Dict[str, str]) -> int:
+        try:
+            sheet = self.client.open_by_key(spreadsheet_id).worksheet(sheet_name)
+            headers = [h.lower() for h in sheet.row_values(1)]
+
+            if "url" not in headers or "status" not in headers:
+                print("❌ В таблице нет колонок 'url' или 'status'")
+                return 0
+
+            url_col = headers.index("url") + 1
+            status_col = headers.index("status") + 1
+            urls = sheet.col_values(url_col)
+            current = sheet.col_values(status_col)
+            status_letter = _column_letter(status_col)
+
+            # Строки ищутся по url_key: все варианты одного адреса в таблице получают один статус
+            rows_by_key: Dict[str, List[int]] = {}
+            for row, url in enumerate(urls[1:], start=2):
+                if url and url.strip():
+                    rows_by_key.setdefault(url_key(url), []).append(row)
+
+            updates = []
+            for url, new_status in statuses.items():
+                for row in rows_by_key.get(url_key(url), []):
+                    old_status = current[row - 1] if row - 1 < len(current) else ""
+                    if old_status != new_status:
+                        updates.append({"range": f"{status_letter}{row}", "values": [[new_status]]})
+
+            if updates:
+                sheet.batch_update(updates)
+                print(f"✅ Обновлено статусов: {len(updates)}")
+            return len(updates)
+
+        except Exception as e:
+            print(f"❌ Ошибка пакетного обновления статусов: {type(e).__name__}: {e}")
+            raise
+
     def add_tasks_if_not_exists(self, spreadsheet_id: str, sheet_name: str, tasks: List[LightTask]) -> List[LightTask]:
         """
         Проверяет наличие URL во втором столбце и добавляет отсутствующие задачи в конец таблицы.
@@ -118,8 +217,10 @@ class GoogleSheetsService:
             # Получаем все значения из второго столбца (URL)
             url_column_values = sheet.col_values(2)
 
-            # Находим задачи, URL которых еще нет в таблице
-            tasks_to_add = [task for task in tasks if task.url not in url_column_values]
+            # Хэш-индекс канонических URL: http/https, www. и завершающий слэш не дают дубликатов,
+            # повторы внутри самого списка задач тоже отбрасываются
+            index = URLIndex(url_column_values[1:])
+            tasks_to_add = [task for task in tasks if index.add(task.url)]
 
             if not tasks_to_add:
                 print("⚠️ Все задачи уже существуют в таблице")
@@ -131,9 +232,11 @@ class GoogleSheetsService:
 
             if current_row_count + len(tasks_to_add) > max_rows:
                 # Вычисляем, сколько задач мы можем добавить
-                can_add_count = max_rows - current_row_count
+                can_add_count = max(0, max_rows - current_row_count)
                 tasks_to_add = tasks_to_add[:can_add_count]
                 print(f"⚠️ Превышен лимит строк. Добавлено только {can_add_count} задач")
+                if not tasks_to_add:
+                    return []
 
             # Подготавливаем данные для добавления
             data = []
@@ -151,3 +254,29 @@ class GoogleSheetsService:
         except Exception as e:
             print(f"❌ Ошибка при добавлении задач: {type(e).__name__}: {e}")
             return []
+
+
+def create_sheets_service() -> GoogleSheetsService:
+    """
+    Сервис таблиц по окружению: SHEETS_BACKEND=google (по умолчанию) или emulator.
+    Эмулятор настраивается через SHEETS_EMULATOR_PATH, SHEETS_EMULATOR_LATENCY,
+    SHEETS_EMULATOR_QUOTA_ERROR_RATE, SHEETS_EMULATOR_READ_QUOTA и SHEETS_EMULATOR_WRITE_QUOTA.
+    """
+    backend = os.getenv("SHEETS_BACKEND", "google").lower()
+    if backend == "google":
+        return GoogleSheetsService()
+    if backend != "emulator":
+        raise ValueError(f"Неизвестный SHEETS_BACKEND: {backend}")
+
+    from services.sheets_emulator import SheetsEmulator
+
+    path = os.getenv("SHEETS_EMULATOR_PATH", "pipeline_cache/sheets_emulator.sqlite")
+    emulator = SheetsEmulator(
+        path=path,
+        latency=float(os.getenv("SHEETS_EMULATOR_LATENCY", 0)),
+        quota_error_rate=float(os.getenv("SHEETS_EMULATOR_QUOTA_ERROR_RATE", 0)),
+        read_quota_per_minute=int(os.getenv("SHEETS_EMULATOR_READ_QUOTA", 0)),
+        write_quota_per_minute=int(os.getenv("SHEETS_EMULATOR_WRITE_QUOTA", 0)),
+    )
+    print(f"🧪 Google Sheets: эмулятор {path}")
+    return GoogleSheetsService(client=emulator.client())
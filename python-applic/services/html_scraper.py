@@ -1,24 +1,32 @@
 import asyncio
 import socket
 import time
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Union
 from urllib.parse import urljoin, urlparse
 from prefect.utilities.asyncutils import run_coro_as_sync # type: ignore
 from bs4 import BeautifulSoup # type: ignore
 import requests # type: ignore
 import json
 from crawl4ai import  AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode # type: ignore
+from services.extraction_pool import ExtractionPool, get_extraction_pool
+from services.url_utils import url_variants
 
 HAS_CLOUDSCRAPER = False
 HAS_DNS_RESOLVER = False
 
+
+def _as_soup(html: Union[str, BeautifulSoup]) -> BeautifulSoup:
+    """Готовое дерево используется как есть — страница разбирается один раз"""
+    return html if isinstance(html, BeautifulSoup) else BeautifulSoup(html, 'html.parser')
+
 class StructuredHTMLScraper:
     """
     Продвинутый сервис для извлечения структурированного HTML контента с веб-страниц.
     Включает множественные fallback стратегии, проверку доступности доменов и кэширование.
     """
 
-    def __init__(self, logger, headless: bool = True, use_custom_dns: bool = True):
+    def __init__(self, logger, headless: bool = True, use_custom_dns: bool = True,
+                 extraction_pool: Optional[ExtractionPool] = None):
         dns_args = []
         if use_custom_dns:
             dns_args = [
@@ -26,6 +34,8 @@ class StructuredHTMLScraper:
             ]
 
         self.logger = logger
+        # Пул процессов для разбора HTML (процессы стартуют при первом разборе)
+        self.extraction_pool = extraction_pool or get_extraction_pool()
         # Конфигурация браузера с дополнительными параметрами
         self.browser_config = BrowserConfig(
             browser_type="chromium",
@@ -120,19 +130,13 @@ class StructuredHTMLScraper:
         """
         Проверяет и пытается исправить URL, пробуя разные варианты.
         """
-        # Базовая нормализация
+        # Базовая нормализация: только схема; путь, параметры и фрагмент загружаются как есть
+        url = url.strip()
         if not url.startswith(('http://', 'https://')):
             url = 'https://' + url
 
-        # Проверяем разные варианты URL
-        variants = [
-            url,
-            url.replace('https://', 'http://'),
-            f"https://www.{url.replace('https://', '').replace('http://', '').replace('www.', '')}",
-            f"http://www.{url.replace('https://', '').replace('http://', '').replace('www.', '')}",
-        ]
-
-        for variant in variants:
+        # Проверяем разные варианты URL (схема и www. меняются только в хосте, не в пути)
+        for variant in url_variants(url):
             is_available, _ = self._check_domain_availability(variant)
             if is_available:
                 self.logger.info(f"✅ Найден рабочий вариант URL: {variant}")
@@ -201,7 +205,7 @@ class StructuredHTMLScraper:
                     html = response.text
                     self.logger.info(f"✅ Requests успешно получил контент для {url}")
                     self.stats['fallback_used'] += 1
-                    return self._process_html(html, url, method="requests")
+                    return await self.extraction_pool.extract_structured(html, url, method="requests")
 
             except Exception as e:
                 self.logger.warning(f"⚠️ Requests ошибка с user-agent {user_agent[:30]}...: {e}")
@@ -218,10 +222,17 @@ class StructuredHTMLScraper:
             self.logger.warning(f"⚠️ Слишком короткий или пустой HTML для {url}")
             return None
 
-        structured_html = self._extract_main_content_with_tags(html)
-        metadata = self._extract_metadata(html, url)
-        page_structure = self.extract_page_structure(html)
-        seo_metrics = self.analyze_seo_metrics(html, url)
+        # Одно дерево на страницу: сначала анализы только для чтения, последним — извлечение контента,
+        # которое вырезает элементы из дерева; затем дерево освобождается
+        soup = BeautifulSoup(html, 'html.parser')
+        html = None
+        try:
+            metadata = self._extract_metadata(soup, url)
+            page_structure = self.extract_page_structure(soup)
+            seo_metrics = self.analyze_seo_metrics(soup, url)
+            structured_html = self._extract_main_content_with_tags(soup)
+        finally:
+            soup.decompose()
 
         result = {
             "url": url,
@@ -281,7 +292,7 @@ class StructuredHTMLScraper:
 
                     if result and result.success and result.html:
                         self.logger.info(f"✅ Crawl4AI успешно получил контент для {fixed_url}")
-                        processed = self._process_html(result.html, fixed_url, method="crawl4ai")
+                        processed = await self.extraction_pool.extract_structured(result.html, fixed_url, method="crawl4ai")
                         if processed:
                             self.stats['successful'] += 1
                             return processed
@@ -327,7 +338,7 @@ class StructuredHTMLScraper:
             self.logger.error(f"❌ Ошибка в синхронной обертке: {e}")
             return None
 
-    def extract_page_structure(self, html_content: str) -> Dict[str, Any]:
+    def extract_page_structure(self, html_content: Union[str, BeautifulSoup]) -> Dict[str, Any]:
         """
         Расширенное извлечение структуры страницы.
         """
@@ -350,7 +361,7 @@ class StructuredHTMLScraper:
             return structure
 
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
+            soup = _as_soup(html_content)
 
             # Заголовки с иерархией
             header_hierarchy = []
@@ -422,7 +433,7 @@ class StructuredHTMLScraper:
 
         return structure
 
-    def analyze_seo_metrics(self, html: str, url: str) -> Dict[str, Any]:
+    def analyze_seo_metrics(self, html: Union[str, BeautifulSoup], url: str) -> Dict[str, Any]:
         """
         Анализ SEO параметров страницы.
         """
@@ -441,7 +452,7 @@ class StructuredHTMLScraper:
         }
 
         try:
-            soup = BeautifulSoup(html, 'html.parser')
+            soup = _as_soup(html)
             parsed_url = urlparse(url)
             domain = parsed_url.netloc
 
@@ -504,15 +515,16 @@ class StructuredHTMLScraper:
 
         return metrics
 
-    def _extract_main_content_with_tags(self, html: str) -> str:
+    def _extract_main_content_with_tags(self, html: Union[str, BeautifulSoup]) -> str:
         """
         Извлекает основной контент из HTML, сохраняя теги и структуру.
+        Переданное готовое дерево изменяется (шумовые элементы удаляются).
         """
         if not html:
             return ""
 
         try:
-            soup = BeautifulSoup(html, 'html.parser')
+            soup = _as_soup(html)
 
             # Удаляем ненужные элементы
             for element in soup(['script', 'style', 'noscript', 'meta', 'link', 'comment']):
@@ -580,9 +592,9 @@ class StructuredHTMLScraper:
 
         except Exception as e:
             self.logger.error(f"❌ Ошибка при извлечении основного контента: {e}")
-            return html
+            return str(html)
 
-    def _extract_metadata(self, html: str, url: str) -> Dict[str, Any]:
+    def _extract_metadata(self, html: Union[str, BeautifulSoup], url: str) -> Dict[str, Any]:
         """
         Извлекает расширенные метаданные из HTML.
         """
@@ -600,7 +612,7 @@ class StructuredHTMLScraper:
         }
 
         try:
-            soup = BeautifulSoup(html, 'html.parser')
+            soup = _as_soup(html)
 
             # Title
             title = soup.title
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class LLMResponseCache:
+    """
+    Персистентный контентно-адресуемый кэш ответов LLM (SQLite в pipeline_cache).
+    Ключ — хэш (model, messages, temperature, max_tokens, json_mode);
+    записи живут ttl_seconds, при превышении max_bytes вытесняются самые давно читавшиеся.
+    Кэшировать ли запрос, решает место вызова (cacheable в LLMService): структурированные ответы
+    и извлечение текста кэшируются при любой температуре. Для остальных действует порог:
+    запросы с temperature выше max_temperature (по умолчанию 0.0) не кэшируются, поэтому
+    generate_long_content при 0.7 каждый раз генерирует текст заново.
+    """
+
+    def __init__(
+        self,
+        path: str = "pipeline_cache/llm_responses.sqlite",
+        ttl_seconds: float = 30 * 24 * 3600,
+        max_bytes: int = 512 * 1024 * 1024,
+        max_temperature: float = 0.0,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_temperature = max_temperature
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+
+        self.metrics = {"hits": 0, "misses": 0, "skipped": 0, "stores": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+        self.purge_expired()
+
+    @classmethod
+    def from_env(cls, logger: Optional[logging.Logger] = None) -> Optional["LLMResponseCache"]:
+        """Кэш по переменным окружения; LLM_CACHE_DISABLED=1 отключает его."""
+        if os.getenv("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+            return None
+        return cls(
+            path=os.getenv("LLM_CACHE_PATH", "pipeline_cache/llm_responses.sqlite"),
+            ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", 30 * 24 * 3600)),
+            max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+            max_temperature=float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", 0.0)),
+            logger=logger,
+        )
+
+    @staticmethod
+    def make_key(
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: Optional[int],
+        json_mode: bool,
+        **extra: Any,
+    ) -> str:
+        messages_hash = hashlib.sha256(
+            json.dumps(messages, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        ).hexdigest()
+        key_data = [model, messages_hash, float(temperature), max_tokens, bool(json_mode), sorted(extra.items())]
+        return hashlib.sha256(json.dumps(key_data, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, temperature: float, cacheable: Optional[bool] = None) -> bool:
+        """cacheable — явное решение места вызова; None — по порогу max_temperature."""
+        if cacheable is None:
+            cacheable = temperature <= self.max_temperature
+        if not cacheable:
+            with self._lock:
+                self.metrics["skipped"] += 1
+        return cacheable
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.metrics["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.metrics["hits"] += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, model: str, response: Dict[str, Any]) -> None:
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, data, len(data), now, now),
+                )
+                self._conn.commit()
+                self.metrics["stores"] += 1
+                self._evict_if_needed()
+        except sqlite3.Error as e:
+            # Кэш не должен ронять генерацию
+            self.logger.warning(f"⚠️ Не удалось сохранить ответ LLM в кэш: {e}")
+
+    def _evict_if_needed(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Освобождаем с запасом (до 90% лимита), чтобы не вытеснять на каждой записи
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._conn.commit()
+        self.metrics["evicted"] += evicted
+        self.logger.info(f"🧹 Кэш LLM: вытеснено {evicted} записей")
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            stats: Dict[str, Any] = dict(self.metrics)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups * 100 if lookups else 0
+        stats["entries"] = entries
+        stats["bytes"] = total
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,12 +1,80 @@
+import asyncio
 import os
 import json
+import random
+import time
+from email.utils import parsedate_to_datetime
+import httpx # type: ignore
 import requests # type: ignore
-from typing import Dict, List, Optional, Union
+from requests.adapters import HTTPAdapter # type: ignore
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
+from pydantic import BaseModel # type: ignore
 
-class LLMService:
-    def __init__(self):
+from services.llm_cache import LLMResponseCache
+from services.structured_output import StructuredOutputValidator, parse_json_response
+from services.text_cleaning import estimate_tokens, split_into_blocks, take_within_budget
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str] = None, base: float = 1.0, max_delay: float = 60.0) -> float:
+    """Задержка перед повтором: Retry-After (секунды или HTTP-дата), иначе экспонента с джиттером."""
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), max_delay)
+        except ValueError:
+            try:
+                return min(max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0), max_delay)
+            except (TypeError, ValueError):
+                pass
+    return min(base * 2 ** (attempt - 1) + random.uniform(0, base), max_delay)
+
+
+def _build_payload(
+    messages: List[Dict[str, str]],
+    model: str,
+    temperature: float,
+    max_tokens: Optional[int] = None,
+    json_mode: bool = False,
+    stream: bool = False,
+) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+    }
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+    if stream:
+        payload["stream"] = True
+    return payload
+
+
+def _parse_content(response: Dict, json_mode: bool) -> Union[str, Dict]:
+    content = response["choices"][0]["message"]["content"]
+    # JSON с код-блоками, висячими запятыми или обрезанным хвостом чиним локально, без повторного запроса
+    return parse_json_response(content)[0] if json_mode else content
+
+
+class _OpenRouterSettings:
+    """Общие настройки OpenRouter для синхронного и асинхронного клиентов."""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        timeout: float = 300.0,
+        max_retries: int = 4,
+        cache: Optional[LLMResponseCache] = None,
+        use_cache: bool = True,
+    ):
         self.api_key = os.getenv("OPENROUTER_API_KEY")
-        self.base_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.base_url = base_url or os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
+        self.timeout = timeout
+        self.connect_timeout = 10.0
+        self.max_retries = max_retries
 
         self.main_model = "z-ai/glm-4.5-air:free"
         # self.main_model = "x-ai/grok-4-fast:free"
@@ -18,6 +86,7 @@ class LLMService:
 
         self.model_search = "perplexity/sonar"
         self.long_content_model = "x-ai/grok-4"
+        self.extraction_model = "mistralai/mistral-small-3.2-24b-instruct:free"
 
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -26,6 +95,200 @@ class LLMService:
             "X-Title": "Search Engine Optimization",
         }
 
+        # Кэш ответов: повторные запуски и resume не платят за одинаковые промпты
+        self.cache = cache if cache is not None else (LLMResponseCache.from_env() if use_cache else None)
+
+    def _cache_lookup(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        max_tokens: Optional[int],
+        json_mode: bool,
+        refresh: bool = False,
+        cacheable: Optional[bool] = None,
+        **extra: Any,
+    ) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        Ключ и закэшированный ответ; refresh — не читать кэш (новый ответ перезапишет старый).
+        cacheable — решение вызывающего кода: True кэширует при любой температуре, False — никогда,
+        None — по порогу max_temperature кэша.
+        """
+        if self.cache is None or not self.cache.is_cacheable(temperature, cacheable):
+            return None, None
+        key = self.cache.make_key(model, messages, temperature, max_tokens, json_mode, **extra)
+        return key, None if refresh else self.cache.get(key)
+
+    def _cache_store(self, key: Optional[str], model: str, response: Dict, json_mode: bool = False) -> None:
+        if key is None or self.cache is None:
+            return
+        if json_mode:
+            # Неразбираемый JSON не кэшируем, иначе повторный запрос вернёт тот же брак
+            try:
+                _parse_content(response, json_mode)
+            except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                return
+        self.cache.set(key, model, response)
+
+
+class AsyncLLMService(_OpenRouterSettings):
+    """
+    Асинхронный клиент OpenRouter: общий пул соединений, таймауты,
+    ограничение параллелизма на модель и повторы с учётом Retry-After.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        timeout: float = 300.0,
+        max_retries: int = 4,
+        max_connections: int = 20,
+        concurrency_per_model: int = 4,
+        cache: Optional[LLMResponseCache] = None,
+        use_cache: bool = True,
+    ):
+        super().__init__(base_url, timeout, max_retries, cache, use_cache)
+        self.max_connections = max_connections
+        self.concurrency_per_model = concurrency_per_model
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.concurrency_per_model)
+        return self._semaphores[model]
+
+    async def _make_request(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        json_mode: bool = False,
+        refresh: bool = False,
+        cacheable: Optional[bool] = None,
+    ) -> Dict:
+        cache_key, cached = self._cache_lookup(messages, model, temperature, max_tokens, json_mode, refresh, cacheable)
+        if cached is not None:
+            return cached
+
+        payload = _build_payload(messages, model, temperature, max_tokens, json_mode)
+        client = self._get_client()
+
+        async with self._semaphore(model):
+            for attempt in range(1, self.max_retries + 1):
+                try:
+                    response = await client.post(self.base_url, json=payload)
+                except httpx.TransportError as e:
+                    if attempt == self.max_retries:
+                        raise RuntimeError(f"OpenRouter API error: {e}") from e
+                    await asyncio.sleep(_retry_delay(attempt))
+                    continue
+
+                if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                    await asyncio.sleep(_retry_delay(attempt, response.headers.get("Retry-After")))
+                    continue
+                if response.is_error:
+                    raise RuntimeError(f"OpenRouter API error: {response.status_code} {response.text[:200]}")
+                result = response.json()
+                self._cache_store(cache_key, model, result, json_mode)
+                return result
+
+        raise RuntimeError("OpenRouter API error: retries exhausted")
+
+    async def generate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: Optional[int] = None,
+        json_mode: bool = False,
+        cacheable: Optional[bool] = None,
+    ) -> Union[str, Dict]:
+        messages = [{"role": "user", "content": prompt}]
+        response = await self._make_request(
+            messages, model or self.main_model, temperature, max_tokens, json_mode, cacheable=cacheable
+        )
+        return _parse_content(response, json_mode)
+
+    async def generate_many(self, prompts: List[str], return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        """Пакетная генерация: запросы идут параллельно в пределах лимита модели, порядок ответов сохраняется."""
+        return await asyncio.gather(
+            *(self.generate(prompt, **kwargs) for prompt in prompts),
+            return_exceptions=return_exceptions,
+        )
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+        return False
+
+
+class LLMService(_OpenRouterSettings):
+    """Синхронный фасад: постоянная сессия requests с пулом соединений, таймаутами и повторами."""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        timeout: float = 300.0,
+        max_retries: int = 4,
+        pool_size: int = 10,
+        cache: Optional[LLMResponseCache] = None,
+        use_cache: bool = True,
+    ):
+        super().__init__(base_url, timeout, max_retries, cache, use_cache)
+        self.structured_validator = StructuredOutputValidator(self)
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def _timeouts(self) -> Tuple[float, float]:
+        return self.connect_timeout, self.timeout
+
+    def _post(self, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        """POST с повторами на сетевые ошибки, 429 (с учётом Retry-After) и 5xx."""
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                response = self.session.post(self.base_url, json=payload, timeout=self._timeouts, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(_retry_delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = _retry_delay(attempt, response.headers.get("Retry-After"))
+                response.close()
+                time.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response
+
+        raise requests.exceptions.RetryError("OpenRouter retries exhausted")
+
     def _make_request(
         self,
         messages: List[Dict[str, str]],
@@ -33,21 +296,50 @@ class LLMService:
         temperature: float = 0.7,
         max_tokens: Optional[int] = None,
         json_mode: bool = False,
+        refresh: bool = False,
+        cacheable: Optional[bool] = None,
     ) -> Dict:
-        payload: Dict[str, Union[str, float, int, dict, list]] = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-        }
-        if max_tokens:
-            payload["max_tokens"] = max_tokens
-        if json_mode:
-            payload["response_format"] = {"type": "json_object"}
+        cache_key, cached = self._cache_lookup(messages, model, temperature, max_tokens, json_mode, refresh, cacheable)
+        if cached is not None:
+            return cached
 
+        payload = _build_payload(messages, model, temperature, max_tokens, json_mode)
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            return response.json()
+            result = self._post(payload).json()
+        except requests.exceptions.RequestException as e:
+            raise RuntimeError(f"OpenRouter API error: {e}") from e
+        self._cache_store(cache_key, model, result, json_mode)
+        return result
+
+    def _stream_request(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float = 0.0,
+        max_tokens: Optional[int] = None,
+    ) -> Iterator[str]:
+        """Потоковый запрос (SSE): отдаёт фрагменты текста по мере генерации.
+        Закрытие генератора обрывает соединение — модель перестаёт тратить токены.
+        """
+        payload = _build_payload(messages, model, temperature, max_tokens, stream=True)
+
+        try:
+            with self._post(payload, stream=True) as response:
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    # Пустые строки и комментарии SSE (": OPENROUTER PROCESSING") пропускаем
+                    if not line or not line.startswith("data: "):
+                        continue
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if "error" in chunk:
+                        raise RuntimeError(f"OpenRouter API error: {chunk['error']}")
+                    choices = chunk.get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
         except requests.exceptions.RequestException as e:
             raise RuntimeError(f"OpenRouter API error: {e}") from e
 
@@ -58,12 +350,28 @@ class LLMService:
         temperature: float = 0.3,
         max_tokens: Optional[int] = None,
         json_mode: bool = False,
+        cacheable: Optional[bool] = None,
     ) -> Union[str, Dict]:
-        """Универсальный метод генерации ответа"""
+        """Универсальный метод генерации ответа; cacheable — см. _cache_lookup"""
         messages = [{"role": "user", "content": prompt}]
-        response = self._make_request(messages, model or self.main_model, temperature, max_tokens, json_mode)
-        content = response["choices"][0]["message"]["content"]
-        return json.loads(content) if json_mode else content
+        response = self._make_request(
+            messages, model or self.main_model, temperature, max_tokens, json_mode, cacheable=cacheable
+        )
+        return _parse_content(response, json_mode)
+
+    def generate_many(self, prompts: List[str], return_exceptions: bool = False, **kwargs: Any) -> List[Any]:
+        """Пакетная генерация через AsyncLLMService с теми же настройками."""
+        # Prefect нужен только здесь: клиенты OpenRouter импортируются и без него
+        from prefect.utilities.asyncutils import run_coro_as_sync  # type: ignore
+
+        async def _run() -> List[Any]:
+            async with AsyncLLMService(
+                self.base_url, self.timeout, self.max_retries,
+                max_connections=self.pool_size, cache=self.cache, use_cache=self.cache is not None,
+            ) as client:
+                return await client.generate_many(prompts, return_exceptions=return_exceptions, **kwargs)
+
+        return run_coro_as_sync(_run())
 
     # Шорткаты для удобства
     def generate_response(self, prompt: str) -> str:
@@ -72,11 +380,19 @@ class LLMService:
     def generate_paid_response(self, prompt: str, temperature: float, max_tokens: int = 25000) -> str:
         return self.generate(prompt, model=self.payed_model, max_tokens=max_tokens, temperature=temperature)
 
-    def generate_long_content(self, prompt: str, max_tokens: int = 35000) -> str:
-        return self.generate(prompt, max_tokens=max_tokens, model=self.long_content_model, temperature=0.7)
+    def generate_long_content(self, prompt: str, max_tokens: int = 35000, cacheable: Optional[bool] = None) -> str:
+        return self.generate(prompt, max_tokens=max_tokens, model=self.long_content_model, temperature=0.7,
+                             cacheable=cacheable)
 
-    def generate_structured_response(self, prompt: str) -> Dict:
-        return self.generate(prompt, model=self.long_content_model, temperature=0.3, json_mode=True)
+    def generate_structured_response(self, prompt: str, schema: Optional[Type[BaseModel]] = None) -> Union[Dict, BaseModel]:
+        """
+        JSON-ответ; со schema — валидированная модель (ремонт, перезапрос невалидных полей).
+        Ответ — данные, а не текст для разнообразия: кэшируется, и resume не платит за него повторно.
+        """
+        if schema is None:
+            return self.generate(prompt, model=self.long_content_model, temperature=0.3, json_mode=True, cacheable=True)
+        return self.structured_validator.generate(prompt, schema, model=self.long_content_model, temperature=0.3,
+                                                  cacheable=True)
 
     def generate_response_with_search(self, prompt: str) -> str:
         return self.generate(prompt, model=self.model_search, temperature=0.7)
@@ -90,4 +406,68 @@ class LLMService:
         HTML:
         {html_content}
         """
-        return self.generate_long_content(prompt, max_tokens=max_tokens)
+        # Извлечение текста из одного и того же HTML повторять незачем — кэшируем
+        return self.generate_long_content(prompt, max_tokens=max_tokens, cacheable=True)
+
+    def extract_text_from_blocks(
+        self,
+        blocks: List[str],
+        token_budget: int = 6000,
+        max_tokens: int = 4000,
+        target_chars: int = 15000,
+        model: Optional[str] = None,
+    ) -> str:
+        """Потоковое извлечение основного текста из заранее отобранных блоков.
+
+        В промпт попадают только блоки, укладывающиеся в token_budget;
+        генерация обрывается, как только набрано target_chars символов.
+        """
+        selected = take_within_budget(blocks, token_budget)
+        if not selected:
+            return ""
+
+        content = "\n".join(selected)
+        prompt = f"""
+        Ниже фрагменты основного контента веб-страницы.
+        Убери остатки навигации, рекламы и служебных подписей.
+        Верни только связный текст статьи, без JSON и разметки.
+
+        Фрагменты:
+        {content}
+        """
+        messages = [{"role": "user", "content": prompt}]
+        # Ответ не длиннее входа: ограничиваем max_tokens размером отобранного текста
+        limit = min(max_tokens, estimate_tokens(content) + 200)
+        extraction_model = model or self.extraction_model
+
+        cache_key, cached = self._cache_lookup(messages, extraction_model, 0.0, limit, False, stream_target_chars=target_chars)
+        if cached is not None:
+            return cached["content"]
+
+        collected: List[str] = []
+        collected_chars = 0
+        stream = self._stream_request(messages, extraction_model, temperature=0.0, max_tokens=limit)
+        try:
+            for delta in stream:
+                collected.append(delta)
+                collected_chars += len(delta)
+                if collected_chars >= target_chars:
+                    break
+        finally:
+            stream.close()
+
+        text = "".join(collected)
+        if collected_chars >= target_chars:
+            # Обрезаем по последней целой строке, чтобы не оставлять оборванное предложение
+            cut = text.rfind("\n")
+            text = text[:cut] if cut > 0 else text
+        text = text.strip()
+        self._cache_store(cache_key, extraction_model, {"content": text})
+        return text
+
+    def extract_text_from_html_streaming(self, html_content: str, url: str = "", token_budget: int = 6000, **kwargs) -> str:
+        """Как extract_text_from_html, но HTML сначала сокращается BS-экстракторами до основного контента."""
+        from services.simple_scraper import extract_with_beautifulsoup
+
+        main_text = extract_with_beautifulsoup(html_content, site_specific=True, url=url)
+        return self.extract_text_from_blocks(split_into_blocks(main_text), token_budget=token_budget, **kwargs)
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Страницы больше лимита обрезаются до разбора: текст статьи почти всегда в первых мегабайтах
+DEFAULT_MAX_HTML_BYTES = 5 * 1024 * 1024
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes() -> int:
+    """Текущий RSS процесса (Linux: /proc/self/statm; иначе — пиковый RSS)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def peak_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+        return None if value == "max" else int(value)
+    except (OSError, ValueError):
+        return None
+
+
+def container_memory() -> Optional[Tuple[int, int]]:
+    """(использовано, лимит) памяти контейнера по cgroup v2/v1; None, если лимита нет"""
+    for current, limit in (
+        ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.max"),
+        ("/sys/fs/cgroup/memory/memory.usage_in_bytes", "/sys/fs/cgroup/memory/memory.limit_in_bytes"),
+    ):
+        used, cap = _read_int(current), _read_int(limit)
+        # v1 без лимита отдаёт огромное число — считаем, что лимита нет
+        if used is not None and cap and cap < 1 << 60:
+            return used, cap
+    return None
+
+
+def system_memory() -> Optional[Tuple[int, int]]:
+    """(использовано, всего) по /proc/meminfo с учётом MemAvailable"""
+    try:
+        values = {}
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, rest = line.split(":", 1)
+                values[key] = int(rest.split()[0]) * 1024
+        return values["MemTotal"] - values["MemAvailable"], values["MemTotal"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def cap_html(data: bytes, max_bytes: int) -> Tuple[bytes, bool]:
+    """Обрезает HTML до max_bytes по границе тега; разбор допишет незакрытые теги сам"""
+    if not max_bytes or len(data) <= max_bytes:
+        return data, False
+    cut = data.rfind(b"<", 0, max_bytes)
+    return data[:cut if cut > 0 else max_bytes], True
+
+
+def tracked_call(func, data: bytes, *args: Any) -> Tuple[Any, Dict[str, float]]:
+    """
+    Вызов функции разбора с замером памяти (выполняется в процессе-воркере пула).
+    rss_mb — RSS после разбора, peak_growth_mb — насколько страница подняла пиковый RSS процесса.
+    """
+    peak_before = peak_rss_bytes()
+    result = func(data, *args)
+    memory = {
+        "html_bytes": len(data),
+        "rss_mb": current_rss_bytes() / 2**20,
+        "peak_growth_mb": max(0, peak_rss_bytes() - peak_before) / 2**20,
+    }
+    return result, memory
+
+
+class MemoryGuard:
+    """
+    Ограничение памяти скрапинга: лимит размера HTML и притормаживание параллельных загрузок
+    при нехватке памяти (лимит cgroup контейнера, иначе MemAvailable системы, плюс RSS процесса).
+    Одна страница в работе пропускается всегда, чтобы конвейер не встал.
+
+    Настройка окружением: SCRAPER_MAX_HTML_BYTES, SCRAPER_MEMORY_HIGH_WATERMARK (доля, 0.85),
+    SCRAPER_MAX_RSS_MB (0 — без лимита), SCRAPER_MAX_CONCURRENCY (0 — без лимита).
+    """
+
+    def __init__(
+        self,
+        max_html_bytes: Optional[int] = None,
+        high_watermark: Optional[float] = None,
+        max_rss_mb: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        poll_interval: float = 0.2,
+        check_interval: float = 0.5,
+        page_warning_mb: float = 200.0,
+    ):
+        env = os.getenv
+        self.max_html_bytes = max_html_bytes if max_html_bytes is not None else int(env("SCRAPER_MAX_HTML_BYTES", DEFAULT_MAX_HTML_BYTES))
+        self.high_watermark = high_watermark if high_watermark is not None else float(env("SCRAPER_MEMORY_HIGH_WATERMARK", 0.85))
+        self.max_rss_bytes = (max_rss_mb if max_rss_mb is not None else float(env("SCRAPER_MAX_RSS_MB", 0))) * 2**20
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(env("SCRAPER_MAX_CONCURRENCY", 0))
+        self.poll_interval = poll_interval
+        self.check_interval = check_interval
+        self.page_warning_mb = page_warning_mb
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._checked_at = 0.0
+        self._pressure = False
+        self.stats = {"pages": 0, "truncated": 0, "throttled": 0, "max_page_rss_mb": 0.0, "max_peak_growth_mb": 0.0}
+
+    def under_pressure(self) -> bool:
+        """Высокое давление памяти (результат кэшируется на check_interval)"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._pressure
+        self._checked_at = now
+
+        pressure = bool(self.max_rss_bytes and current_rss_bytes() > self.max_rss_bytes)
+        if not pressure:
+            usage = container_memory() or system_memory()
+            pressure = bool(usage and usage[1] and usage[0] / usage[1] > self.high_watermark)
+        self._pressure = pressure
+        return pressure
+
+    @asynccontextmanager
+    async def slot(self):
+        """Место для загрузки и разбора одной страницы; ждёт, пока давление памяти не спадёт"""
+        throttled = False
+        while True:
+            with self._lock:
+                limit_ok = not self.max_concurrency or self._in_flight < self.max_concurrency
+                if self._in_flight == 0 or (limit_ok and not self.under_pressure()):
+                    self._in_flight += 1
+                    break
+            if not throttled:
+                throttled = True
+                self.stats["throttled"] += 1
+                METRICS.inc("memory_throttled")
+                logger.warning(f"🧠 Мало памяти — ждём освобождения (страниц в работе: {self._in_flight})")
+            await asyncio.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def cap(self, data: bytes, url: str = "") -> bytes:
+        data, truncated = cap_html(data, self.max_html_bytes)
+        if truncated:
+            self.stats["truncated"] += 1
+            METRICS.inc("pages_truncated")
+            logger.warning(f"✂️ HTML обрезан до {self.max_html_bytes // 1024} КБ: {url}")
+        return data
+
+    def observe_page(self, memory: Dict[str, float], url: str = "") -> None:
+        """Учёт памяти разбора одной страницы"""
+        with self._lock:
+            self.stats["pages"] += 1
+            self.stats["max_page_rss_mb"] = max(self.stats["max_page_rss_mb"], memory["rss_mb"])
+            self.stats["max_peak_growth_mb"] = max(self.stats["max_peak_growth_mb"], memory["peak_growth_mb"])
+        if memory["peak_growth_mb"] > self.page_warning_mb:
+            logger.warning(
+                f"🧠 Страница подняла пиковый RSS на {memory['peak_growth_mb']:.0f} МБ "
+                f"(HTML {memory['html_bytes'] // 1024} КБ): {url}"
+            )
+
+
+_default_guard: Optional[MemoryGuard] = None
+_default_guard_lock = threading.Lock()
+
+
+def get_memory_guard() -> MemoryGuard:
+    """Общий MemoryGuard на процесс."""
+    global _default_guard
+    with _default_guard_lock:
+        if _default_guard is None:
+            _default_guard = MemoryGuard()
+        return _default_guard
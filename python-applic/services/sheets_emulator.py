@@ -0,0 +1,342 @@
+"""
+Локальный эмулятор Google Sheets (подмножество gspread, которым пользуется GoogleSheetsService).
+
+Данные хранятся в SQLite (или в памяти), поэтому GoogleSheetsService работает с эмулятором
+без изменений — чтение, пакетные обновления и добавление строк ведут себя так же, как с Google.
+Для нагрузочных прогонов можно добавить задержку на каждый вызов API и ошибки квоты.
+
+Заполнение эмулятора из python-applic:
+    python -m services.sheets_emulator --path pipeline_cache/sheets_emulator.sqlite --rows 20000
+"""
+import argparse
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+DEFAULT_ROW_COUNT = 1000  # размер сетки нового листа в Google Sheets
+_A1_RE = re.compile(r'^([A-Z]+)(\d+)$')
+
+
+class QuotaExceededError(Exception):
+    """Аналог gspread APIError 429: текст содержит 'Quota exceeded', как у Google."""
+
+    def __init__(self, metric: str):
+        super().__init__(
+            f"APIError: [429]: Quota exceeded for quota metric '{metric}' and limit "
+            f"'{metric} per minute per user' of service 'sheets.googleapis.com'"
+        )
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - 64
+    return index
+
+
+def _parse_a1(cell: str) -> Tuple[int, int]:
+    match = _A1_RE.match(cell.upper())
+    if not match:
+        raise ValueError(f"Некорректная ссылка на ячейку: {cell}")
+    return int(match.group(2)), _column_index(match.group(1))
+
+
+def _parse_range(a1_range: str) -> Tuple[int, int, int, int]:
+    """'A2:B1001' → (row1, col1, row2, col2); одиночная ячейка — диапазон из одной ячейки."""
+    start, _, end = a1_range.partition(":")
+    row1, col1 = _parse_a1(start)
+    row2, col2 = _parse_a1(end) if end else (row1, col1)
+    return row1, col1, row2, col2
+
+
+def _trim(values: List[Any]) -> List[str]:
+    """Как в Sheets API: хвостовые пустые ячейки не возвращаются."""
+    values = ["" if v is None else str(v) for v in values]
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+
+class SheetsEmulator:
+    """
+    Хранилище листов и «API» с задержкой и квотами. Один экземпляр можно разделять
+    между потоками; клиент для GoogleSheetsService — client().
+
+    latency — секунд на каждый вызов API;
+    quota_error_rate — доля вызовов, завершающихся ошибкой квоты;
+    read_quota_per_minute / write_quota_per_minute — лимиты запросов в скользящем окне (0 — без лимита).
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        latency: float = 0.0,
+        quota_error_rate: float = 0.0,
+        read_quota_per_minute: int = 0,
+        write_quota_per_minute: int = 0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.quotas = {"Read requests": read_quota_per_minute, "Write requests": write_quota_per_minute}
+        self.calls: Counter = Counter()
+        self.quota_errors = 0
+        self._windows: Dict[str, Deque[float]] = {metric: deque() for metric in self.quotas}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cells_rows (
+                spreadsheet_id TEXT NOT NULL,
+                sheet_name TEXT NOT NULL,
+                row_num INTEGER NOT NULL,
+                cells TEXT NOT NULL,
+                PRIMARY KEY (spreadsheet_id, sheet_name, row_num)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sheets (
+                spreadsheet_id TEXT NOT NULL,
+                sheet_name TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                PRIMARY KEY (spreadsheet_id, sheet_name)
+            );
+        """)
+
+    def client(self) -> "EmulatedClient":
+        return EmulatedClient(self)
+
+    def _api_call(self, method: str, metric: str) -> None:
+        """Один запрос к API: задержка, счётчики, ошибки квоты."""
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.calls[method] += 1
+            limit = self.quotas[metric]
+            if limit:
+                now = time.monotonic()
+                window = self._windows[metric]
+                while window and now - window[0] > 60:
+                    window.popleft()
+                if len(window) >= limit:
+                    self.quota_errors += 1
+                    raise QuotaExceededError(metric)
+                window.append(now)
+            if self.quota_error_rate and self._random.random() < self.quota_error_rate:
+                self.quota_errors += 1
+                raise QuotaExceededError(metric)
+
+    def add_sheet(self, spreadsheet_id: str, sheet_name: str, headers: List[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sheets (spreadsheet_id, sheet_name, row_count) VALUES (?, ?, ?)",
+                (spreadsheet_id, sheet_name, DEFAULT_ROW_COUNT),
+            )
+            self._conn.execute(
+                "DELETE FROM cells_rows WHERE spreadsheet_id = ? AND sheet_name = ?", (spreadsheet_id, sheet_name)
+            )
+            self._conn.execute(
+                "INSERT INTO cells_rows (spreadsheet_id, sheet_name, row_num, cells) VALUES (?, ?, 1, ?)",
+                (spreadsheet_id, sheet_name, json.dumps(headers, ensure_ascii=False)),
+            )
+
+    def seed_tasks(self, spreadsheet_id: str, sheet_name: str, count: int, completed_ratio: float = 0.0,
+                   url_template: str = "https://example.com/page-{i}") -> None:
+        """Лист задач (status, url) на count строк; часть строк можно пометить completed."""
+        self.add_sheet(spreadsheet_id, sheet_name, ["status", "url"])
+        rows = [
+            ["completed" if self._random.random() < completed_ratio else "", url_template.format(i=i)]
+            for i in range(count)
+        ]
+        self._append(spreadsheet_id, sheet_name, rows)
+
+    # --- хранилище (без задержек и квот) ---
+
+    def _exists(self, spreadsheet_id: str, sheet_name: Optional[str] = None) -> bool:
+        query = "SELECT 1 FROM sheets WHERE spreadsheet_id = ?" + (" AND sheet_name = ?" if sheet_name else "")
+        params = (spreadsheet_id, sheet_name) if sheet_name else (spreadsheet_id,)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone() is not None
+
+    def _row_count(self, spreadsheet_id: str, sheet_name: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT row_count FROM sheets WHERE spreadsheet_id = ? AND sheet_name = ?", (spreadsheet_id, sheet_name)
+            ).fetchone()[0]
+
+    def _rows(self, spreadsheet_id: str, sheet_name: str, first: int = 1, last: Optional[int] = None) -> Dict[int, List[str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_num, cells FROM cells_rows WHERE spreadsheet_id = ? AND sheet_name = ? "
+                "AND row_num BETWEEN ? AND ? ORDER BY row_num",
+                (spreadsheet_id, sheet_name, first, last if last is not None else 2 ** 31),
+            ).fetchall()
+        return {row_num: json.loads(cells) for row_num, cells in rows}
+
+    def _write_cells(self, spreadsheet_id: str, sheet_name: str, updates: List[Tuple[int, int, Any]]) -> None:
+        if not updates:
+            return
+        with self._lock, self._conn:
+            self._write_cells_locked(spreadsheet_id, sheet_name, updates)
+
+    def _write_cells_locked(self, spreadsheet_id: str, sheet_name: str, updates: List[Tuple[int, int, Any]]) -> None:
+        """Запись ячеек; вызывается под self._lock внутри транзакции."""
+        by_row: Dict[int, List[Tuple[int, Any]]] = {}
+        for row, col, value in updates:
+            by_row.setdefault(row, []).append((col, value))
+        if not by_row:
+            return
+
+        for row, cells in by_row.items():
+            current = self._conn.execute(
+                "SELECT cells FROM cells_rows WHERE spreadsheet_id = ? AND sheet_name = ? AND row_num = ?",
+                (spreadsheet_id, sheet_name, row),
+            ).fetchone()
+            values = json.loads(current[0]) if current else []
+            for col, value in cells:
+                values.extend([""] * (col - len(values)))
+                values[col - 1] = value
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cells_rows (spreadsheet_id, sheet_name, row_num, cells) VALUES (?, ?, ?, ?)",
+                (spreadsheet_id, sheet_name, row, json.dumps(_trim(values), ensure_ascii=False)),
+            )
+        self._conn.execute(
+            "UPDATE sheets SET row_count = MAX(row_count, ?) WHERE spreadsheet_id = ? AND sheet_name = ?",
+            (max(by_row), spreadsheet_id, sheet_name),
+        )
+
+    def _append(self, spreadsheet_id: str, sheet_name: str, rows: List[List[Any]]) -> None:
+        """Как в Sheets, добавление атомарно: поиск последней строки и запись под одной блокировкой."""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            last = self._conn.execute(
+                "SELECT COALESCE(MAX(row_num), 0) FROM cells_rows WHERE spreadsheet_id = ? AND sheet_name = ?",
+                (spreadsheet_id, sheet_name),
+            ).fetchone()[0]
+            self._write_cells_locked(spreadsheet_id, sheet_name, [
+                (last + offset, col, value)
+                for offset, row in enumerate(rows, start=1)
+                for col, value in enumerate(row, start=1)
+            ])
+
+
+class EmulatedWorksheet:
+    """Методы gspread.Worksheet, которыми пользуется GoogleSheetsService."""
+
+    def __init__(self, emulator: SheetsEmulator, spreadsheet_id: str, title: str):
+        self.emulator = emulator
+        self.spreadsheet_id = spreadsheet_id
+        self.title = title
+
+    @property
+    def row_count(self) -> int:
+        return self.emulator._row_count(self.spreadsheet_id, self.title)
+
+    def row_values(self, row: int) -> List[str]:
+        self.emulator._api_call("row_values", "Read requests")
+        return _trim(self.emulator._rows(self.spreadsheet_id, self.title, row, row).get(row, []))
+
+    def col_values(self, col: int) -> List[str]:
+        self.emulator._api_call("col_values", "Read requests")
+        rows = self.emulator._rows(self.spreadsheet_id, self.title)
+        last = max(rows) if rows else 0
+        return _trim([
+            rows[r][col - 1] if r in rows and len(rows[r]) >= col else ""
+            for r in range(1, last + 1)
+        ])
+
+    def get_all_records(self) -> List[Dict[str, Any]]:
+        self.emulator._api_call("get_all_records", "Read requests")
+        rows = self.emulator._rows(self.spreadsheet_id, self.title)
+        if not rows:
+            return []
+        headers = rows.get(1, [])
+        last = max(rows)
+        records = []
+        for r in range(2, last + 1):
+            values = rows.get(r, [])
+            records.append({h: values[i] if i < len(values) else "" for i, h in enumerate(headers)})
+        return records
+
+    def batch_get(self, ranges: List[str], **kwargs: Any) -> List[List[List[str]]]:
+        self.emulator._api_call("batch_get", "Read requests")
+        result = []
+        for a1_range in ranges:
+            row1, col1, row2, col2 = _parse_range(a1_range)
+            rows = self.emulator._rows(self.spreadsheet_id, self.title, row1, row2)
+            block = [_trim(rows.get(r, [])[col1 - 1:col2]) for r in range(row1, row2 + 1)]
+            while block and not block[-1]:
+                block.pop()
+            result.append(block)
+        return result
+
+    def update_cell(self, row: int, col: int, value: Any) -> None:
+        self.emulator._api_call("update_cell", "Write requests")
+        self.emulator._write_cells(self.spreadsheet_id, self.title, [(row, col, value)])
+
+    def batch_update(self, data: List[Dict[str, Any]], **kwargs: Any) -> None:
+        self.emulator._api_call("batch_update", "Write requests")
+        updates = []
+        for item in data:
+            row1, col1, _, _ = _parse_range(item["range"])
+            for dr, values in enumerate(item["values"]):
+                for dc, value in enumerate(values):
+                    updates.append((row1 + dr, col1 + dc, value))
+        if updates:
+            self.emulator._write_cells(self.spreadsheet_id, self.title, updates)
+
+    def append_rows(self, values: List[List[Any]], **kwargs: Any) -> None:
+        self.emulator._api_call("append_rows", "Write requests")
+        if values:
+            self.emulator._append(self.spreadsheet_id, self.title, values)
+
+
+class EmulatedSpreadsheet:
+    def __init__(self, emulator: SheetsEmulator, spreadsheet_id: str):
+        self.emulator = emulator
+        self.id = spreadsheet_id
+
+    def worksheet(self, title: str) -> EmulatedWorksheet:
+        self.emulator._api_call("worksheet", "Read requests")
+        if not self.emulator._exists(self.id, title):
+            raise LookupError(f"WorksheetNotFound: {title}")
+        return EmulatedWorksheet(self.emulator, self.id, title)
+
+
+class EmulatedClient:
+    """Замена gspread.Client для GoogleSheetsService(client=...)."""
+
+    def __init__(self, emulator: SheetsEmulator):
+        self.emulator = emulator
+
+    def open_by_key(self, key: str) -> EmulatedSpreadsheet:
+        self.emulator._api_call("open_by_key", "Read requests")
+        if not self.emulator._exists(key):
+            raise LookupError(f"SpreadsheetNotFound: {key}")
+        return EmulatedSpreadsheet(self.emulator, key)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="pipeline_cache/sheets_emulator.sqlite")
+    parser.add_argument("--spreadsheet-id", default="emulated")
+    parser.add_argument("--sheet", default="Main")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--completed-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+
+    emulator = SheetsEmulator(args.path, seed=42)
+    emulator.seed_tasks(args.spreadsheet_id, args.sheet, args.rows, args.completed_ratio)
+    print(f"🧪 Эмулятор заполнен: {args.rows} строк в {args.path} ({args.spreadsheet_id}/{args.sheet})")
+    print(f"   SHEETS_BACKEND=emulator SHEETS_EMULATOR_PATH={args.path} GOOGLE_LIGHT_ID={args.spreadsheet_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
+import asyncio
 import logging
 import os
 import json
 import re
-from typing import Dict, Any, Optional, List
+import time
+from typing import Dict, Any, Optional, List, Tuple
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup  # type: ignore
 
@@ -16,6 +18,12 @@ from crawl4ai import (  # type: ignore
 )
 from prefect.utilities.asyncutils import run_coro_as_sync  # type: ignore
 
+from metrics import METRICS
+from services.extraction_pool import ExtractionPool, get_extraction_pool
+from services.llm_services import LLMService
+from services.memory_guard import get_memory_guard
+from services.text_cleaning import NAV_KEYWORDS, SKIP_WORDS, clean_text, split_into_blocks, take_within_budget
+
 logger = logging.getLogger(__name__)
 
 
@@ -67,41 +75,9 @@ def clean_llm_response(llm_response: str) -> str:
     return '\n'.join(cleaned_lines).strip()
 
 
-def advanced_text_cleaning(text: str, preserve_formatting: bool = False) -> str:
-    """Мягкая очистка с сохранением структуры."""
-    if not text:
-        return ""
-
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'&[a-zA-Z0-9#]+;', ' ', text)
-
-    lines = text.split('\n')
-    cleaned_lines = []
-
-    for line in lines:
-        line = line.strip()
-        if not line or len(line) < 3:
-            continue
-
-        # Skip nav/UI (расширенно для Вики/Habr)
-        nav_keywords = ['войти', 'login', 'регистрация', 'register', 'меню', 'menu', 'подписаться', 'subscribe', 'перейти к навигации', 'перейти к поиску', 'вики любит', 'заглавная', 'порталы', 'справка', 'карма', 'профиль', '@']
-        if any(kw in line.lower() for kw in nav_keywords) and len(line) < 20:
-            continue
-
-        # Skip URLs
-        if re.match(r'^https?://\S+$', line):
-            continue
-
-        if preserve_formatting and re.match(r'^(#{1,6}\s+|\d+\.\s+|- \s+)', line):
-            cleaned_lines.append(line)
-            continue
-
-        cleaned_lines.append(line)
-
-    cleaned_text = '\n'.join(cleaned_lines)
-    cleaned_text = re.sub(r'\s{2,}', ' ', cleaned_text)
-    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
-    return cleaned_text.strip()
+def advanced_text_cleaning(text: str) -> str:
+    """Мягкая очистка с сохранением структуры (однопроходный движок из text_cleaning)."""
+    return clean_text(text, NAV_KEYWORDS)
 
 
 def validate_text_content(content: str, min_length: int = 100, min_letters_ratio: float = 0.2) -> bool:
@@ -118,11 +94,31 @@ def validate_text_content(content: str, min_length: int = 100, min_letters_ratio
     return True
 
 
-def extract_with_beautifulsoup(html: str, site_specific: bool = True, url: str = "") -> str:
+def extract_with_beautifulsoup(html: str, site_specific: bool = True, url: str = "",
+                               timings: Optional[Dict[str, float]] = None) -> str:
     """Fallback BS: Адаптирован минимально для Habr и Википедии (селекторы + простой фильтр)."""
     soup = BeautifulSoup(html, 'html.parser')
+    try:
+        return _extract_text_from_soup(soup, url, timings)
+    finally:
+        soup.decompose()
+
+
+def extract_page(html: str, url: str, timings: Optional[Dict[str, float]] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Текст и метаданные страницы за один разбор: метаданные читаются до удаления шума (meta, nav),
+    дерево освобождается сразу после извлечения — в памяти остаются только текст и метаданные.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    try:
+        metadata = _extract_metadata_from_soup(soup, url)
+        return _extract_text_from_soup(soup, url, timings), metadata
+    finally:
+        soup.decompose()
+
 
-    # Удаляем шум
+def _extract_text_from_soup(soup: BeautifulSoup, url: str, timings: Optional[Dict[str, float]] = None) -> str:
+    # Удаляем шум (дерево изменяется)
     for elem in soup(['script', 'style', 'noscript', 'meta', 'nav', 'header', 'footer', 'aside']):
         elem.decompose()
 
@@ -161,8 +157,7 @@ def extract_with_beautifulsoup(html: str, site_specific: bool = True, url: str =
                 continue
 
             # Skip nav/профиль
-            skip_words = ['войти', 'регистрация', 'меню', 'подписаться', 'карма', 'профиль', '@', 'перейти к навигации', 'перейти к поиску', 'вики любит', 'заглавная', 'порталы', 'справка', 'узнать больше']
-            if any(kw in line.lower() for kw in skip_words):
+            if SKIP_WORDS.search(line):
                 skip_section = True
                 continue
             if skip_section and len(line) < 30:
@@ -176,7 +171,10 @@ def extract_with_beautifulsoup(html: str, site_specific: bool = True, url: str =
         extracted_text = '\n'.join(filtered_lines)
         logger.info(f"BS fallback raw: {len(extracted_text)} chars (filtered).")
 
-    cleaned = advanced_text_cleaning(extracted_text, preserve_formatting=True)
+    clean_start = time.perf_counter()
+    cleaned = advanced_text_cleaning(extracted_text)
+    if timings is not None:
+        timings["clean"] = time.perf_counter() - clean_start
     logger.info(f"BS final: {len(cleaned)} chars. Sample: {cleaned[:150]}...")
     if len(cleaned) < 1000:  # Смягчили порог warning
         logger.warning(f"⚠️ BS too short ({len(cleaned)} chars) — JS issue?")
@@ -187,6 +185,13 @@ def extract_with_beautifulsoup(html: str, site_specific: bool = True, url: str =
 def extract_metadata(html: str, url: str) -> Dict[str, Any]:
     """Извлечение метаданных."""
     soup = BeautifulSoup(html, 'html.parser')
+    try:
+        return _extract_metadata_from_soup(soup, url)
+    finally:
+        soup.decompose()
+
+
+def _extract_metadata_from_soup(soup: BeautifulSoup, url: str) -> Dict[str, Any]:
     parsed_url = urlparse(url)
 
     title = soup.title.string.strip() if soup.title else ''
@@ -229,6 +234,12 @@ def process_blocks(blocks: List[Any], max_blocks: int = 30, min_total_length: in
     return ""
 
 
+def observe_timings(page: Dict[str, Any]) -> None:
+    """Длительности parse/clean, замеренные в процессе-воркере пула извлечения (без ожидания в очереди)"""
+    for stage, seconds in page.get("timings", {}).items():
+        METRICS.observe(stage, seconds)
+
+
 class SimpleScraperService:
     """Минимальный скрапер (рабочий для Habr; + Вики селекторы)."""
 
@@ -236,18 +247,26 @@ class SimpleScraperService:
         self,
         logger: logging.Logger,
         use_llm: bool = False,  # По умолчанию off для стабильности
-        preserve_formatting: bool = True,
-        js_delay: float = 3.0
+        js_delay: float = 3.0,
         # js_delay: float = 10.0  # Вернул 10s (рабочий)
+        extraction_pool: Optional[ExtractionPool] = None,
+        llm_mode: str = "crawl4ai",  # "crawl4ai" — вся страница в LLMExtractionStrategy, "streaming" — только основной контент
+        llm_token_budget: int = 6000,
     ):
         self.logger = logger
-        self.preserve_formatting = preserve_formatting
+        self.extraction_pool = extraction_pool or get_extraction_pool()
+        self.memory_guard = get_memory_guard()
         self.js_delay = js_delay
         self.browser_config = BrowserConfig(headless=True)  # Убрал UA (упростил)
         self.api_key = os.getenv("OPENROUTER_API_KEY")
         self.llm_strategy = None
+        self.llm_service = None
+        self.llm_token_budget = llm_token_budget
 
-        if use_llm and self.api_key:
+        if use_llm and self.api_key and llm_mode == "streaming":
+            self.llm_service = LLMService()
+            self.logger.info(f"LLM streaming init (budget={llm_token_budget} tokens, delay={js_delay}s).")
+        elif use_llm and self.api_key:
             self.llm_strategy = LLMExtractionStrategy(
                 llm_config=LLMConfig(
                     provider="openrouter/mistralai/mistral-small-3.2-24b-instruct:free",
@@ -264,79 +283,126 @@ class SimpleScraperService:
             )
             self.logger.info(f"LLM init (delay={js_delay}s).")
 
+    async def _crawl(self, url: str, use_llm: bool):
+        """Загрузка страницы браузером; результат с полями html, success, status_code, extracted_content"""
+        async with AsyncWebCrawler(config=self.browser_config) as crawler:
+            # Простой JS-код (минимальный, без setTimeout — чтобы избежать crash)
+            js_code = """
+            window.scrollTo(0, document.body.scrollHeight);
+            console.log('Scrolled for lazy load');
+            """
+
+            config = CrawlerRunConfig(
+                delay_before_return_html=self.js_delay,
+                magic=True,
+                cache_mode=CacheMode.BYPASS,
+                js_code=js_code,  # Только прокрутка
+            )
+            if use_llm and self.llm_strategy:
+                config.extraction_strategy = self.llm_strategy
+
+            return await crawler.arun(url, config=config)
+
     async def get_page_info(self, url: str, use_llm: Optional[bool] = False, max_retries: int = 2) -> Dict[str, Any]:
         if use_llm is None:
             use_llm = False  # Минимально: BS-only
 
         self.logger.info(f"Scraping {url} (LLM: {use_llm}, retries: {max_retries}, delay: {self.js_delay}s)")
 
-        result = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                async with AsyncWebCrawler(config=self.browser_config) as crawler:
-                    # Простой JS-код (минимальный, без setTimeout — чтобы избежать crash)
-                    js_code = """
-                    window.scrollTo(0, document.body.scrollHeight);
-                    console.log('Scrolled for lazy load');
-                    """
-
-                    config = CrawlerRunConfig(
-                        delay_before_return_html=self.js_delay,
-                        magic=True,
-                        cache_mode=CacheMode.BYPASS,
-                        js_code=js_code,  # Только прокрутка
-                    )
-                    if use_llm:
-                        config.extraction_strategy = self.llm_strategy
-
-                    result = await crawler.arun(url, config=config)
-                    logger.debug(f"Raw HTML length (attempt {attempt}): {len(result.html) if result.html else 0}")
-
-                    if result.html:
-                        test_bs = extract_with_beautifulsoup(result.html, site_specific=True, url=url)
+        # От результата crawl4ai держим только нужные поля: HTML уходит в пул разбора и сразу освобождается
+        crawled: Optional[Dict[str, Any]] = None
+        page = None
+        async with self.memory_guard.slot():
+            for attempt in range(1, max_retries + 1):
+                try:
+                    with METRICS.span("fetch"):
+                        result = await self._crawl(url, use_llm)
+                    html = result.html
+                    crawled = {
+                        "success": result.success,
+                        "status_code": getattr(result, 'status_code', 200),
+                        "extracted_content": result.extracted_content if use_llm else None,
+                    }
+                    result = None
+                    logger.debug(f"Raw HTML length (attempt {attempt}): {len(html) if html else 0}")
+
+                    # Разбор HTML — в пуле процессов, браузер к этому моменту уже закрыт
+                    page = None
+                    if html:
+                        page = await self.extraction_pool.extract_text(html, url)
+                        html = None
+                        observe_timings(page)
                         min_success = 1000  # Смягчили для retry
-                        if len(test_bs) > min_success:
+                        if len(page["content"]) > min_success:
                             break
                         else:
-                            logger.warning(f"Attempt {attempt}: Short ({len(test_bs)} chars) — retrying...")
+                            logger.warning(f"Attempt {attempt}: Short ({len(page['content'])} chars) — retrying...")
 
-            except Exception as e:
-                logger.error(f"❌ Error (attempt {attempt}): {e}")
-                if attempt == max_retries:
-                    return self._error_response(url, str(e))
+                except Exception as e:
+                    logger.error(f"❌ Error (attempt {attempt}): {e}")
+                    if attempt == max_retries:
+                        return self._error_response(url, str(e))
 
-        if not result or not result.success:
+        if not crawled or not crawled["success"]:
             return self._error_response(url, "Crawl failed.")
 
         # LLM (опционально)
         llm_content = None
         blocks_processed = 0
-        if use_llm and result.extracted_content:
-            extracted_raw = result.extracted_content
+        if use_llm and crawled["extracted_content"]:
+            extracted_raw = crawled.pop("extracted_content")
             if isinstance(extracted_raw, list):
                 full_text = process_blocks(extracted_raw)
                 if full_text:
-                    llm_content = advanced_text_cleaning(full_text, self.preserve_formatting)
+                    llm_content = advanced_text_cleaning(full_text)
                     blocks_processed = len(extracted_raw)
             else:
-                llm_content = advanced_text_cleaning(clean_llm_response(str(extracted_raw)), self.preserve_formatting)
+                llm_content = advanced_text_cleaning(clean_llm_response(str(extracted_raw)))
                 blocks_processed = 1
 
-        # BS fallback (основной)
-        cleaned_content = extract_with_beautifulsoup(result.html or "", site_specific=True, url=url)
+        # BS fallback (основной) — уже извлечён в пуле на последней попытке
+        if page is None:
+            page = await self.extraction_pool.extract_text("", url)
+            observe_timings(page)
+        cleaned_content = page["content"]
         if llm_content and len(llm_content) > len(cleaned_content):
             cleaned_content = llm_content  # LLM если лучше
 
+        # Потоковый LLM: дочищает уже отобранный BS-контент в пределах бюджета токенов.
+        # Строки за пределами бюджета LLM не видит — они остаются в тексте как есть, длинная страница не обрезается
+        if use_llm and self.llm_service and cleaned_content:
+            try:
+                lines = cleaned_content.split('\n')
+                head = take_within_budget(lines, self.llm_token_budget)
+                tail = lines[len(head):]
+                with METRICS.span("llm"):
+                    streamed = await asyncio.to_thread(
+                        self.llm_service.extract_text_from_blocks,
+                        split_into_blocks('\n'.join(head)),
+                        token_budget=self.llm_token_budget,
+                        # Ответ может быть не короче входа: лимиты не должны обрезать дочищенную часть
+                        max_tokens=self.llm_token_budget + 200,
+                        target_chars=sum(len(line) + 1 for line in head) + 1000,
+                    )
+                with METRICS.span("clean"):
+                    streamed = advanced_text_cleaning(streamed)
+                if validate_text_content(streamed, min_length=100, min_letters_ratio=0.15):
+                    llm_content = streamed
+                    cleaned_content = '\n'.join([streamed, *tail])
+                    blocks_processed = 1
+            except Exception as e:
+                logger.warning(f"⚠️ LLM streaming failed, keeping BS content: {e}")
+
         # Валидация (мягкая)
         if not validate_text_content(cleaned_content, min_length=100, min_letters_ratio=0.15):
             return self._error_response(url, f"Too short: {len(cleaned_content)} chars.")
 
-        metadata = extract_metadata(result.html or "", url)
+        metadata = page["metadata"]
         logger.info(f"✅ Success: {len(cleaned_content)} chars (attempt {attempt})")
 
         return {
             "url": url,
-            "status_code": getattr(result, 'status_code', 200),
+            "status_code": crawled["status_code"],
             "title": metadata["title"],
             "description": metadata["description"],
             "keywords": metadata["keywords"],
@@ -351,12 +417,13 @@ class SimpleScraperService:
     def get_page_info_sync(self, url: str, use_llm: Optional[bool] = False) -> Dict[str, Any]:
         return run_coro_as_sync(self.get_page_info(url, use_llm))
 
-    def scrape_page(self, url: str, clean_html: bool = True, use_llm: Optional[bool] = False) -> Optional[str]:
+    def scrape_page(self, url: str, use_llm: Optional[bool] = False) -> Optional[str]:
         page_info = self.get_page_info_sync(url, use_llm)
         if not page_info["success"]:
             self.logger.error(f"Failed: {page_info.get('error_message', 'Unknown')}")
             return None
-        return advanced_text_cleaning(page_info["content"], self.preserve_formatting) if clean_html else page_info["content"]
+        # content уже очищен в get_page_info
+        return page_info["content"]
 
     def _error_response(self, url: str, error: str) -> Dict[str, Any]:
         logger.error(error)
@@ -0,0 +1,208 @@
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError # type: ignore
+
+M = TypeVar('M', bound=BaseModel)
+
+_FENCE_OPEN_RE = re.compile(r'^\s*```[a-zA-Z]*\s*\n?')
+_FENCE_CLOSE_RE = re.compile(r'\n?\s*```\s*$')
+
+
+def repair_json_text(text: str) -> Tuple[str, List[str]]:
+    """
+    Локальный ремонт типовых дефектов JSON из LLM: код-блоки, текст вокруг объекта,
+    висячие запятые, обрезанный хвост (незакрытые строки, массивы и объекты).
+    Возвращает исправленный текст и список применённых исправлений.
+    """
+    fixes: List[str] = []
+    text = text.strip()
+
+    if text.startswith('```'):
+        text = _FENCE_CLOSE_RE.sub('', _FENCE_OPEN_RE.sub('', text, count=1), count=1)
+        fixes.append('code_fence')
+
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        return text, fixes
+    if min(starts) > 0:
+        text = text[min(starts):]
+        fixes.append('leading_text')
+
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    pending_comma = -1  # индекс запятой в out, которая может оказаться висячей
+    end = len(text)
+
+    for i, char in enumerate(text):
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+            pending_comma = -1
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            pending_comma = -1
+        elif char in '}]':
+            if pending_comma != -1:
+                del out[pending_comma]
+                pending_comma = -1
+                fixes.append('trailing_comma')
+            if not stack:
+                end = i
+                break
+            stack.pop()
+            out.append(char)
+            if not stack:
+                end = i + 1
+                break
+            continue
+        elif char == ',':
+            pending_comma = len(out)
+        elif not char.isspace():
+            pending_comma = -1
+        out.append(char)
+
+    if end < len(text) and text[end:].strip():
+        fixes.append('trailing_text')
+
+    if in_string or stack:
+        if in_string:
+            if escaped:
+                out.pop()
+            out.append('"')
+        repaired = ''.join(out).rstrip()
+        # Обрезано после запятой или двоеточия — убираем висячий разделитель
+        if repaired.endswith(','):
+            repaired = repaired[:-1]
+        elif repaired.endswith(':'):
+            repaired += ' null'
+        fixes.append('truncated')
+        return repaired + ''.join(reversed(stack)), fixes
+
+    return ''.join(out), fixes
+
+
+def parse_json_response(content: str) -> Tuple[Any, List[str]]:
+    """json.loads с локальным ремонтом; при неудаче пробрасывает исходную ошибку."""
+    try:
+        return json.loads(content), []
+    except json.JSONDecodeError as original_error:
+        repaired, fixes = repair_json_text(content)
+        try:
+            return json.loads(repaired), fixes
+        except json.JSONDecodeError:
+            raise original_error
+
+
+class StructuredOutputValidator:
+    """
+    Валидация ответов LLM по Pydantic-схеме с локальным ремонтом JSON.
+    Невалидные поля перезапрашиваются коротким уточняющим промптом;
+    полная перегенерация — только если ответ не удалось разобрать или поправить.
+    """
+
+    def __init__(self, llm: Any, logger: Optional[logging.Logger] = None, max_reasks: int = 1, max_regenerations: int = 1):
+        self.llm = llm
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.max_reasks = max_reasks
+        self.max_regenerations = max_regenerations
+        self.counters = {
+            'total': 0,        # всего ответов
+            'valid': 0,        # валидны сразу
+            'repaired': 0,     # валидны после локального ремонта
+            'reasked': 0,      # понадобился перезапрос отдельных полей
+            'regenerated': 0,  # понадобилась полная перегенерация
+            'failed': 0,
+        }
+
+    def _request(self, prompt: str, model: str, temperature: float, refresh: bool = False,
+                 cacheable: Optional[bool] = None) -> str:
+        messages = [{"role": "user", "content": prompt}]
+        # refresh: перегенерация не должна получить из кэша ответ, который только что забраковали
+        response = self.llm._make_request(messages, model, temperature, None, True, refresh=refresh, cacheable=cacheable)
+        return response["choices"][0]["message"]["content"]
+
+    def _reask_prompt(self, schema: Type[BaseModel], data: Dict[str, Any], error: ValidationError) -> Tuple[str, List[str]]:
+        fields = sorted({str(err['loc'][0]) for err in error.errors() if err.get('loc')})
+        properties = schema.model_json_schema().get('properties', {})
+        problems = '\n'.join(f"- {'.'.join(map(str, err['loc']))}: {err['msg']}" for err in error.errors())
+        prompt = f"""
+        В твоём JSON-ответе невалидны поля: {', '.join(fields)}.
+        Ошибки:
+        {problems}
+
+        Верни JSON-объект ТОЛЬКО с этими полями по схеме:
+        {json.dumps({f: properties.get(f, {}) for f in fields}, ensure_ascii=False)}
+
+        Текущие значения:
+        {json.dumps({f: data.get(f) for f in fields}, ensure_ascii=False, default=str)}
+        """
+        return prompt, fields
+
+    def generate(self, prompt: str, schema: Type[M], model: str, temperature: float = 0.3,
+                 cacheable: Optional[bool] = None) -> M:
+        self.counters['total'] += 1
+
+        for regeneration in range(self.max_regenerations + 1):
+            if regeneration:
+                self.counters['regenerated'] += 1
+                self.logger.warning(f"🔁 Полная перегенерация структурированного ответа ({regeneration})")
+
+            try:
+                response = self._request(prompt, model, temperature, refresh=bool(regeneration), cacheable=cacheable)
+                data, fixes = parse_json_response(response)
+            except json.JSONDecodeError as e:
+                self.logger.warning(f"⚠️ Ответ не удалось разобрать даже после ремонта: {e}")
+                continue
+            if not isinstance(data, dict):
+                continue
+
+            for reask in range(self.max_reasks + 1):
+                try:
+                    result = schema.model_validate(data)
+                except ValidationError as e:
+                    if reask == self.max_reasks:
+                        break
+                    reask_prompt, fields = self._reask_prompt(schema, data, e)
+                    self.logger.info(f"🩹 Перезапрос полей {fields}")
+                    try:
+                        patch, _ = parse_json_response(
+                            self._request(reask_prompt, model, temperature, cacheable=cacheable)
+                        )
+                    except json.JSONDecodeError:
+                        break
+                    if not isinstance(patch, dict):
+                        break
+                    data.update({k: v for k, v in patch.items() if k in fields})
+                    self.counters['reasked'] += 1
+                    continue
+
+                if not regeneration and not reask:
+                    self.counters['repaired' if fixes else 'valid'] += 1
+                if fixes:
+                    self.logger.info(f"🩹 JSON отремонтирован локально: {fixes}")
+                return result
+
+        self.counters['failed'] += 1
+        raise ValueError(f"Не удалось получить валидный ответ по схеме {schema.__name__}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.counters)
+        total = stats['total'] or 1
+        stats['repair_rate'] = stats['repaired'] / total * 100
+        stats['reask_rate'] = stats['reasked'] / total * 100
+        stats['regeneration_rate'] = stats['regenerated'] / total * 100
+        return stats
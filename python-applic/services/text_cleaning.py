@@ -0,0 +1,120 @@
+import re
+from typing import Dict, Iterable, List, Optional
+
+# Предкомпилированные шаблоны (раньше компилировались/искались в кэше re на каждом вызове)
+TAG_RE = re.compile(r'<[^>]+>')
+ENTITY_RE = re.compile(r'&[a-zA-Z0-9#]+;')
+MULTI_SPACE_RE = re.compile(r'\s{2,}')
+URL_LINE_RE = re.compile(r'^https?://\S+$')
+
+
+class KeywordMatcher:
+    """
+    Мультипаттерн-поиск подстрок за один проход по строке (в духе Aho-Corasick).
+    Ключевые слова собираются в префиксное дерево, из которого строится одно
+    регулярное выражение без перебора альтернатив с общим префиксом.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = tuple(dict.fromkeys(kw.lower() for kw in keywords if kw))
+        trie: Dict[str, dict] = {}
+        for kw in self.keywords:
+            node = trie
+            for char in kw:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        self._pattern = re.compile(self._trie_to_pattern(trie)) if self.keywords else None
+
+    @classmethod
+    def _trie_to_pattern(cls, node: Dict[str, dict]) -> str:
+        # Конец слова внутри узла означает, что ключ короче — совпадения достаточно
+        if '' in node:
+            return ''
+
+        branches = [re.escape(char) + cls._trie_to_pattern(child) for char, child in sorted(node.items())]
+        if len(branches) == 1:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')'
+
+    def search(self, text: str) -> bool:
+        """Есть ли в тексте хотя бы одно ключевое слово (без учёта регистра)."""
+        if self._pattern is None or not text:
+            return False
+        return self._pattern.search(text.lower()) is not None
+
+    __contains__ = search
+
+
+NAV_KEYWORDS = KeywordMatcher([
+    'войти', 'login', 'регистрация', 'register', 'меню', 'menu', 'подписаться', 'subscribe',
+    'перейти к навигации', 'перейти к поиску', 'вики любит', 'заглавная', 'порталы', 'справка',
+    'карма', 'профиль', '@',
+])
+
+SKIP_WORDS = KeywordMatcher([
+    'войти', 'регистрация', 'меню', 'подписаться', 'карма', 'профиль', '@', 'перейти к навигации',
+    'перейти к поиску', 'вики любит', 'заглавная', 'порталы', 'справка', 'узнать больше',
+])
+
+
+def clean_text(text: str, nav_matcher: Optional[KeywordMatcher] = None) -> str:
+    """
+    Однопроходная очистка текста: теги и HTML-сущности снимаются над всем текстом,
+    дальше каждая строка обрабатывается один раз (нормализация пробелов, фильтр
+    навигации и голых URL). Результат идемпотентен: повторный вызов ничего не меняет.
+    """
+    if not text:
+        return ""
+
+    matcher = nav_matcher or NAV_KEYWORDS
+    text = ENTITY_RE.sub(' ', TAG_RE.sub('', text))
+
+    cleaned_lines: List[str] = []
+    append = cleaned_lines.append
+    for line in text.split('\n'):
+        line = line.strip()
+        if len(line) < 3:
+            continue
+
+        # Схлопываем пробелы до проверок длины, чтобы повторная очистка не отбрасывала новые строки
+        line = MULTI_SPACE_RE.sub(' ', line)
+        if len(line) < 3:
+            continue
+
+        # Skip nav/UI (дешёвая проверка длины идёт первой)
+        if len(line) < 20 and matcher.search(line):
+            continue
+
+        # Skip URLs
+        if line[0] == 'h' and URL_LINE_RE.match(line):
+            continue
+
+        append(line)
+
+    return '\n'.join(cleaned_lines)
+
+
+# Грубая оценка без токенайзера: для смеси кириллицы и латиницы ~3 символа на токен
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_into_blocks(text: str, min_length: int = 20) -> List[str]:
+    """Разбивает очищенный текст на блоки-абзацы, отбрасывая короткие обрывки."""
+    return [block for block in (b.strip() for b in text.split('\n')) if len(block) >= min_length]
+
+
+def take_within_budget(blocks: Iterable[str], token_budget: int) -> List[str]:
+    """Берёт блоки по порядку, пока укладываемся в бюджет токенов."""
+    selected: List[str] = []
+    used = 0
+    for block in blocks:
+        cost = estimate_tokens(block) + 1  # +1 на перевод строки
+        if used + cost > token_budget:
+            break
+        selected.append(block)
+        used += cost
+    return selected
@@ -0,0 +1,120 @@
+import hashlib
+from typing import Iterable, List, Set
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Параметры, которые не меняют содержимое страницы
+TRACKING_PARAMS = frozenset({
+    'gclid', 'fbclid', 'yclid', 'ysclid', 'msclkid', '_openstat',
+})
+TRACKING_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _is_tracking(param: str) -> bool:
+    param = param.lower()
+    return param in TRACKING_PARAMS or param.startswith(TRACKING_PREFIXES)
+
+
+def normalize_url(url: str) -> str:
+    """
+    Рабочая нормализованная форма URL: схема по умолчанию https, хост в нижнем регистре
+    (IDN → punycode), без порта по умолчанию, фрагмента, трекинг-параметров и завершающего слэша.
+    Параметры запроса сортируются. Неразбираемый адрес (порт вне диапазона, битый IPv6)
+    возвращается как есть, чтобы одна плохая строка не роняла обработку всего пакета.
+    """
+    url = url.strip()
+    if not url:
+        return ""
+    if '://' not in url:
+        url = 'https://' + url.lstrip('/')
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if not host.isascii():
+        try:
+            host = host.encode('idna').decode('ascii')
+        except UnicodeError:
+            pass
+
+    netloc = host
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{port}"
+
+    path = parts.path
+    while '//' in path:
+        path = path.replace('//', '/')
+    path = path.rstrip('/')
+
+    query = ''
+    if parts.query:
+        query = urlencode(sorted(
+            (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking(key)
+        ))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def url_key(url: str) -> str:
+    """Ключ для поиска дубликатов: http/https и www.-варианты одного адреса совпадают."""
+    normalized = normalize_url(url)
+    if not normalized:
+        return ""
+    key = normalized.split('://', 1)[1]
+    return key[4:] if key.startswith('www.') else key
+
+
+def url_hash(url: str) -> int:
+    """64-битный хэш ключа URL — компактный элемент индекса существующих строк."""
+    return int.from_bytes(hashlib.blake2b(url_key(url).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def url_variants(url: str) -> List[str]:
+    """
+    Варианты адреса для проверки доступности: https/http, с www. и без.
+    Меняются только схема и хост — путь, параметры, их порядок и фрагмент остаются как в исходном URL,
+    ведь загружать нужно ту же страницу, что записана в таблице (нормализация — только для ключа url_key).
+    """
+    url = url.strip()
+    if not url:
+        return []
+    if '://' not in url:
+        url = 'https://' + url.lstrip('/')
+    rest = url.split('://', 1)[1]
+    cut = min((i for i in (rest.find(c) for c in '/?#') if i >= 0), default=len(rest))
+    host, tail = rest[:cut], rest[cut:]
+    bare = host[4:] if host.lower().startswith('www.') else host
+    variants = [url]
+    for candidate in (f"https://{host}{tail}", f"http://{host}{tail}", f"https://www.{bare}{tail}",
+                      f"http://www.{bare}{tail}", f"https://{bare}{tail}", f"http://{bare}{tail}"):
+        if candidate not in variants:
+            variants.append(candidate)
+    return variants
+
+
+class URLIndex:
+    """Хэш-индекс канонических URL: проверка и добавление за O(1)."""
+
+    def __init__(self, urls: Iterable[str] = ()):
+        self._hashes: Set[int] = set()
+        for url in urls:
+            self.add(url)
+
+    def add(self, url: str) -> bool:
+        """Добавляет URL; False, если такой адрес (с точностью до канонизации) уже есть."""
+        if not url or not url.strip():
+            return False
+        digest = url_hash(url)
+        if digest in self._hashes:
+            return False
+        self._hashes.add(digest)
+        return True
+
+    def __contains__(self, url: str) -> bool:
+        return url_hash(url) in self._hashes
+
+    def __len__(self) -> int:
+        return len(self._hashes)
@@ -1,16 +1,39 @@
-from typing import List, Dict, Any
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import time
+from itertools import islice
+from typing import Callable, List, Dict, Any, Optional
 from prefect import get_run_logger, task, get_client  # type: ignore
 from prefect.context import get_run_context  # type: ignore
 from prefect.cache_policies import NO_CACHE  # type: ignore
 from prefect.states import Cancelling  # type: ignore
-from models import LightTask
-from services.vector_ingestion_service import VectorIngestionService
+from checkpoint import CheckpointJournal
+from metrics import METRICS
+from models import LightTask, ResultTable
+from profiling import profile_worker
+from services.vector_ingestion_service import VectorIngestionService, build_vector_ingestion
+from task_store import LeaseHeartbeat, TaskStore
 import asyncio
 
 
-@task(retries=3, retry_delay_seconds=10, cache_policy=NO_CACHE)
-def process_single_url(task_obj: LightTask, vector_ingestion: VectorIngestionService) -> Dict[str, Any]:
-    logger = get_run_logger()
+RATE_LIMIT_ERROR = "Rate limit исчерпан"
+CANCELLED_ERROR = "Flow cancelled"
+# Как часто родитель шардированного запуска спрашивает у Prefect, не отменён ли flow
+CANCEL_CHECK_SECONDS = 10
+
+
+def ingest_one(task_obj: LightTask, vector_ingestion: VectorIngestionService, logger) -> Dict[str, Any]:
+    """Обработка одного URL с классификацией результата (completed / error / skipped)"""
+    with METRICS.span("url"):
+        res = _ingest_one(task_obj, vector_ingestion, logger)
+    METRICS.inc(f"urls_{res['status']}")
+    return res
+
+
+def _ingest_one(task_obj: LightTask, vector_ingestion: VectorIngestionService, logger) -> Dict[str, Any]:
     logger.info(f"🔄 Обработка {task_obj.url}")
     try:
         success = vector_ingestion.ingest_url(task_obj)
@@ -24,10 +47,50 @@ def process_single_url(task_obj: LightTask, vector_ingestion: VectorIngestionSer
         error_msg = str(e)
         # Если это rate limit, возвращаем специальный статус
         if "rate limit" in error_msg.lower() or "quota" in error_msg.lower():
-            return {"url": task_obj.url, "status": "skipped", "error": "Rate limit исчерпан"}
+            return {"url": task_obj.url, "status": "skipped", "error": RATE_LIMIT_ERROR}
         return {"url": task_obj.url, "status": "error", "error": error_msg}
 
 
+@task(retries=3, retry_delay_seconds=10, cache_policy=NO_CACHE)
+def process_single_url(task_obj: LightTask, vector_ingestion: VectorIngestionService) -> Dict[str, Any]:
+    return ingest_one(task_obj, vector_ingestion, get_run_logger())
+
+
+def record_result(
+    processed_results: ResultTable,
+    res: Dict[str, Any],
+    journal: Optional[CheckpointJournal] = None,
+) -> str:
+    """Раскладывает результат по success/errors/skipped и пишет завершённые в журнал"""
+    # Безопасная проверка ключей
+    url = res.get("url", "Unknown URL")
+    status = res.get("status", "unknown")
+    error_msg = res.get("error", "")
+
+    if status == "completed":
+        processed_results.add(url, status, category="success")
+        if journal:
+            journal.append(res)
+        return "success"
+
+    if error_msg == RATE_LIMIT_ERROR:
+        processed_results.add(url, status, error_msg, category="skipped")
+        return "skipped"
+
+    # Гарантируем, что в errors есть все необходимые ключи
+    error_entry = {
+        "url": url,
+        "status": status,
+        "error": error_msg or "Unknown error"
+    }
+    # Добавляем остальные поля из res
+    error_entry.update({k: v for k, v in res.items() if k not in error_entry})
+    processed_results.add(url, status, error_entry["error"], category="errors")
+    if journal:
+        journal.append(error_entry)
+    return "errors"
+
+
 async def check_if_cancelled(flow_run_id: str) -> bool:
     """Проверяет, находится ли flow run в состоянии отмены"""
     try:
@@ -45,27 +108,32 @@ def sync_check_if_cancelled(flow_run_id: str) -> bool:
     return asyncio.run(check_if_cancelled(flow_run_id))
 
 
+def _current_flow_run_id() -> Optional[str]:
+    try:
+        context = get_run_context()
+        if context and hasattr(context, 'flow_run'):
+            return str(context.flow_run.id)
+    except Exception:
+        pass
+    return None
+
+
 def urls_to_database(
     tasks_to_process: List[LightTask],
     vector_ingestion: VectorIngestionService,
     logger=None,
     batch_size: int = 1,
-) -> Dict[str, List[Dict[str, Any]]]:
+    journal: Optional[CheckpointJournal] = None,
+) -> ResultTable:
     if logger is None:
         logger = get_run_logger()
 
     # Получаем ID текущего flow run
-    flow_run_id = None
-    try:
-        context = get_run_context()
-        if context and hasattr(context, 'flow_run'):
-            flow_run_id = str(context.flow_run.id)
-    except Exception:
-        pass
+    flow_run_id = _current_flow_run_id()
 
     logger.info(f"🚀 Запуск обработки {len(tasks_to_process)} URL, batch_size={batch_size}")
 
-    processed_results = {"success": [], "errors": [], "skipped": []}
+    processed_results = ResultTable()
     batches = [tasks_to_process[i:i + batch_size] for i in range(0, len(tasks_to_process), batch_size)]
 
     for batch_num, batch in enumerate(batches, 1):
@@ -73,19 +141,14 @@ def urls_to_database(
         if flow_run_id and sync_check_if_cancelled(flow_run_id):
             logger.warning(f"⏹ Flow отменён, прерываем обработку на батче {batch_num}")
             # Добавляем все оставшиеся задачи в skipped
-            for remaining_batch in batches[batch_num-1:]:
-                for task_obj in remaining_batch:
-                    processed_results["skipped"].append({
-                        "url": getattr(task_obj, 'url', 'Unknown URL'),
-                        "status": "skipped",
-                        "error": "Flow cancelled"
-                    })
+            _skip_cancelled(processed_results, tasks_to_process, (batch_num - 1) * batch_size)
             break
 
         logger.info(f"🔧 Батч {batch_num}/{len(batches)} ({len(batch)} URL)")
 
         futures = [process_single_url.submit(task_obj, vector_ingestion) for task_obj in batch]
 
+        cancelled = False
         for i, fut in enumerate(futures):
             # Проверка отмены перед получением результата
             if flow_run_id and asyncio.run(check_if_cancelled(flow_run_id)):
@@ -97,52 +160,228 @@ def urls_to_database(
                             futures[j].cancel()
                     except Exception:
                         pass
-                    processed_results["skipped"].append({
-                        "url": getattr(batch[j], 'url', 'Unknown URL'),
-                        "status": "skipped",
-                        "error": "Flow cancelled"
-                    })
-                # Добавляем оставшиеся батчи в skipped
-                for remaining_batch_idx in range(batch_num, len(batches)):
-                    for task_obj in batches[remaining_batch_idx]:
-                        processed_results["skipped"].append({
-                            "url": getattr(task_obj, 'url', 'Unknown URL'),
-                            "status": "skipped",
-                            "error": "Flow cancelled"
-                        })
+                # Текущий батч с i-й задачи и все следующие батчи — в skipped
+                _skip_cancelled(processed_results, tasks_to_process, (batch_num - 1) * batch_size + i)
+                cancelled = True
                 break
 
             try:
-                res = fut.result()
-                # Безопасная проверка ключей
-                status = res.get("status", "unknown")
-                error_msg = res.get("error", "")
-
-                if status == "completed":
-                    processed_results["success"].append(res)
-                elif error_msg == "Rate limit исчерпан":
-                    processed_results["skipped"].append(res)
-                else:
-                    # Гарантируем, что в errors есть все необходимые ключи
-                    error_entry = {
-                        "url": res.get("url", "Unknown URL"),
-                        "status": status,
-                        "error": error_msg or "Unknown error"
-                    }
-                    # Добавляем остальные поля из res
-                    error_entry.update({k: v for k, v in res.items() if k not in error_entry})
-                    processed_results["errors"].append(error_entry)
-
+                record_result(processed_results, fut.result(), journal)
             except Exception as e:
                 logger.warning(f"⚠️ Задача прервана или ошибка: {e}")
-                processed_results["skipped"].append({
-                    "url": getattr(batch[i], 'url', 'Unknown URL') if i < len(batch) else "Unknown URL",
-                    "status": "skipped",
-                    "error": str(e)
-                })
-
-    logger.info(
-        f"✅ Завершено. Success={len(processed_results['success'])}, "
-        f"Errors={len(processed_results['errors'])}, Skipped={len(processed_results['skipped'])}"
+                processed_results.add(
+                    getattr(batch[i], 'url', 'Unknown URL') if i < len(batch) else "Unknown URL",
+                    "skipped", str(e),
+                )
+        if cancelled:
+            break
+
+    _log_totals(logger, "✅ Завершено.", processed_results)
+    return processed_results
+
+
+def _skip_cancelled(processed_results: ResultTable, tasks: List[LightTask], start: int) -> None:
+    """Все задачи с позиции start — в skipped одной записью на URL, без словаря на задачу"""
+    processed_results.add_many(
+        (getattr(t, 'url', 'Unknown URL') for t in islice(tasks, start, None)), "skipped", CANCELLED_ERROR,
     )
+
+
+def _log_totals(logger, prefix: str, processed_results: ResultTable) -> None:
+    counts = processed_results.counts()
+    logger.info(f"{prefix} Success={counts['success']}, Errors={counts['errors']}, Skipped={counts['skipped']}")
+
+
+def lease_worker(
+    worker_id: str,
+    spreadsheet_id: str,
+    sheet_name: str,
+    journal_key: str,
+    lease_seconds: float = 300,
+    extraction_workers: int = 1,
+    ingestion_factory: Callable[..., VectorIngestionService] = build_vector_ingestion,
+    stop_event: Optional[Any] = None,
+) -> Dict[str, Any]:
+    """
+    Точка входа процесса-воркера: арендует URL из общей очереди TaskStore, пока она не опустеет.
+    Аренда продлевается heartbeat'ом; если процесс умрёт, родитель сразу вернёт его URL в очередь
+    (а при падении всего запуска они вернутся по истечении аренды).
+    Новые URL не берутся, как только родитель выставил stop_event (отмена flow, ошибка) или сам умер:
+    текущий URL дорабатывается, и воркер завершается.
+    """
+    # Пулы извлечения всех воркеров делят ядра машины
+    os.environ.setdefault("EXTRACTION_WORKERS", str(extraction_workers))
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [{worker_id}] %(levelname)s %(message)s")
+    logger = logging.getLogger(f"lease_worker.{worker_id}")
+    # Метрики считаем только свои: родитель сольёт их со снимками остальных воркеров
+    METRICS.reset()
+
+    store = TaskStore(logger=logger, lease_seconds=lease_seconds)
+    vector_ingestion = ingestion_factory(spreadsheet_id, sheet_name, logger, task_store=store)
+    processed_results = ResultTable()
+
+    with profile_worker(f"worker-{worker_id}", logger), \
+            CheckpointJournal(run_key=journal_key, writer_id=worker_id, logger=logger) as journal, \
+            LeaseHeartbeat(store, worker_id):
+        idle_since = None
+        parent = multiprocessing.parent_process()
+        while True:
+            if (stop_event is not None and stop_event.is_set()) or (parent is not None and not parent.is_alive()):
+                logger.warning("⏹ Запуск остановлен, воркер не берёт новые URL")
+                break
+            claimed = store.claim(worker_id)
+            if not claimed:
+                # Очередь пуста, но импорт из таблицы ещё идёт — ждём следующую страницу
+                idle_since = idle_since or time.monotonic()
+                if store.import_done() or time.monotonic() - idle_since > lease_seconds:
+                    break
+                if stop_event is not None:
+                    stop_event.wait(1)
+                else:
+                    time.sleep(1)
+                continue
+            idle_since = None
+
+            task_obj = claimed[0]
+            outcome = record_result(processed_results, ingest_one(task_obj, vector_ingestion, logger), journal)
+            if outcome == "skipped":
+                # Квота исчерпана — возвращаем URL в очередь и не берём новые
+                store.release(task_obj.url)
+                logger.warning("⏹ Rate limit исчерпан, воркер останавливается")
+                break
+            store.complete(task_obj.url, outcome == "success")
+
+    _log_totals(logger, f"✅ Воркер {worker_id} завершён.", processed_results)
+    # Метрики процесса уходят родителю вместе с результатами
+    return {"results": processed_results, "metrics": METRICS.snapshot()}
+
+
+def _lease_worker_process(result_queue, worker_id: str, *args) -> None:
+    """Цель процесса-воркера: результат lease_worker (или текст исключения) уходит родителю через очередь."""
+    try:
+        result_queue.put((worker_id, lease_worker(worker_id, *args), None))
+    except Exception as e:
+        result_queue.put((worker_id, None, f"{type(e).__name__}: {e}"))
+
+
+def urls_to_database_sharded(
+    spreadsheet_id: str,
+    sheet_name: str,
+    workers: int,
+    journal_key: str,
+    logger=None,
+    lease_seconds: float = 300,
+    ingestion_factory: Callable[..., VectorIngestionService] = build_vector_ingestion,
+    task_store: Optional[TaskStore] = None,
+    max_restarts: Optional[int] = None,
+    stop_grace_seconds: float = 60,
+) -> ResultTable:
+    """
+    Обработка очереди TaskStore в workers отдельных процессах. Воркеры не делят список заранее,
+    а арендуют URL по одному, поэтому медленные страницы не тормозят остальных.
+
+    Каждый воркер — независимый multiprocessing.Process, а не задача общего пула: смерть одного
+    (OOM killer, segfault) не ломает остальных. Родитель следит за кодами выхода, сразу возвращает
+    аренды умершего в очередь и запускает замену (не больше max_restarts раз, по умолчанию workers).
+    Итоги умершего воркера берутся из его сегментов журнала контрольных точек.
+
+    При отмене flow (проверка раз в CANCEL_CHECK_SECONDS) или исключении в родителе выставляется общее
+    событие остановки: воркеры дорабатывают текущий URL и выходят, замены не запускаются.
+    Не успевшие за stop_grace_seconds завершаются принудительно, их аренды возвращаются в очередь.
+    """
+    if logger is None:
+        logger = get_run_logger()
+    store = task_store or TaskStore(logger=logger, lease_seconds=lease_seconds)
+    journal = CheckpointJournal(run_key=journal_key, logger=logger)
+    if max_restarts is None:
+        max_restarts = workers
+
+    extraction_workers = max(1, (os.cpu_count() or 1) // workers)
+    run_id = f"{socket.gethostname()}-{os.getpid()}"
+    logger.info(f"🚀 Запуск {workers} воркеров (пул извлечения по {extraction_workers} процессов)")
+
+    # spawn: процесс Prefect многопоточный, fork из него небезопасен
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    stop_event = ctx.Event()
+    worker_args = (spreadsheet_id, sheet_name, journal_key, lease_seconds, extraction_workers, ingestion_factory,
+                   stop_event)
+    flow_run_id = _current_flow_run_id()
+    next_cancel_check = time.monotonic() + CANCEL_CHECK_SECONDS
+    running: Dict[str, multiprocessing.process.BaseProcess] = {}
+    reported: Dict[str, Optional[str]] = {}
+    processed_results = ResultTable()
+
+    def start(worker_id: str) -> None:
+        # Не daemon: у воркера может быть свой пул процессов извлечения
+        proc = ctx.Process(target=_lease_worker_process, args=(result_queue, worker_id, *worker_args), name=worker_id)
+        proc.start()
+        running[worker_id] = proc
+
+    def collect(block: bool) -> None:
+        try:
+            worker_id, part, error = result_queue.get(timeout=1) if block else result_queue.get_nowait()
+        except queue.Empty:
+            return
+        reported[worker_id] = error
+        if error is None:
+            METRICS.merge(part["metrics"])
+            processed_results.extend(part["results"])
+
+    restarts = 0
+    try:
+        for i in range(workers):
+            start(f"{run_id}-w{i}")
+        while running:
+            # Очередь вычитываем до join: иначе воркер с большим результатом не сможет завершиться
+            collect(block=True)
+            if flow_run_id and not stop_event.is_set() and time.monotonic() >= next_cancel_check:
+                next_cancel_check = time.monotonic() + CANCEL_CHECK_SECONDS
+                if sync_check_if_cancelled(flow_run_id):
+                    logger.warning("⏹ Flow отменён, воркеры дорабатывают текущие URL и останавливаются")
+                    stop_event.set()
+            finished = [worker_id for worker_id, proc in running.items() if not proc.is_alive()]
+            for worker_id in finished:
+                proc = running.pop(worker_id)
+                proc.join()
+                # Результат мог попасть в канал уже после последнего чтения
+                while worker_id not in reported and not result_queue.empty():
+                    collect(block=False)
+                if worker_id in reported and reported[worker_id] is None:
+                    continue
+                if worker_id in reported:
+                    logger.error(f"❌ Воркер {worker_id} упал: {reported[worker_id]}")
+                else:
+                    logger.error(f"❌ Воркер {worker_id} умер без результата (код выхода {proc.exitcode})")
+                # Итоги, которые воркер успел записать, восстанавливаем из его сегментов журнала
+                for res in journal.writer_records(worker_id).values():
+                    record_result(processed_results, res)
+                released = store.release_worker(worker_id)
+                if released:
+                    logger.warning(f"↩️ {released} URL воркера {worker_id} возвращены в очередь")
+                # Исключение в lease_worker скорее всего повторится, перезапускаем только убитые процессы
+                if worker_id not in reported and restarts < max_restarts and not stop_event.is_set() \
+                        and (store.pending(limit=1) or not store.import_done()):
+                    restarts += 1
+                    replacement = f"{run_id}-r{restarts}"
+                    logger.warning(f"🔁 Перезапуск воркера {worker_id} как {replacement}")
+                    start(replacement)
+    finally:
+        # Сюда попадаем с живыми воркерами только при исключении в родителе
+        stop_event.set()
+        deadline = time.monotonic() + stop_grace_seconds
+        while running and time.monotonic() < deadline:
+            collect(block=True)
+            for worker_id in [worker_id for worker_id, proc in running.items() if not proc.is_alive()]:
+                running.pop(worker_id).join()
+        for proc in running.values():
+            proc.terminate()
+            proc.join()
+        for worker_id in running:
+            released = store.release_worker(worker_id)
+            if released:
+                logger.warning(f"↩️ {released} URL воркера {worker_id} возвращены в очередь")
+        result_queue.close()
+
+    _log_totals(logger, "✅ Завершено.", processed_results)
     return processed_results
@@ -1,46 +1,79 @@
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
+from prefect.utilities.asyncutils import run_coro_as_sync # type: ignore
+from metrics import METRICS
 from models import LightTask
 from services.simple_scraper import SimpleScraperService
 from services.vector_store import VectorStoreService
+from task_store import TaskStore
 
 
 class VectorIngestionService:
     """Сервис для сохранения URL в векторную БД"""
 
-    def __init__(self, vector_store: VectorStoreService, sheets_service, spreadsheet_id: str, sheet_name: str, logger):
+    def __init__(self, vector_store: VectorStoreService, sheets_service, spreadsheet_id: str, sheet_name: str, logger,
+                 task_store: Optional[TaskStore] = None, scraper: Optional[SimpleScraperService] = None):
         self.vector_store = vector_store
         self.sheets_service = sheets_service
+        self.task_store = task_store
         self.spreadsheet_id = spreadsheet_id
         self.sheet_name = sheet_name
         self.logger = logger
 
         # ✅ управляющий LLM
-        self.scraper = SimpleScraperService(logger=self.logger, use_llm=True)
+        self.scraper = scraper or SimpleScraperService(logger=self.logger, use_llm=True)
         # self.scraper = SimpleScraperService(logger=self.logger, use_llm=False)
 
+    def _set_status(self, url: str, status: str) -> None:
+        """Статус задачи: в локальное хранилище (уйдёт в таблицу пакетом) или сразу в таблицу"""
+        if self.task_store is not None:
+            self.task_store.set_status(url, status)
+        else:
+            self.sheets_service.update_task_status(self.spreadsheet_id, self.sheet_name, url, status)
+
     def ingest_url(self, task: LightTask) -> bool:
         """Обработка и сохранение одного URL в векторную БД"""
+        return run_coro_as_sync(self.ingest_url_async(task))
+
+    async def _url_exists(self, url: str) -> bool:
+        if hasattr(self.vector_store, 'url_exists_async'):
+            return await self.vector_store.url_exists_async(url)
+        if hasattr(self.vector_store, 'url_exists'):
+            return await asyncio.to_thread(self.vector_store.url_exists, url)
+        return False
+
+    async def _add_chunks(self, chunks: List[Dict]) -> bool:
+        if hasattr(self.vector_store, 'add_chunks_async'):
+            return await self.vector_store.add_chunks_async(chunks)
+        return await asyncio.to_thread(self.vector_store.add_chunks, chunks)
+
+    async def ingest_url_async(self, task: LightTask) -> bool:
+        """
+        Асинхронная обработка URL: проверка в БД и загрузка страницы идут параллельно,
+        загрузка отменяется, если URL уже есть в БД.
+        """
+        fetch = asyncio.create_task(self.scraper.get_page_info(task.url, use_llm=True))
         try:
-            if hasattr(self.vector_store, 'url_exists') and self.vector_store.url_exists(task.url):
+            with METRICS.span("exists"):
+                exists = await self._url_exists(task.url)
+            if exists:
+                fetch.cancel()
                 self.logger.info(f"URL уже в БД: {task.url}")
-                self.sheets_service.update_task_status(
-                    self.spreadsheet_id, self.sheet_name, task.url, "completed"
-                )
+                await asyncio.to_thread(self._set_status, task.url, "completed")
                 return True
 
-            self.sheets_service.update_task_status(
-                self.spreadsheet_id, self.sheet_name, task.url, "processing"
-            )
+            await asyncio.to_thread(self._set_status, task.url, "processing")
 
-            # ✅ Используем метод scrape_page для гарантии чистого текста
-            content = self.scraper.scrape_page(task.url, use_llm=True)
+            # ✅ get_page_info возвращает уже очищенный текст
+            page_info = await fetch
+            content = page_info["content"] if page_info.get("success") else None
+            if content is None:
+                self.logger.error(f"Failed: {page_info.get('error_message', 'Unknown')}")
 
             # ✅ Дополнительная проверка
             if not content or len(content.strip()) < 100:
                 self.logger.error(f"Контент слишком короткий или отсутствует для URL: {task.url}")
-                self.sheets_service.update_task_status(
-                    self.spreadsheet_id, self.sheet_name, task.url, "error"
-                )
+                await asyncio.to_thread(self._set_status, task.url, "error")
                 return False
 
             # ✅ Финальная валидация перед векторизацией
@@ -49,45 +82,43 @@ class VectorIngestionService:
                 return False
 
             # Разбиваем на чанки (content уже точно чистый текст)
-            chunks = self._smart_chunk_content(content, task.url)
+            with METRICS.span("chunk"):
+                chunks = self._smart_chunk_content(content, task.url)
 
             if not chunks:
                 self.logger.error(f"Не удалось создать чанки для URL: {task.url}")
-                self.sheets_service.update_task_status(
-                    self.spreadsheet_id, self.sheet_name, task.url, "error"
-                )
+                await asyncio.to_thread(self._set_status, task.url, "error")
                 return False
 
             # Добавляем в векторную БД
             try:
-                status = self.vector_store.add_chunks(chunks)
+                status = await self._add_chunks(chunks)
                 if not status:
                     raise Exception("Failed!")
                 if hasattr(self.vector_store, 'mark_url_processed'):
                     self.vector_store.mark_url_processed(task.url)
             except Exception as e:
                 self.logger.error(f"Ошибка добавления в векторную БД для {task.url}: {e}")
-                self.sheets_service.update_task_status(
-                    self.spreadsheet_id, self.sheet_name, task.url, "error"
-                )
+                await asyncio.to_thread(self._set_status, task.url, "error")
                 return False
 
             # Обновляем статус на "completed"
-            self.sheets_service.update_task_status(
-                self.spreadsheet_id, self.sheet_name, task.url, "completed"
-            )
+            await asyncio.to_thread(self._set_status, task.url, "completed")
 
             self.logger.info(f"✅ Успешно обработан URL: {task.url}, добавлено чанков: {len(chunks)}")
             return True
 
         except Exception as e:
             self.logger.error(f"❌ Ошибка обработки {task.url}: {e}")
-            self.sheets_service.update_task_status(
-                self.spreadsheet_id, self.sheet_name, task.url, "error"
-            )
+            await asyncio.to_thread(self._set_status, task.url, "error")
             if hasattr(self.vector_store, 'mark_url_error'):
                 self.vector_store.mark_url_error(task.url)
             return False
+        finally:
+            if not fetch.done():
+                fetch.cancel()
+            elif not fetch.cancelled():
+                fetch.exception()  # исключение отменённой загрузки не должно всплыть в логах loop
 
     def _smart_chunk_content(self, content: str, url: str,
                             min_size: int = 800, max_size: int = 1200) -> List[Dict]:
@@ -153,3 +184,14 @@ class VectorIngestionService:
         """Закрываем scraper при удалении объекта"""
         if hasattr(self, 'scraper'):
             self.scraper.close()
+
+
+def build_vector_ingestion(spreadsheet_id: str, sheet_name: str, logger, task_store: Optional[TaskStore] = None,
+                           sheets_service=None) -> VectorIngestionService:
+    """
+    Фабрика сервиса векторизации по умолчанию. LightPipeline и процессы-воркеры создают сервис через фабрику,
+    поэтому её можно подменить (например, в бенчмарке); для воркеров фабрика должна быть picklable.
+    """
+    return VectorIngestionService(
+        VectorStoreService(logger=logger), sheets_service, spreadsheet_id, sheet_name, logger, task_store=task_store
+    )
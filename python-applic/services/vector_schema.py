@@ -0,0 +1,5 @@
+"""Таблица векторного хранилища в Supabase: имена и размерность без зависимостей клиента и эмбеддера."""
+
+TABLE_NAME = "novaya"
+MATCH_FUNCTION = "match_documents_novaya_v2"
+EMBEDDING_DIM = 384
@@ -1,14 +1,29 @@
+import asyncio
 import os
 import time
+import weakref
+import httpx # type: ignore
 from supabase import create_client, Client # type: ignore
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional
 from services.local_embedder import LocalCohereClient
 
+from metrics import METRICS
 from models import SearchResult
+from services.vector_schema import MATCH_FUNCTION, TABLE_NAME
+
+
+def _postgrest_quote(value: str) -> str:
+    """Значение для списков PostgREST in.(...): в кавычках, с экранированием."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
 
 class VectorStoreService:
-    def __init__(self, logger):
+    def __init__(self, logger, max_connections: int = 20, timeout: float = 30.0):
         self.logger = logger
+        self.max_connections = max_connections
+        self.timeout = timeout
+        # httpx.AsyncClient привязан к event loop — держим по клиенту на loop
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
         self.supabase_url = os.getenv("SUPABASE_URL")
         self.supabase_key = os.getenv("SUPABASE_KEY")
 
@@ -28,6 +43,66 @@ class VectorStoreService:
             self.logger.error(f"❌ Ошибка инициализации VectorStoreService: {e}")
             raise
 
+    def _prepare_rows(self, chunks: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """Эмбеддинги и строки для таблицы (CPU-bound, общий для sync и async путей)"""
+        texts = [chunk["text"] for chunk in chunks if chunk.get("text")]
+        if not texts:
+            self.logger.error("❌ Не найдено текстов для создания эмбеддингов")
+            return None
+
+        # response = self.cohere_client.embed(
+        #     texts=texts,
+        #     model="embed-multilingual-light-v3.0",
+        #     input_type="search_document"
+        # )
+        # embeddings = response.embeddings embed_documents
+        with METRICS.span("embed"):
+            response = self.cohere_client.embed_documents(texts=texts)
+        embeddings_list = response.embeddings.tolist()
+
+        # ✅ Проверка размерности
+        if len(embeddings_list) == 0:
+            self.logger.error("❌ Эмбеддинги пустые")
+            return None
+
+        # Проверка размерности первого эмбеддинга
+        if len(embeddings_list[0]) != 384:
+            self.logger.error(f"❌ Неожиданная размерность эмбеддинга запроса: {len(embeddings_list)}, ожидается 384")
+            return None
+
+        # if embeddings and len(embeddings[0]) != 384:
+        #     self.logger.error(f"❌ Неожиданная размерность эмбеддинга: {len(embeddings[0])}, ожидается 384")
+        #     return False
+
+        rows = []
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings_list)):
+            # Берем метадату из чанка, если она есть
+            metadata = dict(chunk.get("metadata", {}))
+
+            if "loc" not in metadata:
+                chunk_size = len(chunk["text"].splitlines()) or 1
+                start_line = i * chunk_size + 1
+                end_line = (i + 1) * chunk_size
+                metadata["loc"] = {"lines": {"from": start_line, "to": end_line}}
+
+            # Дополняем обязательные поля, если их нет в метадате
+            metadata.setdefault("source", chunk.get("source", "blob"))
+            metadata.setdefault("blobType", chunk.get("blob_type", "text/plain"))
+            metadata.setdefault("chunk_index", chunk.get("chunk_index", i))
+            metadata.setdefault("total_chunks", chunk.get("total_chunks", len(chunks)))
+
+            # URL уже должен быть в метадате из _smart_chunk_content
+            # но на всякий случай добавляем проверку
+            if "url" not in metadata and "url" in chunk:
+                metadata["url"] = chunk["url"]
+
+            rows.append({
+                "content": chunk["text"],
+                "metadata": metadata,
+                "embedding": embedding
+            })
+        return rows
+
     def add_chunks(self, chunks: List[Dict[str, Any]]) -> bool:
 
         if not chunks:
@@ -37,63 +112,12 @@ class VectorStoreService:
         try:
             self.logger.info(f"📝 Добавляем {len(chunks)} чанков в векторную БД...")
 
-            texts = [chunk["text"] for chunk in chunks if chunk.get("text")]
-            if not texts:
-                self.logger.error("❌ Не найдено текстов для создания эмбеддингов")
-                return False
-
-            # response = self.cohere_client.embed(
-            #     texts=texts,
-            #     model="embed-multilingual-light-v3.0",
-            #     input_type="search_document"
-            # )
-            # embeddings = response.embeddings embed_documents
-            response = self.cohere_client.embed_documents(texts=texts)
-            embeddings_list = response.embeddings.tolist()
-
-            # ✅ Проверка размерности
-            if len(embeddings_list) == 0:
-                self.logger.error("❌ Эмбеддинги пустые")
+            rows = self._prepare_rows(chunks)
+            if not rows:
                 return False
 
-            # Проверка размерности первого эмбеддинга
-            if len(embeddings_list[0]) != 384:
-                self.logger.error(f"❌ Неожиданная размерность эмбеддинга запроса: {len(embeddings_list)}, ожидается 384")
-                return False
-
-            # if embeddings and len(embeddings[0]) != 384:
-            #     self.logger.error(f"❌ Неожиданная размерность эмбеддинга: {len(embeddings[0])}, ожидается 384")
-            #     return False
-
-            rows = []
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings_list)):
-                # Берем метадату из чанка, если она есть
-                metadata = dict(chunk.get("metadata", {}))
-
-                if "loc" not in metadata:
-                    chunk_size = len(chunk["text"].splitlines()) or 1
-                    start_line = i * chunk_size + 1
-                    end_line = (i + 1) * chunk_size
-                    metadata["loc"] = {"lines": {"from": start_line, "to": end_line}}
-
-                # Дополняем обязательные поля, если их нет в метадате
-                metadata.setdefault("source", chunk.get("source", "blob"))
-                metadata.setdefault("blobType", chunk.get("blob_type", "text/plain"))
-                metadata.setdefault("chunk_index", chunk.get("chunk_index", i))
-                metadata.setdefault("total_chunks", chunk.get("total_chunks", len(chunks)))
-
-                # URL уже должен быть в метадате из _smart_chunk_content
-                # но на всякий случай добавляем проверку
-                if "url" not in metadata and "url" in chunk:
-                    metadata["url"] = chunk["url"]
-
-                rows.append({
-                    "content": chunk["text"],
-                    "metadata": metadata,
-                    "embedding": embedding
-                })
-
-            result = self.supabase.table("novaya").upsert(rows).execute()
+            with METRICS.span("upsert"):
+                result = self.supabase.table(TABLE_NAME).upsert(rows).execute()
 
             if result.data:
                 self.logger.info(f"✅ Успешно добавлено {len(result.data)} чанков")
@@ -223,6 +247,197 @@ class VectorStoreService:
                 else:
                     return False
 
+    # ---------- Асинхронный путь: прямые запросы к PostgREST через общий пул соединений ----------
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Пул соединений для текущего event loop (создаётся при первом обращении)"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=f"{self.supabase_url.rstrip('/')}/rest/v1",
+                headers={
+                    "apikey": self.supabase_key,
+                    "Authorization": f"Bearer {self.supabase_key}",
+                    "Content-Type": "application/json",
+                },
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=httpx.Timeout(self.timeout),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def add_chunks_async(self, chunks: List[Dict[str, Any]]) -> bool:
+        """Асинхронный add_chunks: эмбеддинги в потоке, upsert через пул HTTP-соединений"""
+        if not chunks:
+            self.logger.warning("⚠️ Попытка добавить пустой список чанков")
+            return False
+
+        try:
+            self.logger.info(f"📝 Добавляем {len(chunks)} чанков в векторную БД...")
+
+            rows = await asyncio.to_thread(self._prepare_rows, chunks)
+            if not rows:
+                return False
+
+            with METRICS.span("upsert"):
+                response = await self._get_async_client().post(
+                    f"/{TABLE_NAME}",
+                    json=rows,
+                    headers={"Prefer": "return=representation,resolution=merge-duplicates"},
+                )
+            response.raise_for_status()
+            data = response.json()
+
+            if data:
+                self.logger.info(f"✅ Успешно добавлено {len(data)} чанков")
+                return True
+            else:
+                self.logger.error("❌ Данные не были добавлены в БД")
+                return False
+
+        except Exception as e:
+            self.logger.error(f"❌ Ошибка при добавлении чанков: {e}")
+            return False
+
+    async def search_async(self, query: str, top_k: int = 5, similarity_threshold: float = 0.5) -> List[SearchResult]:
+        """Асинхронный search: та же RPC-функция и тот же текстовый fallback"""
+        if not query or not query.strip():
+            self.logger.warning("⚠️ Пустой запрос для поиска")
+            return []
+
+        client = self._get_async_client()
+        try:
+            self.logger.info(f"🔍 Поиск по запросу: '{query[:50]}...'")
+
+            query_response = await asyncio.to_thread(self.cohere_client.embed_query, query)
+            query_embedding_list = query_response.tolist()
+
+            if len(query_embedding_list) != 384:
+                self.logger.error(f"❌ Неожиданная размерность эмбеддинга запроса: {len(query_embedding_list)}, ожидается 384")
+
+            response = await client.post(
+                f"/rpc/{MATCH_FUNCTION}",
+                json={
+                    'query_embedding': query_embedding_list,
+                    'match_threshold': similarity_threshold,
+                    'match_count': top_k
+                },
+            )
+            response.raise_for_status()
+            data = response.json()
+
+            if not data:
+                self.logger.info("ℹ️ Не найдено похожих документов")
+                return []
+
+            search_results = [
+                SearchResult(
+                    content=row['content'],
+                    score=row.get('similarity', 0.0),
+                    metadata=row.get('metadata', {}),
+                    id=str(row.get('id', ''))
+                )
+                for row in data
+            ]
+            self.logger.info(f"✅ Найдено {len(search_results)} релевантных документов")
+            return search_results
+
+        except Exception as e:
+            self.logger.error(f"❌ Ошибка при поиске: {e}")
+
+        try:
+            self.logger.info("🔄 Используем текстовый поиск как fallback...")
+            response = await client.get(
+                f"/{TABLE_NAME}",
+                params={"select": "id,content,metadata", "content": f"ilike.*{query}*", "limit": top_k},
+            )
+            response.raise_for_status()
+            search_results = [
+                SearchResult(
+                    content=row['content'],
+                    score=0.5,  # Фиксированный score для текстового поиска
+                    metadata=row.get('metadata', {}),
+                    id=str(row.get('id', ''))
+                )
+                for row in response.json()
+            ]
+            self.logger.info(f"✅ Текстовый поиск: найдено {len(search_results)} документов")
+            return search_results
+
+        except Exception as e:
+            self.logger.error(f"❌ Ошибка текстового поиска: {e}")
+            return []
+
+    async def urls_exist_async(self, urls: Iterable[str], batch_size: int = 50, page_size: int = 1000,
+                               retries: int = 3, delay: float = 1.0) -> Dict[str, bool]:
+        """
+        Пакетная проверка URL: запрос in.(...) на batch_size адресов, пакеты идут параллельно
+        в пределах пула соединений. У одного URL много чанков, а PostgREST обрезает ответ по max-rows,
+        поэтому пакет перезапрашивается только по ещё не найденным адресам, пока ответ не станет пустым.
+        Если проверка не удалась после всех попыток, ошибка пробрасывается: «не найден» означало бы
+        повторную загрузку уже сохранённых страниц.
+        """
+        unique = list(dict.fromkeys(url for url in urls if url))
+        found: Dict[str, bool] = {url: False for url in unique}
+        if not unique:
+            return found
+
+        client = self._get_async_client()
+        semaphore = asyncio.Semaphore(self.max_connections)
+
+        async def fetch(batch: List[str]) -> List[Dict[str, Any]]:
+            values = ",".join(_postgrest_quote(url) for url in batch)
+            params = {
+                "select": "url:metadata->>url,URL:metadata->>URL",
+                "or": f"(metadata->>url.in.({values}),metadata->>URL.in.({values}))",
+                "limit": page_size,
+            }
+            for attempt in range(1, retries + 1):
+                try:
+                    async with semaphore:
+                        response = await client.get(f"/{TABLE_NAME}", params=params)
+                    response.raise_for_status()
+                    return response.json()
+                except Exception as e:
+                    self.logger.error(f"❌ Ошибка при пакетной проверке URL (попытка {attempt}): {e}")
+                    if attempt == retries:
+                        raise
+                    await asyncio.sleep(delay)
+            return []
+
+        async def check(batch: List[str]) -> None:
+            remaining = batch
+            while remaining:
+                rows = await fetch(remaining)
+                if not rows:
+                    return
+                for row in rows:
+                    for value in (row.get("url"), row.get("URL")):
+                        if value in found:
+                            found[value] = True
+                left = [url for url in remaining if not found[url]]
+                if len(left) == len(remaining):
+                    return
+                remaining = left
+
+        await asyncio.gather(*(check(unique[i:i + batch_size]) for i in range(0, len(unique), batch_size)))
+        return found
+
+    async def url_exists_async(self, url: str) -> bool:
+        if not url:
+            return False
+        return (await self.urls_exist_async([url])).get(url, False)
+
+    async def aclose(self) -> None:
+        """Закрывает пул соединений текущего event loop"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
     def question_exists(self, data: str) -> bool:
         """Проверка, содержится ли data в поле content"""
         if not data:
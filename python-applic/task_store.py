@@ -0,0 +1,362 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from models import LightTask
+from services.url_utils import url_key
+
+FINISHED_STATUSES = ("completed", "error")
+PROCESSING_STATUS = "processing"
+
+
+def normalize_status(status: Any) -> str:
+    return str(status or "").strip().lower()
+
+
+class TaskStore:
+    """
+    Локальная очередь задач в SQLite (WAL): индексы по url_key и status, пакетный импорт из таблицы,
+    атомарные переходы claim → complete для нескольких процессов-воркеров.
+    Задача берётся в аренду (lease) на lease_seconds; воркер продлевает её heartbeat'ом,
+    а задачи упавшего воркера после истечения аренды снова попадают в очередь.
+    Локальные изменения статусов помечаются dirty и уходят в Google Sheets при синхронизации.
+    Задача идентифицируется каноническим url_key (как в URLIndex), поэтому http/https-, www.- и
+    слэш-варианты одного адреса не попадают в очередь дважды; в url хранится первый встреченный вариант.
+    """
+
+    def __init__(self, path: str = "pipeline_cache/tasks.sqlite", logger: Optional[logging.Logger] = None,
+                 lease_seconds: float = 300):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        # isolation_level=None — транзакциями управляем явно (BEGIN IMMEDIATE для claim)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                url_key TEXT,
+                status TEXT NOT NULL DEFAULT '',
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                dirty INTEGER NOT NULL DEFAULT 0,
+                lease_expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+            CREATE INDEX IF NOT EXISTS idx_tasks_dirty ON tasks(dirty) WHERE dirty = 1;
+            CREATE INDEX IF NOT EXISTS idx_tasks_pending ON tasks(id)
+                WHERE status NOT IN {FINISHED_STATUSES};
+            CREATE INDEX IF NOT EXISTS idx_tasks_claimable ON tasks(id)
+                WHERE status NOT IN {FINISHED_STATUSES + (PROCESSING_STATUS,)};
+        """)
+        # Хранилища, созданные до появления аренды
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+        if "lease_expires_at" not in columns:
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN lease_expires_at REAL")
+        if "url_key" not in columns:
+            self._add_url_keys()
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_url_key ON tasks(url_key)")
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_tasks_lease ON tasks(lease_expires_at) WHERE status = '{PROCESSING_STATUS}'"
+        )
+
+    def _add_url_keys(self) -> None:
+        """Хранилища, созданные до ключа url_key: заполняет его, из вариантов одного адреса остаётся первый."""
+        with self._transaction() as conn:
+            conn.execute("ALTER TABLE tasks ADD COLUMN url_key TEXT")
+            seen = set()
+            keys, duplicates = [], []
+            for task_id, url in conn.execute("SELECT id, url FROM tasks ORDER BY id").fetchall():
+                key = url_key(url)
+                if key in seen:
+                    duplicates.append((task_id,))
+                else:
+                    seen.add(key)
+                    keys.append((key, task_id))
+            conn.executemany("UPDATE tasks SET url_key = ? WHERE id = ?", keys)
+            conn.executemany("DELETE FROM tasks WHERE id = ?", duplicates)
+        if duplicates:
+            self.logger.warning(f"🧹 Удалено {len(duplicates)} дублирующих вариантов URL из очереди")
+
+    @contextmanager
+    def _transaction(self, mode: str = "IMMEDIATE") -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute(f"BEGIN {mode}")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def import_tasks(self, tasks: Iterable[LightTask], overwrite: bool = False) -> int:
+        """
+        Пакетный импорт задач из таблицы. Статус из таблицы применяется, если локально
+        нет несинхронизированных изменений и он не откатывает completed/error обратно в очередь
+        (overwrite=True применяет статус из таблицы всегда). Пустые URL пропускаются,
+        варианты уже известного адреса обновляют его задачу, а не создают новую.
+        """
+        now = time.time()
+        rows = [(t.url.strip(), url_key(t.url), normalize_status(t.status), now)
+                for t in tasks if t.url and t.url.strip()]
+        if overwrite:
+            status_expr, dirty_expr = "excluded.status", "0"
+        else:
+            # Несинхронизированный статус не трогаем; завершённую задачу таблица не возвращает в очередь
+            # (другой вариант того же адреса в таблице может ещё хранить старый пустой статус)
+            status_expr = (
+                "CASE WHEN tasks.dirty = 1 THEN tasks.status "
+                f"WHEN tasks.status IN {FINISHED_STATUSES} AND excluded.status NOT IN {FINISHED_STATUSES} "
+                "THEN tasks.status ELSE excluded.status END"
+            )
+            dirty_expr = "tasks.dirty"
+        with self._transaction() as conn:
+            conn.executemany(f"""
+                INSERT INTO tasks (url, url_key, status, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(url_key) DO UPDATE SET
+                    status = {status_expr},
+                    dirty = {dirty_expr},
+                    updated_at = CASE WHEN tasks.status = {status_expr} THEN tasks.updated_at ELSE excluded.updated_at END
+            """, rows)
+        return len(rows)
+
+    def import_stream(self, tasks: Iterable[LightTask], overwrite: bool = False, batch_size: int = 500) -> int:
+        """Импорт из генератора страницами: каждая страница коммитится и сразу доступна воркерам."""
+        iterator = iter(tasks)
+        total = 0
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                return total
+            total += self.import_tasks(batch, overwrite=overwrite)
+
+    def _set_meta(self, key: str, value: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_import_done(self, done: bool) -> None:
+        self._set_meta("import_done", "1" if done else "0")
+
+    def import_done(self) -> bool:
+        """Закончен ли импорт из таблицы (хранилища без флага считаются импортированными)."""
+        return self._get_meta("import_done") != "0"
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM tasks LIMIT 1").fetchone() is None
+
+    def all_tasks(self) -> List[LightTask]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, url FROM tasks ORDER BY id").fetchall()
+        return [LightTask(status=status, url=url) for status, url in rows]
+
+    def pending(self, limit: Optional[int] = None) -> List[LightTask]:
+        """Задачи, ещё не доведённые до completed/error (индексный запрос)."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT status, url FROM tasks WHERE status NOT IN {FINISHED_STATUSES} ORDER BY id LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [LightTask(status=status, url=url) for status, url in rows]
+
+    def claim(self, worker_id: str, limit: int = 1, lease_seconds: Optional[float] = None) -> List[LightTask]:
+        """
+        Атомарно забирает до limit свободных задач в аренду (status=processing).
+        BEGIN IMMEDIATE берёт блокировку записи до SELECT, поэтому два воркера
+        не получат одну и ту же задачу. Просроченные аренды сначала возвращаются в очередь.
+        """
+        now = time.time()
+        lease_expires_at = now + (lease_seconds or self.lease_seconds)
+        with self._transaction() as conn:
+            expired = conn.execute(
+                "UPDATE tasks SET status = '', worker = NULL, lease_expires_at = NULL, updated_at = ?, dirty = 1 "
+                f"WHERE status = '{PROCESSING_STATUS}' AND lease_expires_at < ?",
+                (now, now),
+            ).rowcount
+            if expired:
+                self.logger.warning(f"⏰ Истекла аренда {expired} задач — возвращены в очередь")
+            rows = conn.execute(
+                f"SELECT id, url FROM tasks WHERE status NOT IN {FINISHED_STATUSES + (PROCESSING_STATUS,)} "
+                "ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = ?, worker = ?, attempts = attempts + 1, updated_at = ?, dirty = 1, "
+                "lease_expires_at = ? WHERE id = ?",
+                [(PROCESSING_STATUS, worker_id, now, lease_expires_at, task_id) for task_id, _ in rows],
+            )
+        return [LightTask(status=PROCESSING_STATUS, url=url) for _, url in rows]
+
+    def set_status(self, url: str, status: str, error: Optional[str] = None) -> None:
+        """Локальная смена статуса; в таблицу уйдёт при следующей синхронизации."""
+        with self._transaction() as conn:
+            conn.execute(
+                f"UPDATE tasks SET status = ?1, error = ?2, updated_at = ?3, dirty = 1, "
+                f"worker = CASE WHEN ?1 = '{PROCESSING_STATUS}' THEN worker ELSE NULL END, "
+                f"lease_expires_at = CASE WHEN ?1 = '{PROCESSING_STATUS}' THEN lease_expires_at ELSE NULL END "
+                "WHERE url_key = ?4",
+                (normalize_status(status), error, time.time(), url_key(url)),
+            )
+
+    def requeue_unleased(self) -> int:
+        """Возвращает в очередь задачи, зависшие в processing без аренды (однопроцессный запуск упал)."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE tasks SET status = '', worker = NULL, updated_at = ?, dirty = 1 "
+                f"WHERE status = '{PROCESSING_STATUS}' AND lease_expires_at IS NULL",
+                (time.time(),),
+            ).rowcount
+
+    def heartbeat(self, worker_id: str, lease_seconds: Optional[float] = None) -> int:
+        """Продлевает аренду всех задач воркера; возвращает число продлённых."""
+        with self._transaction() as conn:
+            return conn.execute(
+                f"UPDATE tasks SET lease_expires_at = ? WHERE worker = ? AND status = '{PROCESSING_STATUS}'",
+                (time.time() + (lease_seconds or self.lease_seconds), worker_id),
+            ).rowcount
+
+    def release_worker(self, worker_id: str) -> int:
+        """Сразу возвращает в очередь все аренды воркера, чей процесс умер, не дожидаясь их истечения."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE tasks SET status = '', worker = NULL, lease_expires_at = NULL, updated_at = ?, dirty = 1 "
+                f"WHERE worker = ? AND status = '{PROCESSING_STATUS}'",
+                (time.time(), worker_id),
+            ).rowcount
+
+    def complete(self, url: str, success: bool, error: Optional[str] = None) -> None:
+        self.set_status(url, "completed" if success else "error", error)
+
+    def release(self, url: str) -> None:
+        """Возвращает задачу в очередь (например, при rate limit)."""
+        self.set_status(url, "")
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def sync_with_sheet(self, sheets_service: Any, spreadsheet_id: str, sheet_name: str, pull: bool = True) -> Dict[str, int]:
+        """
+        Двусторонняя синхронизация: локальные изменения (dirty) пакетно пишутся в таблицу,
+        затем свежие статусы и новые URL из таблицы импортируются в хранилище.
+        """
+        with self._lock:
+            dirty = self._conn.execute(
+                "SELECT url, status, updated_at FROM tasks WHERE dirty = 1"
+            ).fetchall()
+
+        pushed = 0
+        if dirty:
+            pushed = sheets_service.update_task_statuses(
+                spreadsheet_id, sheet_name, {url: status for url, status, _ in dirty}
+            )
+            # Сбрасываем dirty только у строк, которые не менялись во время записи в таблицу
+            with self._transaction() as conn:
+                conn.executemany(
+                    "UPDATE tasks SET dirty = 0 WHERE url = ? AND updated_at = ?",
+                    [(url, updated_at) for url, _, updated_at in dirty],
+                )
+
+        pulled = 0
+        if pull:
+            pulled = self.import_stream(
+                LightTask(status=item.get("status", ""), url=item.get("url", ""))
+                for item in sheets_service.iter_records(spreadsheet_id, sheet_name)
+            )
+
+        self.logger.info(f"🔄 Синхронизация с таблицей: отправлено {pushed}, получено {pulled}")
+        return {"pushed": pushed, "pulled": pulled}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class LeaseHeartbeat:
+    """Фоновое продление аренды задач воркера каждые lease_seconds / 3."""
+
+    def __init__(self, store: TaskStore, worker_id: str, lease_seconds: Optional[float] = None):
+        self.store = store
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds or store.lease_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.store.heartbeat(self.worker_id, self.lease_seconds)
+            except sqlite3.Error as e:
+                self.store.logger.warning(f"⚠️ Heartbeat {self.worker_id} не удался: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.worker_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return False
+
+
+class TaskStoreSyncer:
+    """Фоновая периодическая синхронизация TaskStore с таблицей; при выходе — финальная отправка."""
+
+    def __init__(self, store: TaskStore, sheets_service: Any, spreadsheet_id: str, sheet_name: str,
+                 interval: Optional[float] = None):
+        self.store = store
+        self.sheets_service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.interval = interval if interval is not None else float(os.getenv("TASK_SYNC_INTERVAL", 300))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sync(self, pull: bool) -> None:
+        try:
+            self.store.sync_with_sheet(self.sheets_service, self.spreadsheet_id, self.sheet_name, pull=pull)
+        except Exception as e:
+            # Таблица недоступна — изменения останутся dirty до следующей попытки
+            self.store.logger.warning(f"⚠️ Синхронизация с таблицей не удалась: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sync(pull=True)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="task-store-sync", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sync(pull=False)
+        return False
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Тесты запускаются из python-applic: модули приложения импортируются как services.*, benchmarks.*
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,68 @@
+"""Файловый Cache: атомарная запись, сериализаторы, слой в памяти и старые .json-файлы."""
+import json
+import os
+
+import pytest
+
+from cache import HAS_MSGPACK, HAS_ZSTD, Cache, make_serializer
+from models import LightTask
+
+
+def test_dataclass_round_trip(tmp_path):
+    cache = Cache(str(tmp_path))
+    cache.set("task", LightTask(status="completed", url="https://example.com/a"))
+    assert Cache(str(tmp_path)).get("task") == LightTask(status="completed", url="https://example.com/a")
+
+
+def test_failed_write_keeps_previous_version(tmp_path, monkeypatch):
+    cache = Cache(str(tmp_path))
+    cache.set("tasks", [1, 2, 3])
+
+    def crash(src, dst):
+        raise OSError("диск отвалился")
+
+    monkeypatch.setattr(os, "replace", crash)
+    with pytest.raises(OSError):
+        cache.set("tasks", [4, 5, 6])
+    monkeypatch.undo()
+
+    assert Cache(str(tmp_path)).get("tasks") == [1, 2, 3]
+    assert [p.name for p in tmp_path.iterdir()] == [f"tasks{cache.serializer.suffix}"]
+
+
+def test_memory_layer_returns_fresh_copies(tmp_path):
+    cache = Cache(str(tmp_path))
+    value = {"success": [{"url": "https://example.com/a"}]}
+    cache.set("results", value)
+    value["success"].clear()
+
+    first = cache.get("results")
+    first["success"].append({"url": "https://example.com/b"})
+    assert cache.get("results") == {"success": [{"url": "https://example.com/a"}]}
+
+
+def test_memory_layer_notices_file_change(tmp_path):
+    cache = Cache(str(tmp_path))
+    cache.set("tasks", ["old"])
+    assert cache.get("tasks") == ["old"]
+
+    Cache(str(tmp_path), memory=False).set("tasks", ["new", "и ещё"])
+    assert cache.get("tasks") == ["new", "и ещё"]
+
+
+@pytest.mark.skipif(not HAS_MSGPACK, reason="msgpack не установлен")
+def test_reads_legacy_json_with_new_format(tmp_path):
+    (tmp_path / "0_a_light_tasks.json").write_text(
+        json.dumps([{"status": "", "url": "https://example.com/a"}], ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    cache = Cache(str(tmp_path), serializer=make_serializer("msgpack", compress=False))
+    assert cache.get("0_a_light_tasks") == [{"status": "", "url": "https://example.com/a"}]
+
+
+@pytest.mark.skipif(not HAS_ZSTD, reason="zstandard не установлен")
+def test_zstd_files_are_compressed(tmp_path):
+    cache = Cache(str(tmp_path), serializer=make_serializer("json", compress=True))
+    value = [{"status": "", "url": f"https://example.com/page-{i}"} for i in range(1000)]
+    cache.set("tasks", value)
+    assert (tmp_path / "tasks.json.zst").stat().st_size < len(json.dumps(value)) / 5
+    assert Cache(str(tmp_path), memory=False, serializer=make_serializer("json", compress=True)).get("tasks") == value
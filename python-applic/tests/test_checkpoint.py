@@ -0,0 +1,86 @@
+"""Журнал контрольных точек: порядок воспроизведения, чужие активные сегменты, блокировка компакции."""
+import os
+import time
+
+from checkpoint import CheckpointJournal
+
+
+def journal(tmp_path, writer_id, **kwargs):
+    return CheckpointJournal(run_key="run", base_path=str(tmp_path), writer_id=writer_id, **kwargs)
+
+
+def test_latest_record_wins_regardless_of_segment_order(tmp_path):
+    # Сегменты читаются по имени: более старая запись писателя "b" читается последней
+    with journal(tmp_path, "a") as late, journal(tmp_path, "b") as early:
+        late.append({"url": "https://example.com/x", "status": "completed", "ts": 20})
+        early.append({"url": "https://example.com/x", "status": "error", "ts": 10})
+        early.append({"url": "https://example.com/y", "status": "skipped", "ts": 10})
+
+    records = journal(tmp_path, "reader").replay()
+    assert records["https://example.com/x"]["status"] == "completed"
+    assert set(journal(tmp_path, "reader").finished()) == {"https://example.com/x"}
+
+
+def test_snapshot_does_not_override_newer_segment(tmp_path):
+    with journal(tmp_path, "a") as first:
+        first.append({"url": "https://example.com/x", "status": "error", "ts": 10})
+    assert journal(tmp_path, "compactor").compact() == 1
+
+    with journal(tmp_path, "b") as second:
+        second.append({"url": "https://example.com/x", "status": "completed", "ts": 20})
+    assert journal(tmp_path, "reader").replay()["https://example.com/x"]["status"] == "completed"
+
+
+def test_torn_line_is_skipped(tmp_path):
+    with journal(tmp_path, "a") as writer:
+        writer.append({"url": "https://example.com/x", "status": "completed"})
+    segment = next(tmp_path.glob("run.a.*.jsonl"))
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"url": "https://example.com/y", "sta')
+
+    assert list(journal(tmp_path, "reader").replay()) == ["https://example.com/x"]
+
+
+def test_active_segment_of_dead_writer_is_recovered(tmp_path):
+    dead = journal(tmp_path, "dead")
+    dead.append({"url": "https://example.com/x", "status": "completed"})
+    # Процесс «умер»: сегмент так и остался .active
+    assert len(list(tmp_path.glob("run.dead.*.jsonl.active"))) == 1
+
+    reader = journal(tmp_path, "reader")
+    assert set(reader.finished()) == {"https://example.com/x"}
+    assert set(reader.writer_records("dead")) == {"https://example.com/x"}
+
+    # Свежий активный сегмент компакция не трогает — писатель может быть жив
+    assert reader.compact() == 0
+    stale = next(tmp_path.glob("run.dead.*.jsonl.active"))
+    old = time.time() - 2 * reader.stale_after_seconds
+    os.utime(stale, (old, old))
+    assert reader.compact() == 1
+    assert not stale.exists()
+    assert set(reader.finished()) == {"https://example.com/x"}
+
+
+def test_compact_skips_while_locked(tmp_path):
+    with journal(tmp_path, "a") as writer:
+        writer.append({"url": "https://example.com/x", "status": "completed"})
+    lock = tmp_path / "run.compact.lock"
+    lock.touch()
+
+    compactor = journal(tmp_path, "compactor")
+    assert compactor.compact() == 0
+    assert len(list(tmp_path.glob("run.a.*.jsonl"))) == 1
+
+    lock.unlink()
+    assert compactor.compact() == 1
+    assert not lock.exists()
+    assert not list(tmp_path.glob("run.a.*.jsonl"))
+
+
+def test_own_open_segment_survives_compact(tmp_path):
+    writer = journal(tmp_path, "a", stale_after_seconds=0)
+    writer.append({"url": "https://example.com/x", "status": "completed"})
+    assert writer.compact() == 0
+    writer.append({"url": "https://example.com/y", "status": "completed"})
+    writer.close()
+    assert set(journal(tmp_path, "reader").finished()) == {"https://example.com/x", "https://example.com/y"}
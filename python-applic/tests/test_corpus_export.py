@@ -0,0 +1,106 @@
+"""Выгрузка корпуса в Parquet: разбор эмбеддингов, схема и круговой прогон export → import."""
+import json
+import re
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pa = pytest.importorskip("pyarrow")
+httpx = pytest.importorskip("httpx")
+
+from services.corpus_export import (  # noqa: E402
+    CorpusArchive, _parse_embeddings, corpus_schema, iter_batches, load_embeddings,
+)
+
+DIM = 4
+
+
+def test_parse_embeddings_from_pgvector_strings():
+    matrix, missing = _parse_embeddings(["[0.5,1,2,3]", None, "[4,5,6,7.25]"], DIM)
+    assert matrix.dtype == np.float32
+    assert matrix.tolist() == [[0.5, 1, 2, 3], [0, 0, 0, 0], [4, 5, 6, 7.25]]
+    assert missing.tolist() == [False, True, False]
+
+
+def test_parse_embeddings_from_lists_and_bad_dimension():
+    matrix, missing = _parse_embeddings([[1, 2, 3, 4]], DIM)
+    assert matrix.tolist() == [[1, 2, 3, 4]] and missing is None
+    with pytest.raises(ValueError, match="размерность"):
+        _parse_embeddings(["[1,2,3]"], DIM)
+
+
+def test_schema():
+    schema = corpus_schema(DIM)
+    assert schema.names == ["id", "url", "content", "metadata", "embedding"]
+    assert schema.field("id").type == pa.int64()
+    assert schema.field("embedding").type == pa.list_(pa.float32(), DIM)
+
+
+class FakePostgREST:
+    """Таблица в памяти с подмножеством PostgREST, которым пользуется CorpusArchive."""
+
+    def __init__(self, rows):
+        self.rows = {row["id"]: row for row in rows}
+
+    def __call__(self, request: "httpx.Request") -> "httpx.Response":
+        if request.method == "POST":
+            for row in json.loads(request.content):
+                embedding = row["embedding"]
+                row["embedding"] = None if embedding is None else "[" + ",".join(map(str, embedding)) + "]"
+                self.rows[row["id"]] = row
+            return httpx.Response(201)
+
+        params = request.url.params
+        rows = sorted(self.rows.values(), key=lambda row: row["id"], reverse=params["order"] == "id.desc")
+        if "and" in params:
+            low, high = map(int, re.match(r"\(id\.gt\.(-?\d+),id\.lte\.(-?\d+)\)", params["and"]).groups())
+            rows = [row for row in rows if low < row["id"] <= high]
+        rows = rows[:int(params["limit"])]
+        if params["select"] == "id":
+            rows = [{"id": row["id"]} for row in rows]
+        return httpx.Response(200, json=rows)
+
+
+def make_rows(count):
+    return [
+        {
+            "id": i * 3,
+            "content": f"Текст {i}",
+            "metadata": {"url": f"https://example.com/{i}", "chunk": i},
+            "embedding": None if i % 7 == 0 else "[" + ",".join(str(i + j / 4) for j in range(DIM)) + "]",
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def archive(server):
+    return CorpusArchive("http://supabase", "key", table="novaya", dim=DIM, transport=httpx.MockTransport(server))
+
+
+def test_export_import_round_trip(tmp_path):
+    source = FakePostgREST(make_rows(95))
+    stats = archive(source).export(str(tmp_path / "corpus"), page_size=10, partitions=3, rows_per_file=40)
+    assert stats["rows"] == 95
+
+    ids = sorted(row for batch in iter_batches(str(tmp_path / "corpus")) for row in batch.column("id").to_pylist())
+    assert ids == sorted(source.rows)
+    loaded_ids, matrix = load_embeddings(str(tmp_path / "corpus"))
+    assert len(loaded_ids) == 95 - 95 // 7 and matrix.shape == (len(loaded_ids), DIM)
+
+    target = FakePostgREST([])
+    result = archive(target).import_(str(tmp_path / "corpus"), batch_size=20, concurrency=2)
+    assert result["rows"] == 95 and result["failed_rows"] == 0
+    for row_id, row in source.rows.items():
+        copy = target.rows[row_id]
+        assert (copy["content"], copy["metadata"]) == (row["content"], row["metadata"])
+        if row["embedding"] is None:
+            assert copy["embedding"] is None
+        else:
+            assert json.loads(copy["embedding"]) == json.loads(row["embedding"])
+
+
+def test_export_rejects_non_integer_ids(tmp_path):
+    server = FakePostgREST([])
+    server.rows = {"a": {"id": "0b7e-uuid"}}
+    with pytest.raises(ValueError, match="целочисленный id"):
+        archive(server).export(str(tmp_path / "corpus"))
@@ -0,0 +1,151 @@
+"""Клиенты OpenRouter против локального MockOpenRouter: Retry-After, лимит на модель, generate_many."""
+import asyncio
+import random
+import threading
+import time
+
+import pytest
+
+from benchmarks.mock_openrouter import MockOpenRouter, default_reply
+from services.llm_services import AsyncLLMService, LLMService
+
+
+class ConcurrencyProbe:
+    """Ответ мока, который держит запрос и запоминает, сколько запросов было в работе одновременно."""
+
+    def __init__(self, hold: float = 0.1):
+        self.hold = hold
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, payload):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.hold)
+            return default_reply(payload)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_async_retries_429_after_retry_after():
+    with MockOpenRouter(rate_limit_every=2, retry_after=0.3) as mock:
+        async def run():
+            async with AsyncLLMService(base_url=mock.base_url, use_cache=False, max_retries=3) as client:
+                first = await client.generate("первый")
+                started = time.perf_counter()
+                second = await client.generate("второй")
+                return first, second, time.perf_counter() - started
+
+        first, second, elapsed = asyncio.run(run())
+
+    assert first == "Ответ на: первый"
+    assert second == "Ответ на: второй"
+    assert mock.rate_limited == 1
+    assert len(mock.requests) == 3
+    assert elapsed >= 0.3
+
+
+def test_async_gives_up_after_max_retries():
+    with MockOpenRouter(rate_limit_every=1, retry_after=0.01) as mock:
+        async def run():
+            async with AsyncLLMService(base_url=mock.base_url, use_cache=False, max_retries=3) as client:
+                await client.generate("всегда 429")
+
+        with pytest.raises(RuntimeError, match="429"):
+            asyncio.run(run())
+
+    assert len(mock.requests) == 3
+
+
+def test_sync_post_honours_retry_after():
+    with MockOpenRouter(rate_limit_every=2, retry_after=0.3) as mock:
+        service = LLMService(base_url=mock.base_url, use_cache=False, max_retries=3)
+        assert service.generate("первый") == "Ответ на: первый"
+        started = time.perf_counter()
+        assert service.generate("второй") == "Ответ на: второй"
+        elapsed = time.perf_counter() - started
+
+    assert mock.rate_limited == 1
+    assert len(mock.requests) == 3
+    assert elapsed >= 0.3
+
+
+def test_per_model_semaphore_limits_concurrency():
+    probe = ConcurrencyProbe(hold=0.1)
+    with MockOpenRouter(reply=probe) as mock:
+        async def run():
+            async with AsyncLLMService(base_url=mock.base_url, use_cache=False, concurrency_per_model=2) as client:
+                return await client.generate_many([f"запрос {i}" for i in range(8)], model="model-a")
+
+        results = asyncio.run(run())
+
+    assert len(results) == 8
+    assert probe.max_in_flight == 2
+
+
+def test_semaphore_is_per_model():
+    probe = ConcurrencyProbe(hold=0.2)
+    with MockOpenRouter(reply=probe) as mock:
+        async def run():
+            async with AsyncLLMService(base_url=mock.base_url, use_cache=False, concurrency_per_model=1) as client:
+                return await asyncio.gather(
+                    *(client.generate(f"a{i}", model="model-a") for i in range(3)),
+                    *(client.generate(f"b{i}", model="model-b") for i in range(3)),
+                )
+
+        asyncio.run(run())
+
+    # По одному запросу на каждую из двух моделей
+    assert probe.max_in_flight == 2
+    models = [request["model"] for request in mock.requests]
+    assert sorted(models) == ["model-a"] * 3 + ["model-b"] * 3
+
+
+def test_generate_many_preserves_order():
+    rng = random.Random(7)
+
+    def shuffled_reply(payload):
+        # Ответы приходят в случайном порядке
+        time.sleep(rng.uniform(0, 0.05))
+        return default_reply(payload)
+
+    prompts = [f"вопрос {i}" for i in range(12)]
+    with MockOpenRouter(reply=shuffled_reply) as mock:
+        async def run():
+            async with AsyncLLMService(base_url=mock.base_url, use_cache=False, concurrency_per_model=6) as client:
+                return await client.generate_many(prompts)
+
+        results = asyncio.run(run())
+
+    assert results == [f"Ответ на: {prompt}" for prompt in prompts]
+
+
+def test_generate_many_exceptions():
+    prompts = [f"вопрос {i}" for i in range(4)]
+    # Без повторов третий запрос получает 429 и падает; лимит 1 делает порядок запросов детерминированным
+    with MockOpenRouter(rate_limit_every=3, retry_after=0.01) as mock:
+        async def run(return_exceptions):
+            async with AsyncLLMService(base_url=mock.base_url, use_cache=False, max_retries=1,
+                                       concurrency_per_model=1) as client:
+                return await client.generate_many(prompts, return_exceptions=return_exceptions)
+
+        results = asyncio.run(run(True))
+        assert [r for i, r in enumerate(results) if i != 2] == [f"Ответ на: {p}" for i, p in enumerate(prompts) if i != 2]
+        assert isinstance(results[2], RuntimeError)
+
+        mock.requests.clear()
+        with pytest.raises(RuntimeError, match="429"):
+            asyncio.run(run(False))
+
+
+def test_sync_generate_many_uses_async_client():
+    pytest.importorskip("prefect")
+    prompts = [f"вопрос {i}" for i in range(5)]
+    with MockOpenRouter() as mock:
+        service = LLMService(base_url=mock.base_url, use_cache=False)
+        assert service.generate_many(prompts) == [f"Ответ на: {prompt}" for prompt in prompts]
+    assert len(mock.requests) == 5
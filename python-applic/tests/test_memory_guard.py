@@ -0,0 +1,102 @@
+"""Лимит HTML и притормаживание загрузок при нехватке памяти."""
+import asyncio
+
+from services import memory_guard
+from services.memory_guard import MemoryGuard, cap_html, tracked_call
+
+
+def test_cap_html_cuts_at_tag_boundary():
+    data = b"<html><body><p>" + b"x" * 100 + b"</p><p>tail</p></body></html>"
+    assert cap_html(data, 0) == (data, False)
+    assert cap_html(data, len(data)) == (data, False)
+
+    capped, truncated = cap_html(data, 120)
+    assert truncated
+    assert capped == data[:data.rfind(b"<", 0, 120)]
+    assert capped.endswith(b"</p>")
+    # Без тега в пределах лимита режем ровно по лимиту
+    assert cap_html(b"x" * 50, 10) == (b"x" * 10, True)
+
+
+def test_cap_counts_truncated_pages():
+    guard = MemoryGuard(max_html_bytes=10)
+    assert guard.cap(b"<p>short</p>") == b"<p>short"
+    assert guard.cap(b"<p>") == b"<p>"
+    assert guard.stats["truncated"] == 1
+
+
+def test_tracked_call_reports_memory():
+    result, memory = tracked_call(lambda data, suffix: data + suffix, b"<p>", b"</p>")
+    assert result == b"<p></p>"
+    assert memory["html_bytes"] == 3
+    assert memory["rss_mb"] > 0
+    assert memory["peak_growth_mb"] >= 0
+
+
+def test_pressure_from_rss_and_system_memory(monkeypatch):
+    monkeypatch.setattr(memory_guard, "container_memory", lambda: None)
+    monkeypatch.setattr(memory_guard, "system_memory", lambda: (50, 100))
+
+    assert not MemoryGuard(max_rss_mb=0, high_watermark=0.9, check_interval=0).under_pressure()
+    assert MemoryGuard(max_rss_mb=0, high_watermark=0.4, check_interval=0).under_pressure()
+    assert MemoryGuard(max_rss_mb=1e-6, high_watermark=0.9, check_interval=0).under_pressure()
+
+    # Лимит контейнера важнее памяти хоста
+    monkeypatch.setattr(memory_guard, "container_memory", lambda: (95, 100))
+    assert MemoryGuard(max_rss_mb=0, high_watermark=0.9, check_interval=0).under_pressure()
+
+
+def test_container_memory_ignores_unlimited_cgroup(monkeypatch):
+    values = {
+        "/sys/fs/cgroup/memory.current": None,
+        "/sys/fs/cgroup/memory.max": None,
+        "/sys/fs/cgroup/memory/memory.usage_in_bytes": 10,
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes": 1 << 62,
+    }
+    monkeypatch.setattr(memory_guard, "_read_int", values.get)
+    assert memory_guard.container_memory() is None
+
+    values["/sys/fs/cgroup/memory/memory.limit_in_bytes"] = 100
+    assert memory_guard.container_memory() == (10, 100)
+
+
+def test_slot_admits_one_page_under_pressure(monkeypatch):
+    guard = MemoryGuard(poll_interval=0.01)
+    pressure = {"on": True}
+    monkeypatch.setattr(guard, "under_pressure", lambda: pressure["on"])
+    order = []
+
+    async def page(name, hold):
+        async with guard.slot():
+            order.append(f"{name}+")
+            await asyncio.sleep(hold)
+            order.append(f"{name}-")
+
+    async def run():
+        first = asyncio.create_task(page("a", 0.05))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(page("b", 0))
+        await asyncio.gather(first, second)
+
+    asyncio.run(run())
+    # Под давлением вторая страница ждёт, пока первая не освободит место
+    assert order == ["a+", "a-", "b+", "b-"]
+    assert guard.stats["throttled"] == 1
+
+
+def test_slot_respects_max_concurrency():
+    guard = MemoryGuard(max_concurrency=2, high_watermark=1.0, max_rss_mb=0, poll_interval=0.01)
+    peak = {"now": 0, "max": 0}
+
+    async def page():
+        async with guard.slot():
+            peak["now"] += 1
+            peak["max"] = max(peak["max"], peak["now"])
+            await asyncio.sleep(0.02)
+            peak["now"] -= 1
+
+    async def run():
+        await asyncio.gather(*(page() for _ in range(5)))
+
+    asyncio.run(run())
+    assert peak["max"] == 2
@@ -0,0 +1,97 @@
+"""Гистограммы этапов, слияние снимков воркеров и экспорт Prometheus."""
+import socket
+import urllib.request
+
+import pytest
+
+import metrics
+from metrics import Histogram, MetricsRegistry, start_metrics_server
+
+
+def test_histogram_quantiles_stay_inside_buckets():
+    h = Histogram(buckets=(0.1, 1.0, 10.0))
+    for value in (0.05, 0.5, 0.5, 0.5, 5.0):
+        h.observe(value)
+    assert h.count == 5
+    assert h.counts == [1, 3, 1, 0]
+    assert 0.1 <= h.quantile(0.5) <= 1.0
+    assert 1.0 <= h.quantile(0.99) <= 5.0
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_merge_adds_worker_snapshots():
+    worker = MetricsRegistry()
+    worker.observe("fetch", 0.2)
+    worker.inc("urls_completed", 2)
+    parent = MetricsRegistry()
+    parent.observe("fetch", 0.4)
+    parent.inc("urls_completed")
+
+    parent.merge(worker.snapshot())
+    parent.merge(worker.snapshot())
+    rows = {row["stage"]: row for row in parent.summary()}
+    assert rows["fetch"]["count"] == 3
+    assert rows["fetch"]["total_s"] == pytest.approx(0.8)
+    assert parent.snapshot()["counters"] == {"urls_completed": 5}
+
+
+def test_merge_rejects_other_buckets():
+    registry = MetricsRegistry()
+    registry.observe("fetch", 0.2)
+    other = MetricsRegistry(buckets=(1.0,))
+    other.observe("fetch", 0.2)
+    with pytest.raises(ValueError):
+        registry.merge(other.snapshot())
+
+
+def test_span_records_on_exception_and_bottleneck():
+    registry = MetricsRegistry()
+    with pytest.raises(RuntimeError):
+        with registry.span("llm"):
+            raise RuntimeError("boom")
+    registry.observe("chunk", 0.001)
+    registry.observe("llm", 5.0)
+    registry.observe("custom", 100.0)
+
+    assert [row["stage"] for row in registry.summary()] == ["llm", "chunk", "custom"]
+    assert registry.summary()[0]["count"] == 2
+    # Нестандартные этапы в выбор узкого места не входят
+    assert registry.bottleneck() == "llm"
+
+
+def test_prometheus_buckets_are_cumulative():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.observe("fetch", 0.05)
+    registry.observe("fetch", 0.5)
+    registry.inc("urls_error")
+    text = registry.to_prometheus()
+    assert 'ingest_stage_seconds_bucket{stage="fetch",le="0.1"} 1' in text
+    assert 'ingest_stage_seconds_bucket{stage="fetch",le="1.0"} 2' in text
+    assert 'ingest_stage_seconds_bucket{stage="fetch",le="+Inf"} 2' in text
+    assert 'ingest_stage_seconds_count{stage="fetch"} 2' in text
+    assert "ingest_urls_error_total 1" in text
+
+
+def test_metrics_server(monkeypatch):
+    monkeypatch.delenv("METRICS_PORT", raising=False)
+    assert start_metrics_server() is None
+
+    monkeypatch.setattr(metrics, "_server", None)
+    registry = MetricsRegistry()
+    registry.inc("urls_completed")
+    server = start_metrics_server(port=_free_port(), registry=registry)
+    try:
+        assert start_metrics_server(port=1) is server
+        host, port = server.server_address
+        body = urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5).read().decode()
+        assert "ingest_urls_completed_total 1" in body
+    finally:
+        server.shutdown()
+        server.server_close()
+        monkeypatch.setattr(metrics, "_server", None)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
@@ -0,0 +1,66 @@
+"""Шардированная обработка: перезапуск убитого воркера и остановка по событию."""
+import logging
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("prefect")
+pytest.importorskip("crawl4ai")
+
+from models import LightTask  # noqa: E402
+from services.urls_to_database import lease_worker, urls_to_database_sharded  # noqa: E402
+from task_store import TaskStore  # noqa: E402
+
+CRASH_URL = "https://example.com/crash"
+
+
+class FakeIngestion:
+    """Загрузка без сети; на CRASH_URL первый процесс умирает, как от OOM killer"""
+
+    def __init__(self, marker: str):
+        self.marker = marker
+
+    def ingest_url(self, task: LightTask) -> bool:
+        if task.url == CRASH_URL and not os.path.exists(self.marker):
+            open(self.marker, "w").close()
+            os._exit(1)
+        return True
+
+
+def fake_ingestion_factory(spreadsheet_id, sheet_name, logger, task_store=None):
+    # Должна импортироваться по имени: воркеры запускаются через spawn
+    return FakeIngestion(os.path.abspath("crashed.marker"))
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Воркеры открывают TaskStore и журнал по путям по умолчанию относительно рабочего каталога
+    monkeypatch.chdir(tmp_path)
+    task_store = TaskStore()
+    task_store.import_tasks([LightTask(status="", url=f"https://example.com/{i}") for i in range(4)]
+                            + [LightTask(status="", url=CRASH_URL)])
+    yield task_store
+    task_store.close()
+
+
+def test_killed_worker_is_replaced_and_its_lease_requeued(store):
+    results = urls_to_database_sharded(
+        "sheet-id", "sheet", 1, "test-run", logging.getLogger("test"),
+        ingestion_factory=fake_ingestion_factory, task_store=store, max_restarts=1,
+    )
+
+    assert os.path.exists("crashed.marker")
+    assert sorted(results.urls_in("success")) == sorted(t.url for t in store.all_tasks())
+    assert not store.pending()
+    assert store.counts().get("processing", 0) == 0
+
+
+def test_worker_claims_nothing_after_stop(store):
+    stop = threading.Event()
+    stop.set()
+    result = lease_worker("w0", "sheet-id", "sheet", "test-run",
+                          ingestion_factory=fake_ingestion_factory, stop_event=stop)
+
+    assert len(result["results"]) == 0
+    assert len(store.pending()) == 5
@@ -0,0 +1,80 @@
+"""Эмулятор Google Sheets: чтение страницами, пакетная запись, добавление строк и квоты."""
+import threading
+
+import pytest
+
+from services.sheets_emulator import QuotaExceededError, SheetsEmulator
+
+
+@pytest.fixture
+def sheet():
+    emulator = SheetsEmulator()
+    emulator.seed_tasks("sheet", "Main", 25)
+    return emulator, emulator.client().open_by_key("sheet").worksheet("Main")
+
+
+def test_batch_get_pages(sheet):
+    _, worksheet = sheet
+    assert worksheet.row_values(1) == ["status", "url"]
+    pages = [worksheet.batch_get([f"A{start}:B{start + 9}"])[0] for start in range(2, worksheet.row_count + 1, 10)]
+    rows = [row for page in pages for row in page]
+    assert len(rows) == 25
+    assert rows[0] == ["", "https://example.com/page-0"]
+    # Пустые хвостовые строки сетки не возвращаются, как в Sheets API
+    assert pages[2] == rows[20:] and all(page == [] for page in pages[3:])
+    assert worksheet.batch_get(["B3"])[0] == [["https://example.com/page-1"]]
+
+
+def test_batch_update(sheet):
+    _, worksheet = sheet
+    worksheet.batch_update([{"range": "A2", "values": [["completed"]]},
+                            {"range": "A4:B4", "values": [["error", "https://example.com/x"]]}])
+    assert worksheet.col_values(1)[:4] == ["status", "completed", "", "error"]
+    assert worksheet.row_values(4) == ["error", "https://example.com/x"]
+
+
+def test_empty_writes_are_ignored():
+    emulator = SheetsEmulator()
+    emulator.seed_tasks("sheet", "Main", 0)
+    worksheet = emulator.client().open_by_key("sheet").worksheet("Main")
+    worksheet.append_rows([])
+    worksheet.batch_update([])
+    emulator._append("sheet", "Main", [[]])
+    assert worksheet.get_all_records() == []
+    assert worksheet.row_count == 1000
+
+
+def test_quota_errors():
+    emulator = SheetsEmulator(read_quota_per_minute=2)
+    emulator.add_sheet("sheet", "Main", ["status", "url"])
+    client = emulator.client()
+    client.open_by_key("sheet")
+    client.open_by_key("sheet")
+    with pytest.raises(QuotaExceededError, match="Quota exceeded"):
+        client.open_by_key("sheet")
+    assert emulator.quota_errors == 1
+
+    flaky = SheetsEmulator(quota_error_rate=1.0, seed=1)
+    flaky.add_sheet("sheet", "Main", ["status", "url"])
+    with pytest.raises(QuotaExceededError):
+        flaky.client().open_by_key("sheet")
+
+
+def test_concurrent_appends_do_not_overwrite(tmp_path):
+    emulator = SheetsEmulator(str(tmp_path / "sheets.sqlite"))
+    emulator.add_sheet("sheet", "Main", ["status", "url"])
+    worksheet = emulator.client().open_by_key("sheet").worksheet("Main")
+
+    def writer(n: int) -> None:
+        for i in range(20):
+            worksheet.append_rows([["", f"https://example.com/{n}-{i}-{j}"] for j in range(3)])
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    urls = worksheet.col_values(2)[1:]
+    assert len(urls) == 8 * 20 * 3
+    assert len(set(urls)) == len(urls)
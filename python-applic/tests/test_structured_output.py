@@ -0,0 +1,90 @@
+"""Структурированные ответы: перегенерация мимо кэша и кэширование только разбираемого JSON."""
+import json
+
+import pytest
+from pydantic import BaseModel
+
+from benchmarks.mock_openrouter import MockOpenRouter
+from services.llm_cache import LLMResponseCache
+from services.llm_services import LLMService
+
+
+class Article(BaseModel):
+    title: str
+    words: int
+
+
+def scripted(*replies):
+    """Ответы мока по очереди; последний повторяется."""
+    queue = list(replies)
+
+    def reply(payload):
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    return reply
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "llm.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_invalid_json_is_not_cached(cache):
+    with MockOpenRouter(reply=scripted("not json", '{"ok": true}')) as mock:
+        service = LLMService(base_url=mock.base_url, cache=cache)
+        with pytest.raises(json.JSONDecodeError):
+            service.generate("дай JSON", json_mode=True, cacheable=True)
+        assert service.generate("дай JSON", json_mode=True, cacheable=True) == {"ok": True}
+        assert service.generate("дай JSON", json_mode=True, cacheable=True) == {"ok": True}
+
+    assert len(mock.requests) == 2
+    assert cache.metrics["stores"] == 1
+    assert cache.metrics["hits"] == 1
+
+
+def test_regeneration_bypasses_cache(cache):
+    good = json.dumps({"title": "SEO", "words": 900})
+    with MockOpenRouter(reply=scripted("not json", good)) as mock:
+        service = LLMService(base_url=mock.base_url, cache=cache)
+        result = service.generate_structured_response("статья", schema=Article)
+
+    assert result == Article(title="SEO", words=900)
+    assert len(mock.requests) == 2
+    assert service.structured_validator.counters["regenerated"] == 1
+
+
+def test_regeneration_replaces_cached_schema_invalid_answer(cache):
+    # Разбираемый, но не проходящий схему ответ кэшируется; перегенерация его перезаписывает
+    bad = json.dumps({"title": "SEO", "words": "много"})
+    good = json.dumps({"title": "SEO", "words": 900})
+    with MockOpenRouter(reply=scripted(bad, bad, good)) as mock:
+        service = LLMService(base_url=mock.base_url, cache=cache)
+        service.structured_validator.max_reasks = 1
+        assert service.generate_structured_response("статья", schema=Article).words == 900
+        # Повторный вызов берёт из кэша уже исправленный ответ
+        assert service.generate_structured_response("статья", schema=Article).words == 900
+
+    assert len(mock.requests) == 3
+
+
+def test_resumed_structured_response_comes_from_cache(tmp_path):
+    path = str(tmp_path / "llm.sqlite")
+    good = json.dumps({"title": "SEO", "words": 900})
+    with MockOpenRouter(reply=scripted(good)) as mock:
+        first = LLMResponseCache(path=path)
+        assert LLMService(base_url=mock.base_url, cache=first).generate_structured_response("статья", schema=Article).words == 900
+        first.close()
+
+        # Новый процесс после resume: кэш с настройками по умолчанию, тот же файл
+        resumed = LLMResponseCache(path=path)
+        service = LLMService(base_url=mock.base_url, cache=resumed)
+        assert service.generate_structured_response("статья", schema=Article).words == 900
+        assert service.generate_structured_response("статья") == {"title": "SEO", "words": 900}
+        assert service.generate("статья", temperature=0.3) == good
+        resumed.close()
+
+    # Структурированные ответы взяты из кэша; свободная генерация при 0.3 ушла в сеть
+    assert len(mock.requests) == 2
+    assert resumed.metrics["hits"] == 2
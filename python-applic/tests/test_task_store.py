@@ -0,0 +1,79 @@
+"""Очередь TaskStore, ключённая по url_key, и её синхронизация с таблицей."""
+import sqlite3
+
+import pytest
+
+from models import LightTask
+from task_store import TaskStore
+
+
+def test_variants_share_one_task(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    store.import_tasks([
+        LightTask(status="", url="https://example.com/a"),
+        LightTask(status="", url="http://www.example.com/a/"),
+        LightTask(status="", url="https://example.com/b?utm_source=x"),
+    ])
+    assert [t.url for t in store.all_tasks()] == ["https://example.com/a", "https://example.com/b?utm_source=x"]
+
+    store.set_status("http://example.com/a/", "completed")
+    assert [t.url for t in store.pending()] == ["https://example.com/b?utm_source=x"]
+    store.close()
+
+
+def test_old_store_gets_url_keys(tmp_path):
+    path = str(tmp_path / "tasks.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE tasks (id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, status TEXT NOT NULL DEFAULT '', "
+                 "worker TEXT, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at REAL NOT NULL, "
+                 "dirty INTEGER NOT NULL DEFAULT 0)")
+    conn.executemany("INSERT INTO tasks (url, status, updated_at) VALUES (?, ?, 0)",
+                     [("https://example.com/a", "completed"), ("http://example.com/a/", ""), ("https://example.com/b", "")])
+    conn.commit()
+    conn.close()
+
+    store = TaskStore(path)
+    assert [(t.url, t.status) for t in store.all_tasks()] == [("https://example.com/a", "completed"),
+                                                               ("https://example.com/b", "")]
+    store.import_tasks([LightTask(status="", url="www.example.com/b/")])
+    assert len(store.all_tasks()) == 2
+    store.close()
+
+
+def test_import_does_not_reopen_finished_task(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    store.import_tasks([LightTask(status="", url="https://example.com/a")])
+    store.complete("https://example.com/a", success=True)
+    store._conn.execute("UPDATE tasks SET dirty = 0")
+
+    # Вариант адреса в таблице со старым пустым статусом не возвращает задачу в очередь
+    store.import_tasks([LightTask(status="completed", url="https://example.com/a"),
+                        LightTask(status="", url="http://example.com/a/")])
+    assert [(t.url, t.status) for t in store.all_tasks()] == [("https://example.com/a", "completed")]
+    assert store.pending() == []
+
+    store.import_tasks([LightTask(status="", url="http://example.com/a/")], overwrite=True)
+    assert [t.status for t in store.pending()] == [""]
+    store.close()
+
+
+def test_sync_keeps_variants_completed(tmp_path):
+    pytest.importorskip("gspread")
+    from services.google_sheets import GoogleSheetsService
+    from services.sheets_emulator import SheetsEmulator
+
+    emulator = SheetsEmulator()
+    emulator.add_sheet("sheet", "Main", ["status", "url"])
+    emulator._append("sheet", "Main", [["", "https://example.com/a"], ["", "http://example.com/a/"],
+                                       ["", "https://example.com/b"]])
+    sheets = GoogleSheetsService(client=emulator.client())
+
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    store.sync_with_sheet(sheets, "sheet", "Main")
+    store.complete("https://example.com/a", success=True)
+
+    for _ in range(2):
+        store.sync_with_sheet(sheets, "sheet", "Main")
+        assert [t.url for t in store.pending()] == ["https://example.com/b"]
+    assert [r["status"] for r in sheets.iter_records("sheet", "Main")] == ["completed", "completed", ""]
+    store.close()
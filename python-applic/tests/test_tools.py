@@ -0,0 +1,51 @@
+"""Поиск JSON в ответах LLM: tools.extract_json и потоковый JSONObjectLocator."""
+import json
+
+from tools import JSONObjectLocator, extract_json
+
+PAYLOAD = {"title": "SEO", "sections": [{"h2": "Раздел", "text": "скобки } и { в строке"}]}
+BODY = json.dumps(PAYLOAD, ensure_ascii=False)
+
+
+def feed_all(locator: JSONObjectLocator, text: str, chunk: int = 7) -> list:
+    found = []
+    for i in range(0, len(text), chunk):
+        found.extend(locator.feed(text[i:i + chunk]))
+    return found
+
+
+def test_json_fence_preferred_over_longer_object():
+    text = f'Черновик: {{"draft": "{"x" * 200}"}}\n```json\n{{"final": 1}}\n```'
+    assert extract_json(text) == {"final": 1}
+
+
+def test_longest_object_without_fences():
+    assert extract_json(f'{{"a": 1}} пояснение {BODY}') == PAYLOAD
+
+
+def test_stray_braces_before_object():
+    assert extract_json("{" * 20000 + BODY) == PAYLOAD
+    assert extract_json("x { y " * 5000 + BODY) == PAYLOAD
+    assert extract_json('{"broken": 1,} и {"x": {"a": 1}, } затем ' + BODY) == PAYLOAD
+
+
+def test_deep_nesting_does_not_raise():
+    assert extract_json('{"a":' * 5000) == {}
+
+
+def test_stream_matches_whole_text_across_chunks():
+    text = f'Ответ: {BODY} и ещё {{"b": "\\\\\\"", "c": [true, false, null, 1.5e3]}}'
+    assert feed_all(JSONObjectLocator(), text, chunk=1) == [PAYLOAD, {"b": '\\"', "c": [True, False, None, 1500.0]}]
+
+
+def test_stream_drops_stray_brace():
+    locator = JSONObjectLocator()
+    found = feed_all(locator, "проза { с фигурной скобкой " * 1000 + BODY)
+    assert found == [PAYLOAD]
+    assert not locator.pending
+
+
+def test_stream_pending_buffer_is_capped():
+    locator = JSONObjectLocator(max_pending_chars=10_000)
+    feed_all(locator, '{"' + "незакрытая строка " * 5000, chunk=64)
+    assert len(locator._buffer) <= 10_000 + 64
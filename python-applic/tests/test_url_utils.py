@@ -0,0 +1,29 @@
+"""Канонические URL: normalize_url, url_key, варианты для загрузки и хэш-индекс URLIndex."""
+from services.url_utils import URLIndex, normalize_url, url_key, url_variants
+
+
+def test_normalize_url_keeps_unparseable_url():
+    assert normalize_url("http://a:99999/") == "http://a:99999/"
+    assert normalize_url("http://[::1/x") == "http://[::1/x"
+    assert normalize_url("HTTPS://WWW.Example.com:443/a/?utm_source=x&b=1#top") == "https://www.example.com/a?b=1"
+
+
+def test_url_key_merges_variants():
+    assert url_key("www.example.com/b/") == "example.com/b"
+    assert url_key("http://example.com/a/") == url_key("https://www.example.com/a")
+
+
+def test_url_index_survives_bad_port():
+    index = URLIndex(["https://example.com/a"])
+    added = [url for url in ("http://a:99999/", "http://example.com/a/", "example.com/b") if index.add(url)]
+    assert added == ["http://a:99999/", "example.com/b"]
+
+
+def test_url_variants_keep_path_query_and_fragment():
+    assert url_variants("http://www.Example.com/a/?b=2&a=1&utm_source=x#/route") == [
+        "http://www.Example.com/a/?b=2&a=1&utm_source=x#/route",
+        "https://www.Example.com/a/?b=2&a=1&utm_source=x#/route",
+        "https://Example.com/a/?b=2&a=1&utm_source=x#/route",
+        "http://Example.com/a/?b=2&a=1&utm_source=x#/route",
+    ]
+    assert url_variants("example.com")[:2] == ["https://example.com", "http://example.com"]
@@ -1,6 +1,6 @@
 import json
 import re
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 
 from models import LightTask
 
@@ -18,33 +18,249 @@ def create_light_tasks_from_urls(urls: List[str], default_status: str = "pending
     return [LightTask(status=default_status, url=url) for url in urls]
 
 
+# Внутри объекта интересны только скобки и начало строки; хвост строки пропускается одним match
+_JSON_TOKEN_RE = re.compile(r'[{}"]')
+_JSON_STRING_TAIL_RE = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+# Объект начинается с '{', за которой (после пробелов) идёт ключ или '}'; прочие '{' — проза.
+# \Z: в потоке продолжение может быть ещё не получено
+_OBJECT_START_RE = re.compile(r'\{(?=\s*(?:["}]|\Z))')
+_JSON_FENCE_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_CODE_FENCE_RE = re.compile(r'```\s*(.*?)\s*```', re.DOTALL)
+
+# Незакрытый объект в потоке держится в буфере не дольше этого — дальше кандидат отбрасывается
+DEFAULT_MAX_PENDING_CHARS = 1 << 20
+# Ошибка разбора у самого конца буфера — возможно, недописанный литерал (false) или \uXXXX: ждём данных
+_INCOMPLETE_TAIL_CHARS = 6
+
+
+class JSONObjectLocator:
+    """
+    Однопроходный поиск сбалансированных JSON-объектов верхнего уровня с учётом строк.
+    Найденные фрагменты декодируются json.JSONDecoder.raw_decode без копирования текста.
+    Поддерживает инкрементальную подачу (feed) для потоковых ответов LLM.
+
+    Кандидат, который не может стать объектом (фигурная скобка в прозе), отбрасывается
+    с места ошибки разбора, а не пересканируется: всё, что открыто в этой точке, тоже невалидно,
+    а закрытое до неё — вложено в кандидата.
+    """
+
+    def __init__(self, eager_decode: bool = False, max_pending_chars: int = DEFAULT_MAX_PENDING_CHARS):
+        # eager_decode: текст цельный (дописываний не будет) — raw_decode с каждой '{' (C-скорость),
+        # без посимвольного сканирования
+        self.eager_decode = eager_decode
+        self.max_pending_chars = max_pending_chars
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._probed = 0
+
+    @property
+    def pending(self) -> bool:
+        """Есть ли незакрытый объект (ждём продолжения потока)."""
+        return self._depth > 0
+
+    @property
+    def pending_start(self) -> int:
+        return self._start if self._depth > 0 else -1
+
+    def feed(self, chunk: str) -> List[dict]:
+        """Добавляет кусок текста и возвращает объекты, закрытые этим куском."""
+        return [obj for _, _, obj in self.feed_spans(chunk)]
+
+    def feed_spans(self, chunk: str) -> Iterator[Tuple[int, int, dict]]:
+        """Как feed, но с границами объектов (относительно текущего буфера)."""
+        self._buffer += chunk
+        spans = list(self._scan())
+        self._compact()
+        return iter(spans)
+
+    def _scan(self) -> Iterator[Tuple[int, int, dict]]:
+        buffer = self._buffer
+        end = len(buffer)
+        pos = self._pos
+
+        while True:
+            while pos < end:
+                if self._in_string:
+                    match = _JSON_STRING_TAIL_RE.match(buffer, pos)
+                    if match is None:
+                        # Строка не закрыта — ждём данных; прочитанное не сканируем повторно,
+                        # кроме незавершённого экранирования в самом конце
+                        tail = end
+                        while tail > pos and buffer[tail - 1] == '\\':
+                            tail -= 1
+                        pos = end - (end - tail) % 2
+                        break
+                    pos = match.end()
+                    self._in_string = False
+                    continue
+
+                if self._depth == 0:
+                    match = _OBJECT_START_RE.search(buffer, pos)
+                    if match is None:
+                        pos = end
+                        break
+                    start = match.start()
+                    if self.eager_decode:
+                        obj, pos = self._decode_or_skip(buffer, start)
+                        if obj is not None:
+                            yield start, pos, obj
+                        continue
+                    self._start = start
+                    self._depth = 1
+                    self._probed = 0
+                    pos = start + 1
+                    continue
+
+                match = _JSON_TOKEN_RE.search(buffer, pos)
+                if match is None:
+                    pos = end
+                    break
+                pos = match.end()
+                token = match.group()
+                if token == '"':
+                    self._in_string = True
+                elif token == '{':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        obj = self._decode(buffer, self._start, pos)
+                        if obj is not None:
+                            yield self._start, pos, obj
+
+            resume = self._abandon_pending(buffer, end) if self._depth > 0 else None
+            if resume is None:
+                break
+            # Кандидат не станет объектом — сканируем дальше с места ошибки
+            self._depth = 0
+            self._in_string = False
+            self._start = -1
+            pos = resume
+
+        self._pos = pos
+
+    def _decode(self, buffer: str, start: int, end: int) -> Optional[dict]:
+        try:
+            obj, obj_end = self._decoder.raw_decode(buffer, start)
+        except (json.JSONDecodeError, RecursionError):
+            return None
+        return obj if isinstance(obj, dict) and obj_end == end else None
+
+    def _decode_or_skip(self, buffer: str, start: int) -> Tuple[Optional[dict], int]:
+        """Объект с '{' в start и позиция после него; при ошибке — None и место, откуда искать дальше."""
+        try:
+            obj, obj_end = self._decoder.raw_decode(buffer, start)
+        except json.JSONDecodeError as e:
+            return None, max(e.pos, start + 1)
+        except RecursionError:
+            # Вложенность глубже лимита рекурсии: пропускаем кандидата целиком, иначе каждая вложенная '{'
+            # снова упрётся в лимит
+            return None, self._skip_balanced(buffer, start)
+        return (obj, obj_end) if isinstance(obj, dict) else (None, obj_end)
+
+    @staticmethod
+    def _skip_balanced(buffer: str, start: int) -> int:
+        """Позиция после '}', закрывающей '{' в start (с учётом строк), или конец текста."""
+        depth = 0
+        pos = start
+        end = len(buffer)
+        while pos < end:
+            match = _JSON_TOKEN_RE.search(buffer, pos)
+            if match is None:
+                break
+            pos = match.end()
+            token = match.group()
+            if token == '"':
+                tail = _JSON_STRING_TAIL_RE.match(buffer, pos)
+                if tail is None:
+                    break
+                pos = tail.end()
+            elif token == '{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+        return end
+
+    def _abandon_pending(self, buffer: str, end: int) -> Optional[int]:
+        """
+        Откуда продолжить, если незакрытый кандидат точно не объект или превысил max_pending_chars;
+        None — ждём данных. Проверка raw_decode повторяется при удвоении кандидата, так что в сумме линейна.
+        """
+        size = end - self._start
+        if size > self.max_pending_chars:
+            return self._start + 1
+        if size < 2 * self._probed:
+            return None
+        self._probed = size
+        try:
+            self._decoder.raw_decode(buffer, self._start)
+        except json.JSONDecodeError as e:
+            if e.msg.startswith("Unterminated string") or e.pos >= end - _INCOMPLETE_TAIL_CHARS:
+                return None
+            return max(e.pos, self._start + 1)
+        except RecursionError:
+            pass
+        return None
+
+    def _compact(self) -> None:
+        # Отбрасываем уже просканированный текст, чтобы буфер потока не рос
+        keep_from = self._start if self._depth > 0 else self._pos
+        if keep_from > 0:
+            self._buffer = self._buffer[keep_from:]
+            self._pos -= keep_from
+            self._start = 0 if self._depth > 0 else -1
+
+
+def iter_json_objects(text: str) -> Iterator[Tuple[int, int, dict]]:
+    """Все декодируемые JSON-объекты верхнего уровня в тексте: (start, end, obj). Один проход."""
+    locator = JSONObjectLocator(eager_decode=True)
+    locator._buffer = text
+    return locator._scan()
+
+
+def _fenced_json(text: str, pattern: "re.Pattern") -> Optional[dict]:
+    """Самый длинный разбираемый объект из код-блоков (как прежде: блоки сортируются по длине)."""
+    candidates = sorted((m.group(1).strip() for m in pattern.finditer(text)), key=len, reverse=True)
+    for candidate in candidates:
+        if candidate.startswith('{') and candidate.endswith('}'):
+            try:
+                obj = json.loads(candidate)
+            except (json.JSONDecodeError, RecursionError):
+                continue
+            if isinstance(obj, dict):
+                return obj
+    return None
+
+
 def extract_json(text: str) -> dict:
     if not text or not isinstance(text, str):
         return {}
     text = text.strip()
 
-    # Patterns to search for JSON, with code blocks first
-    patterns = [
-        r'```json\s*(.*?)\s*```',  # Code block with json
-        r'```\s*(.*?)\s*```',      # Generic code block
-        r'(\{.*\})'                 # Standalone JSON object
-    ]
-
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.DOTALL)
-        for match in matches:
-            # Try each match, starting with the longest (likely the most complete)
-            matches_sorted = sorted(matches, key=len, reverse=True)
-            for candidate in matches_sorted:
-                candidate = candidate.strip()
-                if candidate.startswith('{') and candidate.endswith('}'):
-                    try:
-                        return json.loads(candidate)
-                    except json.JSONDecodeError:
-                        continue
+    # Как и прежде, явный ```json блок важнее, затем любой код-блок с объектом
+    if '```' in text:
+        for pattern in (_JSON_FENCE_RE, _CODE_FENCE_RE):
+            fenced = _fenced_json(text, pattern)
+            if fenced is not None:
+                return fenced
+
+    # Иначе самый длинный валидный объект — как правило, полный ответ
+    best: Optional[dict] = None
+    best_length = -1
+    for start, end, obj in iter_json_objects(text):
+        if end - start > best_length:
+            best, best_length = obj, end - start
+    if best is not None:
+        return best
 
     # Fallback: try parsing the entire text as JSON
     try:
         return json.loads(text)
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, RecursionError):
         return {}